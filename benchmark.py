@@ -0,0 +1,327 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8 -*-
+
+"""Benchmark of save_webpage.py
+Generate a deterministic synthetic site, serve it from a local HTTP server and
+crawl it with save_webpage.py in every mode, reporting resources per second,
+wall time, CPU time and peak memory as JSON.
+
+Everything runs locally, no network access is needed.
+"""
+
+import os
+import sys
+import json
+import random
+import shutil
+import argparse
+import tempfile
+import threading
+import subprocess
+import time
+import BaseHTTPServer
+import SocketServer
+
+PATH_TO_SAVE_WEBPAGE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "save_webpage.py")
+
+MODES = ("relative", "absolute", "nochange")
+
+# Base url of the absolute mode
+MIRROR_URL = "http://mirror.example.com/"
+
+PAGE_TEMPLATE = u'''<!DOCTYPE html>
+<html>
+<head>
+<meta charset="utf-8">
+<title>Página %(number)d</title>
+%(stylesheets)s
+<script src="%(script)s"></script>
+<style>.banner { background: url(%(background)s) no-repeat; }</style>
+</head>
+<body>
+<h1>Página %(number)d — ñandú</h1>
+<div class="banner" style="background-image: url('%(banner)s')"></div>
+%(images)s
+<ul>
+%(links)s
+</ul>
+%(media)s
+<p>%(text)s</p>
+</body>
+</html>
+'''
+
+WORDS = u"lorem ipsum dolor sit amet consectetur adipiscing elit sed do eiusmod tempor incididunt ut labore et dolore magna aliqua".split()
+
+
+class Synthetic_Site(object):
+    '''Deterministic site of html pages, stylesheets, scripts, images, fonts
+    and large binaries, all of them reachable from /index.html.
+
+    files maps every path to its (content type, content) pair.
+    '''
+
+    def __init__(self, base_url, pages=100, links_per_page=10, images_per_page=5, stylesheets=5, binaries=2, binary_size=1024 * 1024, seed=0):
+        self.files = {}
+
+        rand = random.Random(seed)
+
+        page_paths = ["/index.html"] + ["/pages/page%d.html" % i for i in range(1, pages)]
+        stylesheet_paths = ["/css/style%d.css" % i for i in range(stylesheets)]
+        image_paths = ["/img/image%d.png" % i for i in range(max(images_per_page * 4, 1))]
+        font_paths = ["/fonts/font%d.woff2" % i for i in range(2)]
+        script_paths = ["/js/app%d.js" % i for i in range(2)]
+        binary_paths = ["/media/video%d.mp4" % i for i in range(binaries)]
+
+        for i, path in enumerate(page_paths):
+            # A chain through all the pages, so that all of them are reachable
+            linked_pages = [page_paths[(i + 1) % pages]] + [rand.choice(page_paths) for j in range(links_per_page - 1)]
+
+            links = []
+            for j, linked_page in enumerate(linked_pages):
+                # Absolute paths, relative urls and absolute urls
+                if j % 3 == 1:
+                    href = os.path.relpath(linked_page, os.path.dirname(path))
+                elif j % 3 == 2:
+                    href = base_url.rstrip("/") + linked_page
+                else:
+                    href = linked_page
+
+                links.append(u'<li><a href="%s">Página %d</a></li>' % (href, j))
+
+            images = []
+            for j in range(images_per_page):
+                image = rand.choice(image_paths)
+                image_2x = rand.choice(image_paths)
+                images.append(u'<img src="%s" srcset="%s 1x, %s 2x" alt="%s">' % (image, image, image_2x, rand.choice(WORDS)))
+
+            if binary_paths and i % 10 == 0:
+                media = u'<video src="%s"></video>' % binary_paths[(i // 10) % len(binary_paths)]
+            else:
+                media = u""
+
+            stylesheets_of_page = [u'<link rel="stylesheet" href="%s">' % rand.choice(stylesheet_paths) for j in range(2)] if stylesheet_paths else []
+
+            content = PAGE_TEMPLATE % {
+                "number": i,
+                "stylesheets": u"\n".join(stylesheets_of_page),
+                "script": rand.choice(script_paths),
+                "background": rand.choice(image_paths),
+                "banner": rand.choice(image_paths),
+                "images": u"\n".join(images),
+                "links": u"\n".join(links),
+                "media": media,
+                "text": u" ".join(rand.choice(WORDS) for j in range(200))
+            }
+
+            self.files[path] = ("text/html; charset=utf-8", content.encode("utf-8"))
+
+        for i, path in enumerate(stylesheet_paths):
+            rules = []
+
+            if i + 1 < len(stylesheet_paths):
+                rules.append('@import url("%s");' % stylesheet_paths[i + 1])
+
+            for font_path in font_paths:
+                rules.append('@font-face { font-family: "F%d"; src: url(%s) format("woff2"); }' % (i, font_path))
+
+            for j in range(20):
+                rules.append('.c%d-%d { color: #%06x; background: url(\'%s\'); }' % (i, j, rand.randint(0, 0xffffff), os.path.relpath(rand.choice(image_paths), "/css")))
+
+            self.files[path] = ("text/css", "\n".join(rules))
+
+        for path in script_paths:
+            self.files[path] = ("application/javascript", "var data = %s;\n" % json.dumps([rand.random() for j in range(200)]))
+
+        for path in image_paths + font_paths:
+            content_type = "image/png" if path.endswith(".png") else "font/woff2"
+            self.files[path] = (content_type, self._random_bytes(rand, rand.randint(500, 5000)))
+
+        for path in binary_paths:
+            self.files[path] = ("video/mp4", self._random_bytes(rand, binary_size))
+
+    @staticmethod
+    def _random_bytes(rand, size):
+        return "".join(chr(rand.getrandbits(8)) for i in range(min(size, 4096))) * (size // 4096) + "".join(chr(rand.getrandbits(8)) for i in range(size % 4096))
+
+    def size(self):
+        return sum(len(content) for content_type, content in self.files.values())
+
+
+class Synthetic_Site_Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+    # Keep-alive connections, like a real server
+    protocol_version = "HTTP/1.1"
+
+    # Send every response at once. With the default unbuffered output, each
+    # header is a packet and Nagle's algorithm delays the responses 40 ms
+    wbufsize = -1
+
+    def do_GET(self):
+        path = self.path.split("?", 1)[0]
+        if path == "/":
+            path = "/index.html"
+
+        if self.server.latency:
+            time.sleep(self.server.latency)
+
+        if path in self.server.site.files:
+            content_type, content = self.server.site.files[path]
+
+            self.send_response(200)
+            self.send_header("Content-Type", content_type)
+        else:
+            content = "Not found"
+
+            self.send_response(404)
+            self.send_header("Content-Type", "text/plain")
+
+        self.send_header("Content-Length", str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class Synthetic_Site_Server(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+    def __init__(self, latency=0):
+        BaseHTTPServer.HTTPServer.__init__(self, ("127.0.0.1", 0), Synthetic_Site_Handler)
+
+        self.site = None
+        self.latency = latency
+
+    @property
+    def url(self):
+        return "http://localhost:%d/" % self.server_address[1]
+
+
+def count_saved_files(output):
+    number_of_files = 0
+
+    for dirpath, dirnames, filenames in os.walk(output):
+        if dirpath == output:
+            dirnames[:] = [dirname for dirname in dirnames if not dirname.startswith(".save_webpage")]
+            filenames = [filename for filename in filenames if not filename.startswith(".save_webpage")]
+
+        number_of_files += len(filenames)
+
+    return number_of_files
+
+
+def run_crawl(url, mode, output, crawler_args=()):
+    '''Crawl url with save_webpage.py in a new process and return its
+    measures.'''
+
+    command = [sys.executable, PATH_TO_SAVE_WEBPAGE, url, "-o", output, "--follow-links", "--mode", mode]
+
+    if mode == "absolute":
+        command += ["-b", MIRROR_URL]
+
+    command += list(crawler_args)
+
+    with open(os.devnull, "wb") as devnull:
+        start = time.time()
+        process = subprocess.Popen(command, stdout=devnull, stderr=devnull)
+
+        # Resources used by this process only
+        pid, status, rusage = os.wait4(process.pid, 0)
+        wall_time = time.time() - start
+
+    if status != 0:
+        raise Exception("save_webpage.py failed in %s mode: %s" % (mode, " ".join(command)))
+
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    if sys.platform == "darwin":
+        peak_rss = rusage.ru_maxrss
+    else:
+        peak_rss = rusage.ru_maxrss * 1024
+
+    resources = count_saved_files(output)
+
+    return {
+        "mode": mode,
+        "resources": resources,
+        "wall_time": round(wall_time, 3),
+        "cpu_time": round(rusage.ru_utime + rusage.ru_stime, 3),
+        "resources_per_second": round(resources / wall_time, 1),
+        "peak_rss_bytes": peak_rss
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter, epilog="Extra options of save_webpage.py can be given after --, e.g.: benchmark.py --pages 500 -- -w 4 --html-rewriter stream")
+
+    parser.add_argument('--pages', action='store', type=int, default=100, help="Number of html pages")
+    parser.add_argument('--links-per-page', action='store', type=int, default=10, help="Number of links of every page")
+    parser.add_argument('--images-per-page', action='store', type=int, default=5, help="Number of images with srcset of every page")
+    parser.add_argument('--stylesheets', action='store', type=int, default=5, help="Number of stylesheets")
+    parser.add_argument('--binaries', action='store', type=int, default=2, help="Number of large binary files")
+    parser.add_argument('--binary-size', action='store', type=int, default=1024 * 1024, help="Size in bytes of every large binary file")
+    parser.add_argument('--seed', action='store', type=int, default=0, help="Seed of the generator of the site")
+    parser.add_argument('--latency', action='store', type=float, default=0, help="Latency of every response of the server, in milliseconds")
+    parser.add_argument('--modes', action='store', nargs='+', default=list(MODES), choices=MODES, help="Modes of save_webpage.py to benchmark")
+    parser.add_argument('--repeat', action='store', type=int, default=1, help="Number of crawls of every mode")
+    parser.add_argument('-o', '--output', action='store', help="Write the JSON report in this file instead of stdout")
+    parser.add_argument('crawler_args', nargs=argparse.REMAINDER, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    crawler_args = args.crawler_args
+    if crawler_args and crawler_args[0] == "--":
+        crawler_args = crawler_args[1:]
+
+    # The port of the server is part of the absolute urls of the site
+    server = Synthetic_Site_Server(latency=args.latency / 1000.0)
+
+    site = Synthetic_Site(server.url, pages=args.pages, links_per_page=args.links_per_page, images_per_page=args.images_per_page, stylesheets=args.stylesheets, binaries=args.binaries, binary_size=args.binary_size, seed=args.seed)
+    server.site = site
+
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+
+    directory = tempfile.mkdtemp(prefix="save_webpage_benchmark.")
+
+    runs = []
+
+    try:
+        for mode in args.modes:
+            for i in range(args.repeat):
+                output = os.path.join(directory, "%s%d" % (mode, i))
+
+                runs.append(run_crawl(server.url, mode, output, crawler_args))
+
+                shutil.rmtree(output)
+    finally:
+        server.shutdown()
+        server.server_close()
+        shutil.rmtree(directory)
+
+    report = {
+        "site": {
+            "pages": args.pages,
+            "links_per_page": args.links_per_page,
+            "images_per_page": args.images_per_page,
+            "stylesheets": args.stylesheets,
+            "binaries": args.binaries,
+            "binary_size": args.binary_size,
+            "seed": args.seed,
+            "latency_ms": args.latency,
+            "files": len(site.files),
+            "bytes": site.size()
+        },
+        "crawler_args": crawler_args,
+        "python": sys.version.split()[0],
+        "runs": runs
+    }
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+    else:
+        json.dump(report, sys.stdout, indent=2, sort_keys=True)
+        sys.stdout.write("\n")
+
+if __name__ == '__main__':
+    main()
@@ -16,14 +16,35 @@ import json
 import argparse
 import urltools
 import functools
+import itertools
 import logging
 import codecs
 import datetime
+import HTMLParser
+import hashlib
+import csv
+import collections
+import sqlite3
+import tempfile
+import shutil
+import zipfile
+import uuid
+import math
+import struct
+import bisect
+import time
+import email.utils
+import threading
+import Queue
 
 import chardet
-from bs4 import BeautifulSoup
-import requests
-import tldextract
+# bs4 and requests are slow to import, they are imported when they are used
+
+try:
+    import lxml
+    DEFAULT_HTML_PARSER = "lxml"
+except ImportError:
+    DEFAULT_HTML_PARSER = "html.parser"
 
 __all__ = ['Save_Webpage']
 
@@ -39,7 +60,7 @@ formatter = logging.Formatter('%(message)s')
 syslog = logging.StreamHandler()
 syslog.setFormatter(formatter)
 logger.addHandler(syslog)
-logger.setLevel(logging.DEBUG)
+logger.setLevel(logging.INFO)
 
 HTML_FILE = 0
 CSS_FILE = 1
@@ -51,10 +72,170 @@ JS_FILE = 6
 XML_FILE = 7
 OTHER_RESOURCE = 8
 
-CSS_URL_RE = re.compile('url\s*\((.+?)\)', re.I)
+RESOURCE_TYPE_NAMES = {
+    HTML_FILE: "html",
+    CSS_FILE: "css",
+    IMAGE_FILE: "image",
+    AUDIO_FILE: "audio",
+    VIDEO_FILE: "video",
+    FONT_FILE: "font",
+    JS_FILE: "js",
+    XML_FILE: "xml",
+    OTHER_RESOURCE: "other"
+}
+
+# Type of resource of every file extension
+EXTENSION_TYPES = {}
+
+for type_of_resource, extensions in (
+        (HTML_FILE, "html htm xhtml"),
+        (CSS_FILE, "css"),
+        (JS_FILE, "js mjs"),
+        (IMAGE_FILE, "png gif jpg jpeg svg cur ico webp avif bmp"),
+        (FONT_FILE, "ttf otf woff woff2 eot sfnt"),
+        (AUDIO_FILE, "mp3 oga wav flac m4a aac"),
+        (VIDEO_FILE, "mp4 m4v webm ogv mov avi mkv"),
+        (XML_FILE, "xml rss atom"),
+        (OTHER_RESOURCE, "pdf zip gz tgz bz2 xz tar 7z rar exe dmg iso apk json txt csv doc docx xls xlsx ppt pptx odt epub wasm swf")):
+    for extension in extensions.split():
+        EXTENSION_TYPES["." + extension] = type_of_resource
+
+# Type of resource of every media type
+CONTENT_TYPES = {
+    "text/html": HTML_FILE,
+    "application/xhtml+xml": HTML_FILE,
+    "text/css": CSS_FILE,
+    "text/javascript": JS_FILE,
+    "application/javascript": JS_FILE,
+    "application/x-javascript": JS_FILE,
+    "application/ecmascript": JS_FILE,
+    "text/xml": XML_FILE,
+    "application/xml": XML_FILE,
+    "application/rss+xml": XML_FILE,
+    "application/atom+xml": XML_FILE,
+    "application/vnd.ms-fontobject": FONT_FILE,
+    "application/font-woff": FONT_FILE,
+    "application/x-font-ttf": FONT_FILE,
+    "application/x-font-otf": FONT_FILE,
+    "application/json": OTHER_RESOURCE,
+    "application/pdf": OTHER_RESOURCE,
+    "application/zip": OTHER_RESOURCE,
+    "application/gzip": OTHER_RESOURCE,
+    "application/x-gzip": OTHER_RESOURCE,
+    "application/x-tar": OTHER_RESOURCE,
+    "application/x-7z-compressed": OTHER_RESOURCE,
+    "application/x-rar-compressed": OTHER_RESOURCE,
+    "application/wasm": OTHER_RESOURCE,
+    "application/x-shockwave-flash": OTHER_RESOURCE
+}
+
+CONTENT_TYPE_PREFIXES = (
+    ("image/", IMAGE_FILE),
+    ("audio/", AUDIO_FILE),
+    ("video/", VIDEO_FILE),
+    ("font/", FONT_FILE),
+    ("application/vnd.", OTHER_RESOURCE)
+)
+
+# Signatures at the beginning of binary files
+MAGIC_BYTES = (
+    (b"\x89PNG\r\n\x1a\n", IMAGE_FILE),
+    (b"GIF87a", IMAGE_FILE),
+    (b"GIF89a", IMAGE_FILE),
+    (b"\xff\xd8\xff", IMAGE_FILE),
+    (b"\x00\x00\x01\x00", IMAGE_FILE),
+    (b"wOFF", FONT_FILE),
+    (b"wOF2", FONT_FILE),
+    (b"\x00\x01\x00\x00\x00", FONT_FILE),
+    (b"OTTO\x00", FONT_FILE),
+    (b"ID3", AUDIO_FILE),
+    (b"OggS", AUDIO_FILE),
+    (b"fLaC", AUDIO_FILE),
+    (b"\x1a\x45\xdf\xa3", VIDEO_FILE),
+    (b"%PDF-", OTHER_RESOURCE),
+    (b"PK\x03\x04", OTHER_RESOURCE),
+    (b"\x1f\x8b", OTHER_RESOURCE),
+    (b"BZh", OTHER_RESOURCE),
+    (b"\xfd7zXZ\x00", OTHER_RESOURCE),
+    (b"7z\xbc\xaf\x27\x1c", OTHER_RESOURCE),
+    (b"Rar!\x1a\x07", OTHER_RESOURCE),
+    (b"\x7fELF", OTHER_RESOURCE),
+    (b"\x00asm", OTHER_RESOURCE),
+    (b"CWS", OTHER_RESOURCE),
+    (b"FWS", OTHER_RESOURCE)
+)
+
+# Formats inside a RIFF container and brands of ISO media files
+RIFF_TYPES = {b"WEBP": IMAGE_FILE, b"WAVE": AUDIO_FILE, b"AVI ": VIDEO_FILE}
+IMAGE_BRANDS = set([b"avif", b"avis", b"heic", b"heix", b"mif1"])
+
+# Bytes which never appear in text, from the sniffing algorithm of the WHATWG
+BINARY_DATA_RE = re.compile(b'[\x00-\x08\x0b\x0e-\x1a\x1c-\x1f]')
+
+# Number of bytes looked at to tell text from binary data
+SNIFF_SIZE = 1445
+
+# Tokens of a stylesheet: comments, strings, url(), @import and image-set()
+CSS_STRING = r'''"(?:[^"\\\n]|\\.)*"|'(?:[^'\\\n]|\\.)*\''''
+CSS_TOKEN_RE = re.compile(r'''/\*.*?(?:\*/|\Z)|(?P<string>%s)|(?<![\w-])url\(\s*(?:(?P<quoted>%s)|(?P<raw>(?:[^\s"'()\\]|\\.)*))\s*\)|(?P<import>@import)\b|(?<![\w-])(?P<image_set>(?:-webkit-)?image-set)\(''' % (CSS_STRING, CSS_STRING), re.I | re.S)
+CSS_PARENTHESES_RE = re.compile(r'''/\*.*?(?:\*/|\Z)|%s|[()]''' % CSS_STRING, re.S)
+CSS_ESCAPE_RE = re.compile(r'\\(?:([0-9a-fA-F]{1,6})\s?|(.))', re.S)
+CSS_RAW_URL_SPECIAL_CHARS_RE = re.compile(r'''[\s"'()\\]''')
+
+CSS_URL = collections.namedtuple('CSS_URL', ['type', 'url', 'start', 'end', 'quote'])
 
 CONFIDENCE_THRESOLD = 0.7
 
+# Number of bytes looked at by chardet and by the search of <meta charset>
+CHARDET_SAMPLE_SIZE = 64 * 1024
+HTML_PRESCAN_SIZE = 4096
+
+# utf-32 goes first because its little endian mark starts like the utf-16 one
+BOMS = (
+    (codecs.BOM_UTF8, "utf-8-sig"),
+    (codecs.BOM_UTF32_LE, "utf-32"),
+    (codecs.BOM_UTF32_BE, "utf-32"),
+    (codecs.BOM_UTF16_LE, "utf-16"),
+    (codecs.BOM_UTF16_BE, "utf-16")
+)
+
+# Tree builders of BeautifulSoup. html5lib parses exactly like a browser but it's
+# the slowest one. lxml is the fastest one and it extracts the same urls,
+# although it repairs broken markup in a different way. html.parser doesn't
+# require extra dependencies and keeps the markup closer to the original.
+HTML_PARSERS = ("lxml", "html.parser", "html5lib")
+
+# Engines rewriting urls in html pages. "dom" parses the page with one of
+# HTML_PARSERS and serializes the tree again. "stream" scans the markup and
+# only replaces the values of the rewritten attributes, keeping the rest of
+# the page byte for byte.
+HTML_REWRITERS = ("dom", "stream")
+
+# Formats of the output: a tree of files or a single archive
+OUTPUT_FORMATS = ("dir", "zip", "warc")
+
+# Orders of the crawl: depth first, breadth first, or by priority
+CRAWL_ORDERS = ("dfs", "bfs", "priority")
+
+# Rank of the types of resources in the priority order. Stylesheets are the
+# resources yielding more urls, large media files come last
+RESOURCE_PRIORITIES = dict((type_of_resource, rank) for rank, type_of_resource in enumerate([CSS_FILE, HTML_FILE, JS_FILE, FONT_FILE, IMAGE_FILE, XML_FILE, OTHER_RESOURCE, AUDIO_FILE, VIDEO_FILE]))
+
+# Indexes of the visited urls: an in-memory set, or a Bloom filter backed by
+# a file for crawls of millions of urls
+VISITED_INDEXES = ("set", "bloom")
+
+CHUNK_SIZE = 64 * 1024
+
+# Default number of keep-alive connections per host
+MAX_CONNECTIONS = 10
+
+# Responses of an overloaded host, downloaded again after waiting
+RETRY_STATUS_CODES = (429, 503)
+MAX_RETRIES = 3
+
+USER_AGENT = 'Mozilla/5.0 (compatible; MSIE 10.0; Windows NT 6.2; Win64; x64; Trident/6.0)'
+
 HTTP_CHARSET_RE = re.compile(r'''charset[ ]?=[ ]?["']?([a-z0-9_-]+)''', re.I)
 HTML5_CHARSET_RE = re.compile('<\s*meta[^>]+charset\s*=\s*["\']?([^>]*?)[ /;\'">]'.encode(), re.I)
 XHTML_ENCODING_RE = re.compile('^<\?.*encoding=[\'"](.*?)[\'"].*\?>'.encode(), re.I)
@@ -126,6 +307,14 @@ ATTRS_WITH_EXTERNAL_RESOURCES = {
     ("video", "src"): VIDEO_FILE
 }
 
+# Resources whose content is rewritten. The rest is streamed straight to disk.
+REWRITABLE_RESOURCES = set([HTML_FILE, CSS_FILE, JS_FILE])
+
+# Attributes with urls of each tag, with the type of resource they point to
+URL_ATTRS_BY_TAG = dict((tag_name, [(attribute_name, ATTRS_WITH_EXTERNAL_RESOURCES.get((tag_name, attribute_name), OTHER_RESOURCE)) for attribute_name in attrs])
+                        for tag_name, attrs in TAGS_ATTRS_WITH_URLS.items())
+
+
 
 def is_absolute_url(url):
     return bool(urlparse.urlparse(url).netloc)
@@ -184,6 +373,20 @@ def relurl_path(path_url1, path_url2):
     return "/".join(rel_list)
 
 
+def domain_of_url(url):
+    '''Return the registrable domain label of the url, without subdomain nor
+    public suffix. Hosts without a known public suffix are their own domain.'''
+
+    return domain_of_netloc(urlparse.urlparse(url).netloc)
+
+
+def domain_of_netloc(netloc):
+    username, password, host, port = urltools.split_netloc(netloc)
+    subdomain, domain, tld = urltools.split_host(host)
+
+    return domain or tld
+
+
 def is_subpath(path, parent):
     '''
     Returns True if *path* points to the same or a subpath of *parent*.
@@ -225,6 +428,15 @@ def normalize_codec_name(name):
         # TypeError occurs when name contains \x00 (ValueError in Py3.5)
         pass
 
+def is_utf8(data):
+    '''Return whether data is valid UTF-8.'''
+    try:
+        data.decode("utf-8", 'strict')
+    except UnicodeError:
+        return False
+    else:
+        return True
+
 def try_decoding(data, encoding):
     '''Return whether the Python codec could decode the data.'''
     try:
@@ -246,600 +458,3310 @@ def try_decoding(data, encoding):
         return True
 
 
-def detect_encoding_from_http_response(response, filetype=None, search_entire_document=True):
-    '''Return the likely encoding of the response document.
-
-    Args:
-        response (Response): An instance of :class:`.http.Response`.
-        is_html (bool): See :func:`.util.detect_encoding`.
-        peek (int): The maximum number of bytes of the document to be analyzed.
+def declared_encoding(content, content_type, filetype=None, search_entire_document=False):
+    '''Return the encoding declared by the document and the source of the
+    declaration, checking the cheapest and most authoritative sources first:
+    byte order mark, HTTP charset and <meta>, XML or @charset declarations
+    in the first bytes of the document.
 
     Returns:
-        ``str``, ``None``: The codec name.
+        (``str``, ``str``), (None, None)
     '''
 
-    content_type = response.headers.get('content-type', '')
+    for bom, encoding in BOMS:
+        if content.startswith(bom):
+            return encoding, "bom"
 
     # Parse a "Content-Type" string for the document encoding
     http_match = HTTP_CHARSET_RE.search(content_type)
 
     if http_match:
-        http_charset = http_match.group(1)
+        encoding = normalize_codec_name(http_match.group(1))
+
+        if encoding is not None and try_decoding(content, encoding):
+            return encoding, "http"
+
+    if search_entire_document:
+        xhtml_endpos = html_endpos = css_endpos = len(content)
     else:
-        http_charset = None
+        xhtml_endpos = css_endpos = 1024
+        html_endpos = HTML_PRESCAN_SIZE
 
-    content = response.content
+    encoding_match = None
 
     if filetype == HTML_FILE:
-        if search_entire_document:
-            xhtml_endpos = html_endpos = len(content)
-        else:
-            xhtml_endpos = 1024
-            html_endpos = max(2048, int(len(content) * 0.05))
+        encoding_match = XHTML_ENCODING_RE.search(content, 0, xhtml_endpos)
 
-        html_encoding = None
-        html_encoding_match = XHTML_ENCODING_RE.search(content, endpos=xhtml_endpos)
+        if not encoding_match:
+            encoding_match = HTML5_CHARSET_RE.search(content, 0, html_endpos)
 
-        if not html_encoding_match:
-            html_encoding_match = HTML5_CHARSET_RE.search(content, endpos=html_endpos)
-        if html_encoding_match is not None:
-            html_encoding = html_encoding_match.groups()[0].decode(
-                'ascii', 'replace')
+    elif filetype == CSS_FILE:
+        encoding_match = CSS_CHARSET_RE.search(content, 0, css_endpos)
 
-        if html_encoding is not None:
-            html_encoding = normalize_codec_name(html_encoding)
+    if encoding_match is not None:
+        encoding = normalize_codec_name(encoding_match.group(1).decode('ascii', 'replace'))
 
-            if try_decoding(content, html_encoding):
-                return html_encoding
-            else:
-                return None
+        if encoding is not None and try_decoding(content, encoding):
+            return encoding, "meta"
 
-    elif filetype == CSS_FILE:
-        css_encoding_match = CSS_CHARSET_RE.search(content)
-        if css_encoding_match:
-            encoding = css_encoding_match.group(1)
-            encoding = normalize_codec_name(encoding)
+    return None, None
 
-            if try_decoding(content, encoding):
-                return encoding
-            else:
-                return None
 
-    detected_encoding = chardet.detect(content)
+class Encoding_Detector(object):
+    '''Detect the encoding of downloaded documents.
 
-    if detected_encoding["confidence"] > CONFIDENCE_THRESOLD:
-        return detected_encoding["encoding"]
-    else:
-        logger.info('[ ENCODING NOT DETECTED ] encoding: %s, thresold: %s, url: %s' % (detected_encoding["encoding"], detected_encoding["confidence"], response.url))
+    When a document doesn't declare its encoding and it isn't valid UTF-8,
+    the encoding of the last document of the same host and content type is
+    tried before running the statistical detection, which only looks at a
+    sample of the document. A single byte codec decodes anything, so the
+    cache is never tried before UTF-8.
 
-    return http_charset
+    The attribute counters tells how many times each source decided the
+    encoding.
+    '''
 
+    SOURCES = ("bom", "http", "meta", "utf-8", "cache", "chardet", "fallback")
 
-def download_content(url):
-    headers = {
-        'User-Agent': 'Mozilla/5.0 (compatible; MSIE 10.0; Windows NT 6.2; Win64; x64; Trident/6.0)'
-    }
+    def __init__(self, sample_size=CHARDET_SAMPLE_SIZE):
+        self._sample_size = sample_size
+        self._cache = {}
+        self.counters = dict((source, 0) for source in self.SOURCES)
 
-    try:
-        response = requests.get(url, headers=headers, verify=False)
-        logger.info('[ GET ] %d - %s' % (response.status_code, response.url))
-        if response.status_code >= 400 or response.status_code < 200:
-            response = None
-        # elif response.headers.get('content-type', '').lower().startswith('text/'):
-        #     content = response.text
+    def detect(self, response, filetype=None, search_entire_document=False):
+        '''Return the likely encoding of the response document.
 
-    except Exception as ex:
-        logger.warning('[ DOWNLOAD ERROR ] %s - %s %s' % ('???', url, ex))
-        response = None
+        Args:
+            response (Response): The response of the download.
+            filetype (int): HTML_FILE or CSS_FILE to look for the declarations
+                of those documents.
+            search_entire_document (bool): Look for declarations in the whole
+                document instead of only in its first bytes.
 
-    return response
+        Returns:
+            ``str``, ``None``: The codec name.
+        '''
 
+        content = response.content
+        content_type = response.headers.get('content-type', '')
 
-def resource_type_using_extension(url):
-    url_path = urlparse.urlparse(url).path
-    url_path = url_path.lower()
+        encoding, source = declared_encoding(content, content_type, filetype, search_entire_document)
 
-    if url_path.endswith('.html') or url_path.endswith('.htm'):
-        return HTML_FILE
-    elif url_path.endswith('.js'):
-        return JS_FILE
-    elif url_path.endswith('.css'):
-        return CSS_FILE
-    elif url_path.endswith('.png'):
-        return IMAGE_FILE
-    elif url_path.endswith('.gif'):
-        return IMAGE_FILE
-    elif url_path.endswith('.jpg') or url_path.endswith('.jpeg'):
-        return IMAGE_FILE
-    elif url_path.endswith('.svg'):
-        return IMAGE_FILE
-    elif url_path.endswith('.cur'):
-        return IMAGE_FILE
-    elif url_path.endswith('.ico'):
-        return IMAGE_FILE
-    elif url_path.endswith('.ttf'):
-        return FONT_FILE
-    elif url_path.endswith('.otf'):
-        return FONT_FILE
-    elif url_path.endswith('.woff'):
-        return FONT_FILE
-    elif url_path.endswith('.woff2'):
-        return FONT_FILE
-    elif url_path.endswith('.eot'):
-        return FONT_FILE
-    elif url_path.endswith('.sfnt'):
-        return FONT_FILE
-    else:
-        return None
+        key = (urlparse.urlparse(response.url).netloc, content_type.split(';')[0].strip().lower())
 
+        if encoding is None:
+            encoding = self._cache.get(key)
 
-def process_urls_in_css_content(content, resource_handler, replace=True):
-    # Watch out! how to handle urls which contain parentheses inside? Oh god, css does not support such kind of urls
-    # I tested such url in css, and, unfortunately, the css rule is broken. LOL!
-    # I have to say that, CSS is awesome!
+            if is_utf8(content):
+                encoding, source = "utf-8", "utf-8"
+            elif encoding is not None and try_decoding(content, encoding):
+                source = "cache"
+            else:
+                encoding, source = self._detect_statistically(response)
+
+        # A byte order mark only tells the encoding of its own document
+        if source != "fallback" and source != "bom":
+            self._cache[key] = encoding
 
-    def replace(matchobj):
-        matched_data = matchobj.group(1)
-        src = matched_data.strip(' \'"')
+        self.counters[source] += 1
 
-        if src.startswith("data:"):
-            return matched_data
+        return encoding
 
-        # if src.lower().endswith('woff') or src.lower().endswith('ttf') or src.lower().endswith('otf') or src.lower().endswith('eot'):
-        #     # dont handle font data uri currently
-        #     return 'url(' + src + ')'
+    def _detect_statistically(self, response):
+        content = response.content
+        detected_encoding = chardet.detect(content[:self._sample_size])
 
-        type_of_resource = resource_type_using_extension(src)
+        if detected_encoding["confidence"] > CONFIDENCE_THRESOLD:
+            encoding = normalize_codec_name(detected_encoding["encoding"])
 
-        if type_of_resource == None:
-            logger.warn("Unknown resource "+ matched_data)
-            return 'url('+matched_data+')'
+            if encoding is not None and try_decoding(content, encoding):
+                return encoding, "chardet"
         else:
-            new_src = resource_handler(type_of_resource, src)
+            logger.info('[ ENCODING NOT DETECTED ] encoding: %s, thresold: %s, url: %s', detected_encoding["encoding"], detected_encoding["confidence"], response.url)
 
-            if new_src:
-                return 'url('+ new_src + ')'
-            else:
-                return 'url(' + matched_data + ')'
+        http_match = HTTP_CHARSET_RE.search(response.headers.get('content-type', ''))
 
-    content = CSS_URL_RE.sub(replace, content)
+        if http_match:
+            return http_match.group(1), "fallback"
+        else:
+            return detected_encoding["encoding"], "fallback"
 
-    return content
+    def report(self):
+        return ", ".join("%s: %d" % (source, self.counters[source]) for source in self.SOURCES)
 
 
-def process_urls_in_html_content(content, resource_handler, replace=True):
-    # now build the dom tree
-    soup = BeautifulSoup(content, "html5lib")
+def detect_encoding_from_http_response(response, filetype=None, search_entire_document=False):
+    '''Return the likely encoding of the response document.
 
-    for tag_name, attrs in TAGS_ATTRS_WITH_URLS.items():
-        list_of_tags = soup.find_all(tag_name)
+    See Encoding_Detector.detect().
+    '''
 
-        number_of_tags = len(list_of_tags)
-        if number_of_tags == 0: continue
+    return Encoding_Detector().detect(response, filetype, search_entire_document)
 
-        logger.info("\nProcessing %d %s's.."%(number_of_tags, tag_name))
 
-        if tag_name == "link":
-            for link in list_of_tags:
-                if not link.get('href'): continue
+def create_session(max_connections=MAX_CONNECTIONS):
+    '''Return a session sharing keep-alive connections between downloads.
 
-                href = link['href']
+    Args:
+        max_connections (int): The maximum number of connections kept open
+            per host.
+    '''
 
-                if (link.get('type') == 'text/css' or link['href'].lower().endswith('.css') or 'stylesheet' in (link.get('rel') or [])):
-                    href = resource_handler(CSS_FILE, href)
-                else:
-                    href = resource_handler(OTHER_RESOURCE, href)
+    import requests
 
-                if href:
-                    link['href'] = href
-        elif tag_name == "style":
-            for style in list_of_tags:
-                if style.string.strip():
-                    style.string = process_urls_in_css_content(style.string, resource_handler=resource_handler)
+    session = requests.Session()
+    session.headers['User-Agent'] = USER_AGENT
+    session.verify = False
 
-        else:
-            for tag in list_of_tags:
-                for attribute_name in attrs:
-                    if tag.has_attr(attribute_name):
+    adapter = requests.adapters.HTTPAdapter(pool_connections=max_connections, pool_maxsize=max_connections)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
 
-                        if (tag_name, attribute_name) in ATTRS_WITH_EXTERNAL_RESOURCES:
-                            type_of_resource = ATTRS_WITH_EXTERNAL_RESOURCES[tag_name, attribute_name]
-                        else:
-                            type_of_resource = OTHER_RESOURCE
+    return session
 
-                        # srcset is a fair bit different from most html
-                        # attributes, so it gets it's own processsing
-                        if attribute_name == 'srcset':
-                            srcset = tag[attribute_name]
 
-                            list_of_new_urls_and_descriptors = []
-                            is_srcset_modified = False
+def retry_after_seconds(value):
+    '''Return the seconds to wait according to a Retry-After header, which
+    is a number of seconds or a date, or None if it's not valid.'''
 
+    if value is None:
+        return None
 
-                            for url_and_descriptor in srcset.split(","):
-                                # remove the (optional) descriptor
-                                # https://developer.mozilla.org/en-US/docs/Web/HTML/Element/img#attr-srcset
-                                url_and_descriptor = url_and_descriptor.strip()
+    value = value.strip()
 
-                                match = re.search(r'\s+[\d\.]+[xw]\s*$', url_and_descriptor)
+    if value.isdigit():
+        return int(value)
 
-                                if match:
-                                    descriptor = match.group(0)
-                                    url = url_and_descriptor[:match.start()]
-                                else:
-                                    descriptor = ""
-                                    url = url_and_descriptor
+    date = email.utils.parsedate_tz(value)
+    if date is None:
+        return None
 
-                                new_url = resource_handler(type_of_resource, url)
-                                if new_url:
-                                    list_of_new_urls_and_descriptors.append(new_url + descriptor)
-                                    is_srcset_modified = True
-                                else:
-                                    list_of_new_urls_and_descriptors.append(url + descriptor)
+    return max(0, email.utils.mktime_tz(date) - time.time())
 
-                            if is_srcset_modified:
-                                tag["srcset"] = ",".join(list_of_new_urls_and_descriptors)
-                        else:
 
-                            url = tag[attribute_name]
-                            url = resource_handler(type_of_resource, url)
+class Host_State(object):
+    def __init__(self):
+        # Requests allowed in flight, grows by fractions
+        self.limit = 1.0
+        self.in_flight = 0
 
-                            if url:
-                                tag[attribute_name] = url
+        # No request is sent before this time
+        self.next_time = 0
 
-    for tag in soup(True):
-        if tag.has_attr('style'):
-            style = tag['style'].strip()
+        # Smoothed latency of the responses, in seconds
+        self.latency = None
+        self.decreased_at = 0
 
-            if style:
-                tag['style'] = process_urls_in_css_content(style, resource_handler=resource_handler)
+        self.consecutive_errors = 0
+        self.throttled = 0
 
-    return soup.decode(formatter="html")
 
+class Rate_Controller(object):
+    '''Limits the requests sent to every host.
 
-def empty_file(file_path):
-    dirname = os.path.dirname(file_path)
-    if not os.path.isdir(dirname):
-        os.makedirs(dirname)
+    For each host, it enforces a number of requests in flight, a minimum
+    interval between requests and the waits asked by Retry-After headers.
 
-    open(file_path, 'w').close()
+    The number of requests in flight adapts to the host (AIMD): it grows
+    additively, by one after as many successful responses as the current
+    limit, and it's halved when the host answers 429 or 503, fails, or takes
+    LATENCY_FACTOR times longer than usual to answer.
+    '''
 
+    LATENCY_FACTOR = 2.0
+    LATENCY_SMOOTHING = 0.2
 
-# TODO: Process form actions
-# TODO: Provide the possibility to use a custom handler for extra processing the content of internal resources
-class Save_Webpage(object):
-    RELATIVE_MODE = 0
-    ABSOLUTE_MODE = 1
-    NO_CHANGE_MODE = 2
+    # Waits after errors without Retry-After, doubled after every error
+    BACKOFF = 1.0
+    MAX_WAIT = 300
 
+    def __init__(self, max_in_flight=1, max_rate=None):
+        self._max_in_flight = max_in_flight
 
-    def __init__(self, list_of_seed_urls, forbidden_urls=None, follow_links=False, replacements=None, domain=None, output="output", base_url=None, mode=NO_CHANGE_MODE, index_html="index.html"):
-        if not list_of_seed_urls:
-            raise Exception("List of seed url's can't be empty")
+        if max_rate:
+            self._interval = 1.0 / max_rate
+        else:
+            self._interval = 0
 
-        self._list_of_seed_urls = list_of_seed_urls
+        self._hosts = collections.defaultdict(Host_State)
+        self._condition = threading.Condition()
 
-        self._broken_urls = set([])
+    def acquire(self, host):
+        '''Wait until a request can be sent to host.'''
 
-        self._queue = []
+        with self._condition:
+            state = self._hosts[host]
 
-        for url in list_of_seed_urls:
-            if not is_absolute_url(url):
-                raise Exception("Seed URL is not absolute: %s"%url)
+            while True:
+                now = time.time()
 
-            url = self._normalize_url(url)
-            path_to_resource_file = self._path_to_resource_file(url, output=output, index_html=index_html)
+                if state.in_flight >= int(state.limit):
+                    self._condition.wait()
+                elif now < state.next_time:
+                    self._condition.wait(state.next_time - now)
+                else:
+                    break
 
-            empty_file(path_to_resource_file)
+            state.in_flight += 1
+            state.next_time = now + self._interval
 
-            self._queue.append((HTML_FILE, url))
+    def release(self, host, status_code, latency=None, retry_after=None):
+        '''Record the outcome of a request to host. status_code is None when
+        the request failed.'''
 
+        with self._condition:
+            state = self._hosts[host]
+            state.in_flight -= 1
 
-        if domain is None:
-            url = list_of_seed_urls[0]
-            domain = tldextract.extract(url).domain
+            now = time.time()
 
-        self._domain = domain
+            if status_code is None or status_code in RETRY_STATUS_CODES or status_code >= 500:
+                state.consecutive_errors += 1
+                self._decrease(state, now)
 
-        if output is None:
-            url = list_of_seed_urls[0]
-            output = os.path.join(os.getcwd(), urlparse.urlparse(url).netloc)
-        else:
-            if not os.path.isabs(output):
-                output = os.path.join(os.getcwd(), output)
+                if status_code in RETRY_STATUS_CODES:
+                    state.throttled += 1
 
-        self._output = output
+                    wait = retry_after_seconds(retry_after)
+                    if wait is None:
+                        wait = self.BACKOFF * 2 ** (state.consecutive_errors - 1)
 
-        if forbidden_urls:
-            forbidden_urls = [normalize_url(url) for url in forbidden_urls]
+                    state.next_time = max(state.next_time, now + min(wait, self.MAX_WAIT))
+            else:
+                state.consecutive_errors = 0
 
-        self._forbidden_urls = forbidden_urls
-        self._follow_links = follow_links
+                if state.latency is not None and latency > self.LATENCY_FACTOR * state.latency:
+                    self._decrease(state, now)
+                else:
+                    state.limit = min(self._max_in_flight, state.limit + 1.0 / state.limit)
 
-        if mode != self.RELATIVE_MODE \
-            and mode != self.ABSOLUTE_MODE \
-            and mode != self.NO_CHANGE_MODE:
-            raise Exception("Invalid mode")
+                if state.latency is None:
+                    state.latency = latency
+                else:
+                    state.latency += self.LATENCY_SMOOTHING * (latency - state.latency)
 
-        self._mode = mode
+            self._condition.notify_all()
 
-        if base_url:
-            if not (base_url.startswith("http://") or base_url.startswith("https://")):
-                raise Exception("Base URL requires the protocol")
-        else:
-            if mode == self.ABSOLUTE_MODE:
-                raise Exception("Base URL is require to convert all url's to absolute")
+    def _decrease(self, state, now):
+        # Once per round trip: the responses of requests sent before the
+        # decrease don't count
+        if state.latency is not None and now - state.decreased_at < state.latency: return
 
-        self._base_url = base_url
-        self._index_html = index_html
-        self._replacements = replacements
+        state.limit = max(1.0, state.limit / 2)
+        state.decreased_at = now
 
-    def _is_absolute_url_in_same_domain(self, url):
-        return self._domain == tldextract.extract(url).domain
+    def report(self):
+        with self._condition:
+            return ", ".join(["%s: %d in flight, %d throttled" % (host, int(state.limit), state.throttled) for host, state in sorted(self._hosts.items())])
 
-    def _is_external_resource(self, url):
-        if is_absolute_url(url) and not self._is_absolute_url_in_same_domain(url):
-            return True
-        else:
-            return False
 
+def download_content(url, session=None, stream_to=None, headers=None, discard_body=False, rate_controller=None, type_of_resource=None, memory_governor=None):
+    '''Download url and return the response, or None if it's broken.
 
-    @staticmethod
-    def _normalize_url(url):
-        if url.startswith("//"):
-            url = "http:" + url
+    If stream_to is a directory, the body is written in chunks to a temporary
+    file inside it instead of being held in memory. The path of that file and
+    the SHA-1 of the body are stored in the attributes temporary_file and
+    content_hash of the response.
 
-        parsed_url = urlparse.urlparse(url)
+    If discard_body is True, only the headers are read.
 
-        url_path = parsed_url.path
-        url_path = urllib.quote(url_path, safe="%/:=&?~#+!$,;'@()*[]")
+    If type_of_resource is the type expected from the link, the type of the
+    response is checked with classify_response() before reading the body, and
+    stored in its attribute type_of_resource. Html, css and js files are read
+    in memory, and the rest is streamed to stream_to or discarded.
 
-        url = urlparse.urlunparse((parsed_url.scheme, parsed_url.netloc, url_path, "", "", ""))
-        url = urltools.normalize(url)
+    If a rate_controller is given, the request waits for its turn to the host
+    and responses 429 and 503 are retried up to MAX_RETRIES times.
 
-        return url
+    The size of a body read in memory is added to the memory_governor while
+    it's read, and stored in the attribute memory_bytes of the response. The
+    caller releases it.
+    '''
 
-    @staticmethod
-    def _path_to_resource_file(url, output, index_html):
-        parsed_url = urlparse.urlparse(url)
-        url_path = parsed_url.path
-        url_path = url_path.lstrip("/")
+    if session is None:
+        session = create_session()
 
-        if url_path == "":
-            url_path = index_html
-        else:
-            if url_path.endswith("/"):
-                url_path += index_html
+    host = urlparse.urlparse(url).netloc
 
-        relative_path_to_resource_file = urllib.url2pathname(url_path)
-        path_to_resource_file = os.path.join(output, relative_path_to_resource_file)
+    sniff = type_of_resource in REWRITABLE_RESOURCES
 
-        return path_to_resource_file
+    for attempt in range(MAX_RETRIES + 1):
+        if rate_controller is not None:
+            rate_controller.acquire(host)
 
-    def _replace_content(self, current_url, content):
-        if not self._replacements: return content
+        status_code = latency = retry_after = None
 
-        url_path = urlparse.urlparse(current_url).path
+        try:
+            response = session.get(url, stream=stream_to is not None or discard_body or sniff, headers=headers)
+            logger.info('[ GET ] %d - %s', response.status_code, response.url)
 
-        for pattern_url_path, list_of_replacement_objs in self._replacements:
-            is_url_matched = re.match(pattern_url_path, url_path)
-            if is_url_matched:
-                for replacement_obj in list_of_replacement_objs:
-                    if callable(replacement_obj):
-                        content = replacement_obj(content)
-                    else:
-                        pattern_text, substitution = replacement_obj
-                        content = re.sub(pattern_text, substitution, content)
-                break
+            status_code = response.status_code
+            latency = response.elapsed.total_seconds()
+            retry_after = response.headers.get('Retry-After')
 
-        return content
+            if response.status_code >= 400 or response.status_code < 200:
+                response.close()
+                response = None
+            # elif response.headers.get('content-type', '').lower().startswith('text/'):
+            #     content = response.text
 
-    def _on_extracted_url(self, type_of_resource, url, base_url):
-        if type_of_resource == HTML_FILE and not self._follow_links: return
+            elif response.status_code == 304:
+                response.type_of_resource = type_of_resource
+                response.close()
 
-        original_url = url
+            else:
+                chunks = response.iter_content(CHUNK_SIZE)
 
-        if base_url is not None:
-            url = absurl(base_url, url)
+                if sniff:
+                    first_chunk = next(chunks, b"")
+                    chunks = itertools.chain([first_chunk], chunks)
 
-        url = self._normalize_url(url)
+                    response.type_of_resource = classify_response(type_of_resource, response.headers.get('content-type', ''), first_chunk)
+                else:
+                    response.type_of_resource = type_of_resource
 
-        if self._is_external_resource(url): return
-        if self._forbidden_urls and url in self._forbidden_urls: return
+                if sniff and response.type_of_resource in REWRITABLE_RESOURCES:
+                    response._content = read_in_memory(chunks, memory_governor)
+                    response._content_consumed = True
 
-        if url in self._broken_urls:
-            logger.info('[ BROKEN URL ] - %s' % url)
-            return
+                    if memory_governor is not None:
+                        response.memory_bytes = len(response._content)
 
+                elif discard_body:
+                    response.close()
 
-        path_to_resource_file = self._path_to_resource_file(url, output=self._output, index_html=self._index_html)
+                elif stream_to is not None:
+                    response.temporary_file, response.content_hash = write_to_temporary_file(chunks, stream_to)
 
-        if os.path.isfile(path_to_resource_file):
-            logger.info('[ CACHE HIT ] - %s' % url)
-            return
+        except Exception as ex:
+            logger.warning('[ DOWNLOAD ERROR ] %s - %s %s', '???', url, ex)
+            response = None
 
-        empty_file(path_to_resource_file)
+        finally:
+            if rate_controller is not None:
+                rate_controller.release(host, status_code, latency, retry_after)
 
-        self._queue.append((type_of_resource, url))
+        if rate_controller is None or status_code not in RETRY_STATUS_CODES or attempt == MAX_RETRIES: break
 
-        if self._mode == self.ABSOLUTE_MODE:
-            if is_absolute_url2(original_url):
-                parsed_original_url = urlparse.urlparse(original_url)
+        logger.info('[ RETRY ] %d - %s', status_code, url)
 
-                url = urlparse.urljoin(self._base_url,
-                                       urlparse.urlunparse((
-                                                           "",
-                                                           "",
-                                                           parsed_original_url.path,
-                                                           parsed_original_url.params,
-                                                           parsed_original_url.query,
-                                                           parsed_original_url.fragment))
-                                      )
-            else:
-                url = urlparse.urljoin(self._base_url, original_url)
+    return response
 
-        elif self._mode == self.RELATIVE_MODE:
-            if is_absolute_url2(original_url):
-                parsed_original_url = urlparse.urlparse(original_url)
 
-                url_path = relurl_path(urlparse.urlparse(base_url).path, parsed_original_url.path)
-                url = urlparse.urlunparse((
-                                   "",
-                                   "",
-                                   url_path,
-                                   parsed_original_url.params,
-                                   parsed_original_url.query,
-                                   parsed_original_url.fragment))
+def read_in_memory(chunks, memory_governor=None):
+    '''Join chunks, adding their size to memory_governor as they are read.'''
 
-                if url[0] == "/": url = url[1:]
-            else:
-                url = original_url
-        else:
-            return
+    if memory_governor is None:
+        return b"".join(chunks)
 
-        return url
+    parts = []
+    size = 0
 
+    try:
+        for chunk in chunks:
+            memory_governor.add(len(chunk))
+            size += len(chunk)
 
-    def run(self):
-        if os.path.exists(self._output):
-            if not os.path.isdir(self._output):
-                raise Exception("It's not possible to save webpage in 'output' directory")
-        else:
-            os.makedirs(self._output)
+            parts.append(chunk)
+    except:
+        memory_governor.release(size)
+        raise
 
-        i = 0
+    return b"".join(parts)
 
-        while len(self._queue) != 0:
-            type_of_resource, url = self._queue.pop()
 
-            path_to_resource_file = self._path_to_resource_file(url, output=self._output, index_html=self._index_html)
+def write_to_temporary_file(chunks, directory):
+    '''Write chunks to a new temporary file and return its path and SHA-1.'''
 
-            response = download_content(url)
+    fd, temporary_file = tempfile.mkstemp(prefix='.', suffix='.part', dir=directory)
+    content_hash = hashlib.sha1()
 
-            if response is None:
-                logger.info('[ BROKEN URL ] - %s' % url)
-                self._broken_urls.add(url)
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            for chunk in chunks:
+                content_hash.update(chunk)
+                f.write(chunk)
+    except:
+        os.remove(temporary_file)
+        raise
 
-                if os.path.isfile(path_to_resource_file):
-                    os.remove(path_to_resource_file)
+    return temporary_file, content_hash.hexdigest()
 
-                continue
 
-            content = response.content
+def release_response(response, memory_governor=None):
+    '''Remove the temporary file of a downloaded response, unless it was
+    already moved, and release its bytes in memory_governor.'''
 
-            if type_of_resource == HTML_FILE:
-                soup = BeautifulSoup(content, "html5lib")
-                html_base = soup.find("base", href=True)
+    temporary_file = getattr(response, "temporary_file", None)
+    if temporary_file is not None and os.path.isfile(temporary_file):
+        os.remove(temporary_file)
 
-                if html_base:
-                    base_url = html_base["href"]
-                    if not is_absolute_url2(base_url):
-                        base_url = urlparse.urljoin(url, base_url)
-                else:
-                    base_url = url
+    if memory_governor is not None and hasattr(response, "memory_bytes"):
+        memory_governor.release(response.memory_bytes)
+        del response.memory_bytes
 
-                resource_handler = functools.partial(self._on_extracted_url, base_url=base_url)
 
-                encoding = detect_encoding_from_http_response(response, filetype=HTML_FILE)
+def replace_file(source, destination):
+    try:
+        os.rename(source, destination)
+    except OSError:
+        # Windows doesn't allow to rename over an existing file
+        os.remove(destination)
+        os.rename(source, destination)
+
+
+class Mirror_Database(object):
+    '''SQLite database kept inside the output directory.
+
+    It stores two tables:
+        resources: HTTP validators, content hash and extracted links of every
+            downloaded url, so that a later crawl can revalidate the mirror
+            using conditional requests and, when nothing changed, follow the
+            links without parsing again.
+        frontier: a journal with the state of every url of the current crawl,
+            so that a crawl which was killed can be resumed.
+
+    Changes are committed in batches. Each commit is atomic, so after a crash
+    the journal is always a consistent prefix of the crawl.
+    '''
 
-                content = content.decode(encoding, 'strict')
+    FILENAME = '.save_webpage.db'
+    COMMIT_INTERVAL = 100
+
+    QUEUED = 'queued'
+    IN_FLIGHT = 'in-flight'
+    DONE = 'done'
+    BROKEN = 'broken'
+
+    def __init__(self, path):
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._lock = threading.Lock()
+        self._pending_changes = 0
+
+        with self._lock:
+            self._connection.execute('''CREATE TABLE IF NOT EXISTS resources (
+                                        url TEXT PRIMARY KEY,
+                                        etag TEXT,
+                                        last_modified TEXT,
+                                        content_length INTEGER,
+                                        content_hash TEXT,
+                                        links TEXT)''')
+            self._connection.execute('''CREATE TABLE IF NOT EXISTS frontier (
+                                        position INTEGER PRIMARY KEY,
+                                        url TEXT UNIQUE,
+                                        type_of_resource INTEGER,
+                                        depth INTEGER NOT NULL DEFAULT 0,
+                                        state TEXT)''')
+
+            try:
+                # Journal written by a previous version
+                self._connection.execute('ALTER TABLE frontier ADD COLUMN depth INTEGER NOT NULL DEFAULT 0')
+            except sqlite3.OperationalError:
+                pass
+
+            self._connection.commit()
+
+    def get(self, url):
+        with self._lock:
+            row = self._connection.execute('SELECT etag, last_modified, content_length, content_hash, links FROM resources WHERE url = ?', (url,)).fetchone()
+
+        if row is None:
+            return None
+
+        etag, last_modified, content_length, content_hash, links = row
+
+        return {
+            "etag": etag,
+            "last_modified": last_modified,
+            "content_length": content_length,
+            "content_hash": content_hash,
+            "links": [tuple(link) for link in json.loads(links)]
+        }
+
+    def conditional_headers(self, url):
+        record = self.get(url)
+        if record is None: return None
+
+        headers = {}
+        if record["etag"]:
+            headers["If-None-Match"] = record["etag"]
+
+        if record["last_modified"]:
+            headers["If-Modified-Since"] = record["last_modified"]
+
+        return headers or None
+
+    def put(self, url, response, content_hash, links=()):
+        content_length = response.headers.get('content-length')
+        if content_length is not None:
+            content_length = int(content_length)
+
+        with self._lock:
+            self._connection.execute('INSERT OR REPLACE INTO resources VALUES (?, ?, ?, ?, ?, ?)', (
+                                        url,
+                                        response.headers.get('etag'),
+                                        response.headers.get('last-modified'),
+                                        content_length,
+                                        content_hash,
+                                        json.dumps(list(links))))
+            self._changed()
+
+    def has_frontier(self):
+        with self._lock:
+            return self._connection.execute('SELECT 1 FROM frontier LIMIT 1').fetchone() is not None
+
+    def clear_frontier(self):
+        with self._lock:
+            self._connection.execute('DELETE FROM frontier')
+            self._connection.commit()
+
+    def load_frontier(self):
+        '''Return the queue, the set of queued urls, the set of broken urls and
+        the number of queued pages of the journaled crawl.
+
+        Urls which were in flight are queued again.
+        '''
+
+        queue = []
+        queued_urls = set([])
+        broken_urls = set([])
+        queued_pages = 0
+
+        with self._lock:
+            rows = self._connection.execute('SELECT type_of_resource, url, depth, state FROM frontier ORDER BY position').fetchall()
+
+        for type_of_resource, url, depth, state in rows:
+            queued_urls.add(url)
 
-                if self._mode == self.NO_CHANGE_MODE:
-                    process_urls_in_html_content(content, resource_handler)
-                else:
-                    content = process_urls_in_html_content(content, resource_handler)
+            if type_of_resource == HTML_FILE:
+                queued_pages += 1
 
-                content = self._replace_content(url, content)
+            if state == self.BROKEN:
+                broken_urls.add(url)
+            elif state != self.DONE:
+                queue.append((type_of_resource, url, depth))
 
-                content = content.encode("utf-8")
+        return queue, queued_urls, broken_urls, queued_pages
 
-            elif type_of_resource == CSS_FILE:
-                resource_handler = functools.partial(self._on_extracted_url, base_url=url)
+    def queue(self, type_of_resource, url, depth=0):
+        with self._lock:
+            self._connection.execute('INSERT OR REPLACE INTO frontier (url, type_of_resource, depth, state) VALUES (?, ?, ?, ?)', (url, type_of_resource, depth, self.QUEUED))
+            self._changed()
 
-                encoding = detect_encoding_from_http_response(response, filetype=CSS_FILE)
+    def set_state(self, url, state):
+        with self._lock:
+            self._connection.execute('UPDATE frontier SET state = ? WHERE url = ?', (state, url))
+            self._changed()
 
-                content = content.decode(encoding, 'strict')
+    def _changed(self):
+        self._pending_changes += 1
 
-                if self._mode == self.NO_CHANGE_MODE:
-                    content = process_urls_in_css_content(content, resource_handler)
-                else:
-                    process_urls_in_css_content(content, resource_handler)
+        if self._pending_changes >= self.COMMIT_INTERVAL:
+            self._connection.commit()
+            self._pending_changes = 0
 
-                content = self._replace_content(url, content)
-                content = content.encode(encoding)
+    def commit(self):
+        with self._lock:
+            self._connection.commit()
+            self._pending_changes = 0
 
-            elif type_of_resource == JS_FILE:
-                content = self._replace_content(url, content)
+    def close(self):
+        with self._lock:
+            self._connection.commit()
+            self._connection.close()
 
-            with open(path_to_resource_file, "w") as f:
-                f.write(content)
 
+class Blob_Store(object):
+    '''Content addressed storage inside the output directory.
 
-def main():
-    parser = argparse.ArgumentParser(description=__doc__, epilog="""save_webpage.py:
-    Takes a list of url's and download the websites with all its internal resource files.
-    Transforms all internal resources so that they link to local files.
-    Process css files exctracting new resource and converting url's.
-    Possibility to replace javascript and html files using custom substitutions.
-    Full Unicode/UTF-8 support.""")
+    Every distinct content is written once, as a blob named after its SHA-1,
+    and the files of the mirror are hardlinks to the blobs. When hardlinks are
+    not possible, the blob is copied.
 
-    parser.add_argument("list_of_seed_urls", nargs='+', help="Seed urls")
-    parser.add_argument('-o', '--output', default="output", action='store', help="Output directory")
-    parser.add_argument('--version', action='version', version=__version__)
-    parser.add_argument('-q', '--quite', action='store_true', default=False, help="don't show verbose url get log in stderr")
-    parser.add_argument('--insecure', action='store_true', default=False, help="Ignore the certificate")
-    parser.add_argument("--forbidden-urls", nargs='+', help="Forbidden urls")
-    parser.add_argument('--follow-links', action='store_true', default=False, help="Follow links")
-    parser.add_argument('-b', '--base-url', action='store', help="Resolves relative links using URL as the point of reference")
-    parser.add_argument('--index-html', action='store', default="index.html", help="Default index file")
-    parser.add_argument('--mode', action='store',  default="relative", choices=["relative", "absolute", "nochange"], help="Mode of extraction")
-    parser.add_argument('--config', action='store', dest="path_to_config_file", help="Path to configuration file")
-    args = parser.parse_args()
+    Files are always replaced with a rename, never written in place, because
+    they share their inode with the other files having the same content.
+    '''
 
+    DIRNAME = '.save_webpage.blobs'
 
-    list_of_seed_urls  = args.list_of_seed_urls
-    output = args.output
-    base_url = args.base_url
-    follow_links = args.follow_links
-    forbidden_urls = args.forbidden_urls
-    mode = args.mode
-    index_html = args.index_html
+    def __init__(self, path):
+        self._path = path
 
-    if mode == "relative":
-        mode = Save_Webpage.RELATIVE_MODE
-    elif mode == "absolute":
-        mode = Save_Webpage.ABSOLUTE_MODE
-    else:
-        mode = Save_Webpage.NO_CHANGE_MODE
+        self.files = 0
+        self.bytes_saved = 0
 
-    replacements = None
+    def _blob_path(self, content_hash):
+        return os.path.join(self._path, content_hash[:2], content_hash)
 
-    if args.path_to_config_file:
-        config = json.parse(args.path_to_config_file)
-        if "base_url" in config:
-            base_url = config["base_url"]
+    def add_file(self, path, temporary_file, content_hash):
+        '''Save at path the content of temporary_file, whose SHA-1 is
+        content_hash. The temporary file is consumed.'''
 
-        if "follow_links" in config:
-            follow_links = config["follow_links"]
+        blob = self._blob_path(content_hash)
 
-        if "forbidden_urls" in config:
-            forbidden_urls = config["forbidden_urls"]
+        if os.path.isfile(blob):
+            self.bytes_saved += os.path.getsize(temporary_file)
+            os.remove(temporary_file)
+        else:
+            make_directory(os.path.dirname(blob))
+            replace_file(temporary_file, blob)
 
-        if "replacements" in config:
-            replacements = config["replacements"]
+        self._link(blob, path)
 
-        if "output" in config:
-            output = config["output"]
+    def add_content(self, path, content):
+        '''Save content at path.'''
 
-        if "list_of_seed_urls" in config:
-            list_of_seed_urls = config["list_of_seed_urls"]
+        blob = self._blob_path(hashlib.sha1(content).hexdigest())
 
-        if "index_html" in config:
+        if os.path.isfile(blob):
+            self.bytes_saved += len(content)
+        else:
+            make_directory(os.path.dirname(blob))
+
+            temporary_file, content_hash = write_to_temporary_file([content], os.path.dirname(blob))
+            replace_file(temporary_file, blob)
+
+        self._link(blob, path)
+
+    def _link(self, blob, path):
+        self.files += 1
+
+        if os.path.isfile(path) and os.path.samefile(blob, path): return
+
+        fd, temporary_file = tempfile.mkstemp(prefix='.', suffix='.part', dir=os.path.dirname(path))
+        os.close(fd)
+        os.remove(temporary_file)
+
+        try:
+            os.link(blob, temporary_file)
+        except (AttributeError, OSError):
+            # No hardlinks on this platform or filesystem, or too many links to the blob
+            shutil.copyfile(blob, temporary_file)
+
+        replace_file(temporary_file, path)
+
+    def collect_garbage(self):
+        '''Remove the blobs that are not linked by any file anymore. Returns
+        the number of blobs kept.'''
+
+        blobs = 0
+
+        if not os.path.isdir(self._path):
+            return blobs
+
+        for dirname in os.listdir(self._path):
+            dirname = os.path.join(self._path, dirname)
+
+            for blob in os.listdir(dirname):
+                blob = os.path.join(dirname, blob)
+
+                if os.stat(blob).st_nlink == 1:
+                    os.remove(blob)
+                else:
+                    blobs += 1
+
+        return blobs
+
+
+class Zip_Archive(object):
+    '''Zip file with the saved files, using the same paths than in the output
+    directory. The central directory of the zip file is its index.'''
+
+    EXTENSION = '.zip'
+
+    # Content types of the resources worth compressing. Images, videos,
+    # fonts and most other binary files are already compressed
+    COMPRESSIBLE_CONTENT_TYPE_RE = re.compile(r'^\s*(?:text/|[^;]*[/+](?:xml|json)\b|application/(?:(?:x-)?javascript|ecmascript|x-font-ttf|vnd\.ms-fontobject)\b|font/(?:ttf|otf)\b)', re.I)
+
+    def __init__(self, path):
+        self._zip_file = zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED, allowZip64=True)
+
+    def add_file(self, name, url, source_file, content_type):
+        if self.COMPRESSIBLE_CONTENT_TYPE_RE.match(content_type):
+            compress_type = zipfile.ZIP_DEFLATED
+        else:
+            compress_type = zipfile.ZIP_STORED
+
+        self._zip_file.write(source_file, name, compress_type)
+
+    def add_content(self, name, url, content, content_type):
+        self._zip_file.writestr(name, content, zipfile.ZIP_DEFLATED)
+
+    def close(self):
+        self._zip_file.close()
+
+
+class WARC_Archive(object):
+    '''WARC file with a resource record for every saved file.
+
+    Records are appended sequentially. The index, a CSV file with the url,
+    path, offset and length of every record, is written next to the archive.
+    '''
+
+    EXTENSION = '.warc'
+    INDEX_EXTENSION = '.idx'
+
+    def __init__(self, path):
+        self._file = open(path, 'wb')
+        self._index_file = open(path + self.INDEX_EXTENSION, 'wb')
+        self._index = csv.writer(self._index_file)
+        self._index.writerow(["url", "path", "offset", "length"])
+
+        info = "software: save_webpage.py/%s\r\nformat: WARC File Format 1.0\r\n" % __version__
+        self._write_record("warcinfo", None, "application/warc-fields", len(info), [info])
+
+    def _write_record(self, warc_type, url, content_type, length, chunks):
+        headers = ["WARC/1.0",
+                   "WARC-Type: %s" % warc_type,
+                   "WARC-Record-ID: <urn:uuid:%s>" % uuid.uuid4(),
+                   "WARC-Date: %s" % datetime.datetime.utcnow().strftime("%Y-%m-%dT%H:%M:%SZ")]
+
+        if url is not None:
+            headers.append("WARC-Target-URI: %s" % url)
+
+        headers.append("Content-Type: %s" % content_type)
+        headers.append("Content-Length: %d" % length)
+
+        offset = self._file.tell()
+
+        self._file.write("\r\n".join(headers) + "\r\n\r\n")
+        for chunk in chunks:
+            self._file.write(chunk)
+        self._file.write("\r\n\r\n")
+
+        return offset
+
+    def add_file(self, name, url, source_file, content_type):
+        with open(source_file, 'rb') as f:
+            offset = self._write_record("resource", url, content_type, os.path.getsize(source_file), iter(functools.partial(f.read, CHUNK_SIZE), ''))
+
+        self._index.writerow([url, name, offset, self._file.tell() - offset])
+
+    def add_content(self, name, url, content, content_type):
+        offset = self._write_record("resource", url, content_type, len(content), [content])
+        self._index.writerow([url, name, offset, self._file.tell() - offset])
+
+    def close(self):
+        self._file.close()
+        self._index_file.close()
+
+
+ARCHIVE_CLASSES = {"zip": Zip_Archive, "warc": WARC_Archive}
+
+
+def compact_key(key):
+    if isinstance(key, unicode):
+        return key.encode('utf-8')
+
+    return key
+
+
+class Visited_Index(object):
+    '''Set of the urls or paths already seen by the crawl.
+
+    Keys are stored as UTF-8 byte strings, which take up to four times less
+    memory than unicode strings.
+    '''
+
+    def __init__(self, path=None):
+        self._keys = set([])
+
+    def add(self, key):
+        self._keys.add(compact_key(key))
+
+    def discard(self, key):
+        self._keys.discard(compact_key(key))
+
+    def __contains__(self, key):
+        return compact_key(key) in self._keys
+
+    def __len__(self):
+        return len(self._keys)
+
+    def memory_usage(self):
+        return sys.getsizeof(self._keys) + sum(sys.getsizeof(key) for key in self._keys)
+
+    def close(self):
+        pass
+
+
+class Bloom_Visited_Index(object):
+    '''Visited index for crawls of millions of urls.
+
+    A Bloom filter answers without any I/O the lookups of most keys not in
+    the index. The keys are spilled to a SQLite database at path, or in a
+    temporary file, which confirms the hits of the filter, so the index is
+    exact. The database is deleted when the index is closed.
+    '''
+
+    CAPACITY = 10 * 1000 * 1000
+    FALSE_POSITIVE_RATE = 0.01
+
+    def __init__(self, path=None):
+        self._size = int(-self.CAPACITY * math.log(self.FALSE_POSITIVE_RATE) / math.log(2) ** 2)
+        self._number_of_hashes = int(round(self._size * math.log(2) / self.CAPACITY))
+        self._bits = bytearray((self._size + 7) // 8)
+        self._length = 0
+
+        if path is None:
+            fd, path = tempfile.mkstemp(prefix='.save_webpage.', suffix='.visited')
+            os.close(fd)
+
+        # Left by a crawl which was killed
+        if os.path.exists(path):
+            os.remove(path)
+
+        self._path = path
+
+        self._connection = sqlite3.connect(self._path)
+        self._connection.text_factory = str
+        self._connection.execute('PRAGMA journal_mode = OFF')
+        self._connection.execute('PRAGMA synchronous = OFF')
+        self._connection.execute('CREATE TABLE keys (key TEXT PRIMARY KEY) WITHOUT ROWID')
+
+    def _positions(self, key):
+        h1, h2 = struct.unpack('<QQ', hashlib.md5(key).digest())
+        return [(h1 + i * h2) % self._size for i in range(self._number_of_hashes)]
+
+    def _contains(self, key, positions):
+        for position in positions:
+            if not self._bits[position >> 3] & (1 << (position & 7)):
+                return False
+
+        return self._connection.execute('SELECT 1 FROM keys WHERE key = ?', (key,)).fetchone() is not None
+
+    def add(self, key):
+        key = compact_key(key)
+        positions = self._positions(key)
+
+        if self._contains(key, positions): return
+
+        for position in positions:
+            self._bits[position >> 3] |= 1 << (position & 7)
+
+        self._connection.execute('INSERT INTO keys VALUES (?)', (key,))
+        self._length += 1
+
+    def discard(self, key):
+        # The bits stay set, the spilled keys are the truth
+        if self._connection.execute('DELETE FROM keys WHERE key = ?', (compact_key(key),)).rowcount:
+            self._length -= 1
+
+    def __contains__(self, key):
+        key = compact_key(key)
+        return self._contains(key, self._positions(key))
+
+    def __len__(self):
+        return self._length
+
+    def memory_usage(self):
+        return len(self._bits)
+
+    def close(self):
+        self._connection.close()
+        os.remove(self._path)
+
+
+VISITED_INDEX_CLASSES = {"set": Visited_Index, "bloom": Bloom_Visited_Index}
+
+
+class LRU_Cache(object):
+    '''Mapping keeping only the maxsize most recently used items.'''
+
+    def __init__(self, maxsize):
+        self._maxsize = maxsize
+        self._items = collections.OrderedDict()
+
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, default=None):
+        try:
+            value = self._items.pop(key)
+        except KeyError:
+            self.misses += 1
+            return default
+
+        self._items[key] = value
+        self.hits += 1
+
+        return value
+
+    def peek(self, key, default=None):
+        '''Like get(), without counting the lookup as a hit or a miss.'''
+
+        return self._items.get(key, default)
+
+    def put(self, key, value):
+        self._items.pop(key, None)
+        self._items[key] = value
+
+        if len(self._items) > self._maxsize:
+            self._items.popitem(last=False)
+
+
+class DFS_Frontier(object):
+    '''Resources to crawl, visiting first the last queued ones.
+
+    Entries are (type_of_resource, url, depth) tuples. An entry can be taken
+    out of order with remove().
+    '''
+
+    def __init__(self):
+        self._entries = []
+        self._removed = set()
+
+    def push(self, type_of_resource, url, depth):
+        self._entries.append((type_of_resource, url, depth))
+
+    def pop(self):
+        entry = self._pop()
+
+        while entry in self._removed:
+            self._removed.remove(entry)
+            entry = self._pop()
+
+        return entry
+
+    def remove(self, entry):
+        self._removed.add(entry)
+
+    def upcoming(self):
+        '''Iterate over the entries in the order they will be popped.'''
+
+        for entry in self._iter_entries():
+            if entry not in self._removed:
+                yield entry
+
+    def _pop(self):
+        return self._entries.pop()
+
+    def _iter_entries(self):
+        return reversed(self._entries)
+
+    def __len__(self):
+        return len(self._entries) - len(self._removed)
+
+
+class BFS_Frontier(DFS_Frontier):
+    '''Resources to crawl, visited in the order they are queued.'''
+
+    def __init__(self):
+        DFS_Frontier.__init__(self)
+        self._entries = collections.deque()
+
+    def _pop(self):
+        return self._entries.popleft()
+
+    def _iter_entries(self):
+        return iter(self._entries)
+
+
+class Priority_Frontier(DFS_Frontier):
+    '''Resources to crawl, visiting first the closest ones to the seeds and,
+    at the same depth, by type of resource in RESOURCE_PRIORITIES order.
+    Resources with the same priority are visited in the order they are queued.
+    '''
+
+    def __init__(self):
+        DFS_Frontier.__init__(self)
+
+        # priority -> entries
+        self._buckets = {}
+        # Sorted priorities of the buckets
+        self._priorities = []
+        self._length = 0
+
+    def push(self, type_of_resource, url, depth):
+        priority = (depth, RESOURCE_PRIORITIES[type_of_resource])
+
+        bucket = self._buckets.get(priority)
+        if bucket is None:
+            bucket = self._buckets[priority] = collections.deque()
+            bisect.insort(self._priorities, priority)
+
+        bucket.append((type_of_resource, url, depth))
+        self._length += 1
+
+    def _pop(self):
+        priority = self._priorities[0]
+        bucket = self._buckets[priority]
+
+        entry = bucket.popleft()
+        if not bucket:
+            del self._buckets[priority]
+            del self._priorities[0]
+
+        self._length -= 1
+
+        return entry
+
+    def _iter_entries(self):
+        for priority in self._priorities:
+            for entry in self._buckets[priority]:
+                yield entry
+
+    def __len__(self):
+        return self._length - len(self._removed)
+
+
+FRONTIER_CLASSES = {"dfs": DFS_Frontier, "bfs": BFS_Frontier, "priority": Priority_Frontier}
+
+
+class Memory_Governor(object):
+    '''Account the bytes of the documents held in memory, from their download
+    until they are saved.
+
+    Downloads in progress are never blocked: the crawl stops prefetching while
+    the budget of max_bytes is exhausted. The resource that the crawl waits for
+    is always downloaded, so a document bigger than the budget doesn't stop it.
+    '''
+
+    def __init__(self, max_bytes=None):
+        self.max_bytes = max_bytes
+        self.in_use = 0
+        self.peak = 0
+
+        # Number of times that prefetching was stopped
+        self.throttled = 0
+
+        self._lock = threading.Lock()
+
+    def add(self, size):
+        with self._lock:
+            self.in_use += size
+            if self.in_use > self.peak:
+                self.peak = self.in_use
+
+    def release(self, size):
+        with self._lock:
+            self.in_use -= size
+
+    def exhausted(self):
+        return self.max_bytes is not None and self.in_use >= self.max_bytes
+
+    def report(self):
+        return "peak: %d bytes, budget: %s, throttled: %d" % (self.peak, "none" if self.max_bytes is None else "%d bytes" % self.max_bytes, self.throttled)
+
+
+class Download_Pool(object):
+    '''Download resources in background threads.
+
+    Downloads of frontier entries, (type_of_resource, url, depth) tuples, are
+    requested with prefetch() and collected with get(). At most window
+    entries are downloading or waiting to be collected. Prefetching stops
+    while the budget of the memory_governor is exhausted. The caller keeps
+    processing the results in its own order, so all the crawl bookkeeping can
+    stay in one thread.
+    '''
+
+    _PENDING = object()
+
+    # Seconds between checks of a pending result. Python 2 doesn't deliver
+    # Ctrl-C to a thread blocked in Condition.wait() without timeout
+    WAIT_INTERVAL = 0.5
+
+    def __init__(self, download, workers, window=None, memory_governor=None):
+        self._download = download
+        self._window = window or workers * 2
+        self._memory_governor = memory_governor
+        self._tasks = Queue.Queue()
+        # In the order they were submitted
+        self._results = collections.OrderedDict()
+        self._condition = threading.Condition()
+
+        self._threads = []
+        for i in range(workers):
+            thread = threading.Thread(target=self._work)
+            thread.daemon = True
+            thread.start()
+
+            self._threads.append(thread)
+
+    def _work(self):
+        while True:
+            resource = self._tasks.get()
+            if resource is None: break
+
+            type_of_resource, url, depth = resource
+            response = self._download(type_of_resource, url)
+
+            with self._condition:
+                self._results[resource] = response
+                self._condition.notify_all()
+
+    def _submit(self, resource):
+        with self._condition:
+            if resource in self._results: return
+            self._results[resource] = self._PENDING
+
+        self._tasks.put(resource)
+
+    def prefetch(self, resources):
+        for resource in resources:
+            # Every resource scanned is either submitted or one of the
+            # results, so the scan is bounded by the window
+            if len(self._results) >= self._window: break
+
+            if self._memory_governor is not None and self._memory_governor.exhausted():
+                self._memory_governor.throttled += 1
+                break
+
+            self._submit(resource)
+
+    def ready(self):
+        '''Return the first submitted entry whose download is finished, or
+        None.'''
+
+        with self._condition:
+            for resource, response in self._results.items():
+                if response is not self._PENDING:
+                    return resource
+
+    def get(self, resource):
+        self._submit(resource)
+
+        with self._condition:
+            while self._results[resource] is self._PENDING:
+                self._condition.wait(self.WAIT_INTERVAL)
+
+            return self._results.pop(resource)
+
+    def close(self):
+        '''Cancel the queued downloads, wait for the ones in flight and
+        release the results never collected.'''
+
+        try:
+            while True:
+                try:
+                    resource = self._tasks.get_nowait()
+                except Queue.Empty:
+                    break
+
+                with self._condition:
+                    del self._results[resource]
+        finally:
+            for thread in self._threads:
+                self._tasks.put(None)
+
+            for thread in self._threads:
+                thread.join()
+
+            for response in self._results.values():
+                if response is not None:
+                    release_response(response, self._memory_governor)
+
+            self._results.clear()
+
+
+class Stage_Timer(object):
+    '''Context manager adding the time spent inside it to a total of
+    Crawl_Stats.'''
+
+    __slots__ = ("_times", "_key", "_start")
+
+    def __init__(self, times, key):
+        self._times = times
+        self._key = key
+
+    def __enter__(self):
+        self._start = time.time()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self._times[self._key] += time.time() - self._start
+
+
+class Crawl_Stats(object):
+    '''Time spent in every stage of the crawl and counters, by type of
+    resource.
+
+    Stages:
+        queue_wait: the crawl loop waits for a download of the workers. Serial
+            downloads are only measured as download
+        download: the whole download, including the waits of the rate control
+        ttfb: time until the headers of the response are received
+        transfer: rest of the download, reading the body
+        encoding: detection of the encoding and decoding
+        parse: parsing and serialization of html documents
+        urls: extraction, resolution and rewriting of urls
+        replacements: custom replacements
+        write: saving the file
+    '''
+
+    STAGES = ("queue_wait", "download", "ttfb", "transfer", "encoding", "parse", "urls", "replacements", "write")
+    COUNTERS = ("resources", "bytes", "errors", "cache_hits", "not_modified")
+
+    enabled = True
+
+    def __init__(self):
+        self._start_time = time.time()
+
+        # (stage, type of resource) -> seconds
+        self._times = collections.defaultdict(float)
+
+        # (counter, type of resource) -> value
+        self._counters = collections.defaultdict(int)
+
+    def stage(self, stage, type_of_resource):
+        return Stage_Timer(self._times, (stage, type_of_resource))
+
+    def add_time(self, stage, type_of_resource, seconds):
+        self._times[(stage, type_of_resource)] += seconds
+
+    def count(self, counter, type_of_resource, value=1):
+        self._counters[(counter, type_of_resource)] += value
+
+    def _types(self):
+        return sorted(set([type_of_resource for name, type_of_resource in itertools.chain(self._times, self._counters)]))
+
+    def as_dict(self):
+        stages = collections.OrderedDict()
+        for stage in self.STAGES:
+            stages[stage] = collections.OrderedDict([(RESOURCE_TYPE_NAMES[type_of_resource], round(self._times[(stage, type_of_resource)], 6)) for type_of_resource in self._types() if (stage, type_of_resource) in self._times])
+
+        resources = collections.OrderedDict()
+        for type_of_resource in self._types():
+            resources[RESOURCE_TYPE_NAMES[type_of_resource]] = collections.OrderedDict([(counter, self._counters[(counter, type_of_resource)]) for counter in self.COUNTERS])
+
+        return collections.OrderedDict([
+            ("wall_time", round(time.time() - self._start_time, 6)),
+            ("stages", stages),
+            ("resources", resources)
+        ])
+
+    def as_prometheus(self):
+        '''Return the stats in the text format of Prometheus.'''
+
+        lines = [
+            "# HELP save_webpage_wall_seconds Duration of the crawl.",
+            "# TYPE save_webpage_wall_seconds gauge",
+            "save_webpage_wall_seconds %f" % (time.time() - self._start_time),
+            "# HELP save_webpage_stage_seconds_total Time spent in every stage of the crawl.",
+            "# TYPE save_webpage_stage_seconds_total counter"
+        ]
+
+        for stage in self.STAGES:
+            for type_of_resource in self._types():
+                if (stage, type_of_resource) in self._times:
+                    lines.append('save_webpage_stage_seconds_total{stage="%s",type="%s"} %f' % (stage, RESOURCE_TYPE_NAMES[type_of_resource], self._times[(stage, type_of_resource)]))
+
+        for counter in self.COUNTERS:
+            lines.append("# TYPE save_webpage_%s_total counter" % counter)
+
+            for type_of_resource in self._types():
+                lines.append('save_webpage_%s_total{type="%s"} %d' % (counter, RESOURCE_TYPE_NAMES[type_of_resource], self._counters[(counter, type_of_resource)]))
+
+        return "\n".join(lines) + "\n"
+
+    def summary(self):
+        '''Return a line for every stage and type of resource.'''
+
+        lines = []
+
+        for stage in self.STAGES:
+            times = ["%s %.3fs" % (RESOURCE_TYPE_NAMES[type_of_resource], self._times[(stage, type_of_resource)]) for type_of_resource in self._types() if (stage, type_of_resource) in self._times]
+
+            if times:
+                lines.append("%s: %s" % (stage, ", ".join(times)))
+
+        for type_of_resource in self._types():
+            lines.append("%s: %s" % (RESOURCE_TYPE_NAMES[type_of_resource], ", ".join(["%s %d" % (counter, self._counters[(counter, type_of_resource)]) for counter in self.COUNTERS])))
+
+        return lines
+
+    def dump(self, path):
+        '''Write the stats to path, in the text format of Prometheus if its
+        extension is .prom and as JSON otherwise.
+
+        The file is replaced atomically, so a collector never reads it half written.
+        '''
+
+        if path.endswith(".prom"):
+            content = self.as_prometheus()
+        else:
+            content = json.dumps(self.as_dict(), indent=2, separators=(",", ": ")) + "\n"
+
+        directory = os.path.dirname(os.path.abspath(path))
+        temporary_file, content_hash = write_to_temporary_file([content], directory)
+        replace_file(temporary_file, path)
+
+
+class Null_Stage_Timer(object):
+    __slots__ = ()
+
+    def __enter__(self):
+        pass
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        pass
+
+
+class Null_Crawl_Stats(object):
+    '''Crawl_Stats doing nothing, used when the stats are disabled.'''
+
+    enabled = False
+
+    _timer = Null_Stage_Timer()
+
+    def stage(self, stage, type_of_resource):
+        return self._timer
+
+    def add_time(self, stage, type_of_resource, seconds):
+        pass
+
+    def count(self, counter, type_of_resource, value=1):
+        pass
+
+
+def resource_type_using_extension(url):
+    url_path = urlparse.urlparse(url).path
+
+    dot = url_path.rfind('.')
+    if dot <= url_path.rfind('/'):
+        return None
+
+    return EXTENSION_TYPES.get(url_path[dot:].lower())
+
+
+def resource_type_using_content_type(content_type):
+    '''Return the type of resource of a Content-Type header, or None if it's
+    unknown or it says nothing like application/octet-stream.'''
+
+    media_type = content_type.split(';', 1)[0].strip().lower()
+
+    type_of_resource = CONTENT_TYPES.get(media_type)
+    if type_of_resource is not None:
+        return type_of_resource
+
+    for prefix, type_of_resource in CONTENT_TYPE_PREFIXES:
+        if media_type.startswith(prefix):
+            return type_of_resource
+
+    return None
+
+
+def resource_type_using_magic_bytes(content):
+    '''Return the type of resource of a binary format recognized by the first
+    bytes of content, or None.'''
+
+    for magic_bytes, type_of_resource in MAGIC_BYTES:
+        if content.startswith(magic_bytes):
+            return type_of_resource
+
+    if content[:4] == b"RIFF":
+        return RIFF_TYPES.get(content[8:12])
+
+    if content[4:8] == b"ftyp":
+        if content[8:12] in IMAGE_BRANDS:
+            return IMAGE_FILE
+        else:
+            return VIDEO_FILE
+
+    return None
+
+
+def classify_response(type_of_resource, content_type, content):
+    '''Return the type of resource of a response, given the type expected from
+    its link, its Content-Type and the first bytes of its body.
+
+    Only html, css and js files can turn out to be something else: a link can
+    lead to a pdf or a video, which must not be decoded as text.
+    '''
+
+    if type_of_resource not in REWRITABLE_RESOURCES:
+        return type_of_resource
+
+    # Servers often declare a wrong Content-Type, the content doesn't lie
+    sniffed_type = resource_type_using_magic_bytes(content)
+    if sniffed_type is not None:
+        return sniffed_type
+
+    declared_type = resource_type_using_content_type(content_type)
+
+    if declared_type is None:
+        # Text with a BOM can be UTF-16, full of null bytes
+        if not content.startswith((codecs.BOM_UTF16_BE, codecs.BOM_UTF16_LE)) and BINARY_DATA_RE.search(content, 0, SNIFF_SIZE):
+            return OTHER_RESOURCE
+    elif declared_type not in REWRITABLE_RESOURCES:
+        return declared_type
+
+    return type_of_resource
+
+
+def iter_css_urls(content):
+    '''Scan a stylesheet and yield a CSS_URL for every url of url(),
+    @import and image-set(). Urls in comments and in other strings are
+    skipped, as well as inline data.
+
+    The type of resource is None if it can't be guessed from the url.
+    '''
+
+    position = 0
+
+    # End of the last @import and positions of the strings of image-set()
+    import_end = None
+    image_set_strings = ()
+
+    while True:
+        match = CSS_TOKEN_RE.search(content, position)
+        if match is None: break
+
+        position = match.end()
+
+        if match.group('import') is not None:
+            import_end = position
+            continue
+
+        # The url of an @import is the token just after it
+        is_import = import_end is not None and not content[import_end:match.start()].strip()
+        import_end = None
+
+        if match.group('image_set') is not None:
+            image_set_strings = css_image_set_strings(content, position)
+            continue
+
+        for group in ('string', 'quoted', 'raw'):
+            value = match.group(group)
+            if value is not None: break
+        else:
+            # Comment
+            continue
+
+        start = match.start(group)
+        end = match.end(group)
+
+        if group == 'string' and not is_import and start not in image_set_strings: continue
+
+        if group == 'raw':
+            quote = ''
+        else:
+            quote = value[0]
+            value = value[1:-1]
+            start += 1
+            end -= 1
+
+        url = css_unescape(value)
+
+        # Inline data and references to the same document
+        if not url or url[0] == "#" or url[:5].lower() == "data:": continue
+
+        if is_import:
+            type_of_resource = CSS_FILE
+        else:
+            type_of_resource = resource_type_using_extension(url)
+
+            # The strings of image-set() are images
+            if type_of_resource is None and group == 'string':
+                type_of_resource = IMAGE_FILE
+
+        yield CSS_URL(type_of_resource, url, start, end, quote)
+
+
+def css_image_set_strings(content, position):
+    '''Return the positions of the strings which are arguments of the
+    image-set() function starting at position, and not of a nested function.'''
+
+    strings = set([])
+    depth = 1
+
+    for match in CSS_PARENTHESES_RE.finditer(content, position):
+        token = match.group(0)
+
+        if token == '(':
+            depth += 1
+        elif token == ')':
+            depth -= 1
+            if depth == 0: break
+        elif token[0] in '"\'' and depth == 1:
+            strings.add(match.start())
+
+    return strings
+
+
+def css_unescape(value):
+    if '\\' not in value:
+        return value
+
+    return CSS_ESCAPE_RE.sub(_css_unescape_match, value)
+
+
+def _css_unescape_match(matchobj):
+    code = matchobj.group(1)
+
+    if code is None:
+        # An escaped newline is a line continuation
+        char = matchobj.group(2)
+        return "" if char == "\n" else char
+
+    try:
+        return unichr(int(code, 16))
+    except (ValueError, OverflowError):
+        return u"\ufffd"
+
+
+def css_quote(url, quote):
+    '''Serialize url in place of a value with the given quote.'''
+
+    if not quote:
+        if not CSS_RAW_URL_SPECIAL_CHARS_RE.search(url):
+            return url
+
+        # Unquoted urls are always inside url(), where quotes are allowed
+        return '"%s"' % css_quote(url, '"')
+
+    return url.replace('\\', '\\\\').replace(quote, '\\' + quote).replace('\n', '\\a ')
+
+
+def process_css_urls(css_urls, resource_handler):
+    '''Pass the urls found by iter_css_urls() to resource_handler and return
+    the list of new urls. None keeps the url.'''
+
+    new_urls = []
+
+    for css_url in css_urls:
+        if css_url.type is None:
+            logger.warning("Unknown resource %s", css_url.url)
+            new_url = None
+        else:
+            new_url = resource_handler(css_url.type, css_url.url)
+
+            if new_url == css_url.url:
+                new_url = None
+
+        new_urls.append(new_url)
+
+    return new_urls
+
+
+def replace_css_urls(content, css_urls, new_urls):
+    pieces = []
+    position = 0
+
+    for css_url, new_url in zip(css_urls, new_urls):
+        if not new_url: continue
+
+        pieces.append(content[position:css_url.start])
+        pieces.append(css_quote(new_url, css_url.quote))
+        position = css_url.end
+
+    if not pieces:
+        return content
+
+    pieces.append(content[position:])
+
+    return ''.join(pieces)
+
+
+def process_urls_in_css_content(content, resource_handler, replace=True):
+    '''Pass the urls of the stylesheet to resource_handler, replacing them with
+    its result. The rest of the content is kept untouched.'''
+
+    css_urls = list(iter_css_urls(content))
+
+    return replace_css_urls(content, css_urls, process_css_urls(css_urls, resource_handler))
+
+def process_urls_in_html_content(content, resource_handler, replace=True, parser=DEFAULT_HTML_PARSER):
+    # now build the dom tree
+    from bs4 import BeautifulSoup
+
+    soup = BeautifulSoup(content, parser)
+    process_urls_in_html_document(soup, resource_handler)
+
+    return soup.decode(formatter="html")
+
+
+def resolve_base_url(base_href, url):
+    if base_href is None:
+        return url
+
+    if is_absolute_url2(base_href):
+        return base_href
+    else:
+        return urlparse.urljoin(url, base_href)
+
+
+def html_base_url(soup, url):
+    '''Return the url used to resolve relative links of the parsed document.'''
+
+    html_base = soup.find("base", href=True)
+
+    if html_base:
+        return resolve_base_url(html_base["href"], url)
+    else:
+        return url
+
+
+SRCSET_DESCRIPTOR_RE = re.compile(r'\s+[\d\.]+[xw]\s*$')
+
+
+def process_urls_in_srcset(srcset, type_of_resource, resource_handler):
+    '''Return the srcset with its urls replaced, or None if nothing changed.
+    Only the urls are replaced, the separators and descriptors are kept.'''
+
+    candidates = []
+    is_srcset_modified = False
+
+    for candidate in srcset.split(","):
+        # remove the (optional) descriptor
+        # https://developer.mozilla.org/en-US/docs/Web/HTML/Element/img#attr-srcset
+        url_and_descriptor = candidate.strip()
+
+        match = SRCSET_DESCRIPTOR_RE.search(url_and_descriptor)
+
+        if match:
+            url = url_and_descriptor[:match.start()]
+        else:
+            url = url_and_descriptor
+
+        new_url = resource_handler(type_of_resource, url)
+        if new_url and new_url != url:
+            start = len(candidate) - len(candidate.lstrip())
+            candidate = candidate[:start] + new_url + candidate[start + len(url):]
+
+            is_srcset_modified = True
+
+        candidates.append(candidate)
+
+    if is_srcset_modified:
+        return ",".join(candidates)
+
+
+def link_resource_type(href, type_attribute, rel):
+    if type_attribute == 'text/css' or href.lower().endswith('.css') or 'stylesheet' in rel:
+        return CSS_FILE
+    else:
+        return OTHER_RESOURCE
+
+
+def process_urls_in_html_document(soup, resource_handler, rewrite_style=None):
+    '''Pass all the urls of the parsed document to resource_handler, replacing
+    them in place with its result.
+
+    The whole document is traversed only once. The style attributes are
+    rewritten with rewrite_style(style), if it's given.
+
+    The content of raw text elements like <textarea> or <title> is text for
+    html5lib and browsers, but lxml and html.parser build tags from it. It's
+    skipped, so that all the parsers find the same urls.
+    '''
+
+    from bs4 import Tag
+
+    if rewrite_style is None:
+        rewrite_style = functools.partial(process_urls_in_css_content, resource_handler=resource_handler)
+
+    # Tags in document order
+    tags = [child for child in reversed(soup.contents) if isinstance(child, Tag)]
+
+    while tags:
+        tag = tags.pop()
+
+        tag_name = tag.name
+        attrs = tag.attrs
+
+        if tag_name not in RAW_TEXT_ELEMENTS:
+            tags.extend(child for child in reversed(tag.contents) if isinstance(child, Tag))
+
+        if tag_name == "link":
+            href = attrs.get('href')
+
+            if href:
+                rel = attrs.get('rel') or []
+                href = resource_handler(link_resource_type(href, attrs.get('type'), rel), href)
+
+                if href:
+                    attrs['href'] = href
+
+        elif tag_name in URL_ATTRS_BY_TAG:
+            for attribute_name, type_of_resource in URL_ATTRS_BY_TAG[tag_name]:
+                if attribute_name not in attrs: continue
+
+                # srcset is a fair bit different from most html
+                # attributes, so it gets it's own processsing
+                if attribute_name == 'srcset':
+                    url = process_urls_in_srcset(attrs[attribute_name], type_of_resource, resource_handler)
+                else:
+                    url = resource_handler(type_of_resource, attrs[attribute_name])
+
+                if url:
+                    attrs[attribute_name] = url
+
+        elif tag_name == "style":
+            text = tag.string
+
+            if text:
+                new_text = process_urls_in_css_content(text, resource_handler)
+
+                if new_text != text:
+                    text.replace_with(new_text)
+
+        if 'style' in attrs:
+            style = attrs['style'].strip()
+
+            if style:
+                attrs['style'] = rewrite_style(style)
+
+
+# Quotes only delimit a value right after the "=" of an attribute. The value
+# is matched inside a lookahead so that it's never backtracked
+HTML_TOKEN_RE = re.compile(r'''<!--.*?(?:-->|\Z)|<[!?/][^>]*>|<([a-zA-Z][^\s/>]*)((?:[^>=]|=(?=(\s*(?:"[^"]*"|'[^']*'|[^\s>]*)))\3)*)>''', re.S)
+HTML_ATTRIBUTE_RE = re.compile(r'''([^\s"'>/=][^\s"'>/=]*)(?:\s*=\s*(?:"([^"]*)"|'([^']*)'|([^\s>]+)))?''')
+
+# Elements whose content is not markup
+RAW_TEXT_ELEMENTS = set(["script", "style", "textarea", "title", "xmp", "iframe", "noembed", "noframes", "plaintext"])
+
+HTML_Attribute = collections.namedtuple('HTML_Attribute', ['value', 'start', 'end', 'quote'])
+
+html_unescape = HTMLParser.HTMLParser().unescape
+
+
+def iter_html_start_tags(content):
+    '''Scan the markup without building a tree.
+
+    Yields the name of every start tag, a dict with its attributes and the
+    (start, end) position of its text if it's a raw text element like
+    <style>, or None. Each attribute is an HTML_Attribute with the unescaped
+    value, the position of the raw value in content and its quote character.
+    Attributes without value have an empty value located just after their
+    name.
+    '''
+
+    position = 0
+
+    while True:
+        match = HTML_TOKEN_RE.search(content, position)
+        if match is None: break
+
+        position = match.end()
+
+        tag_name = match.group(1)
+        if tag_name is None: continue
+
+        tag_name = tag_name.lower()
+        attrs = {}
+
+        attrs_offset = match.start(2)
+        for attribute_match in HTML_ATTRIBUTE_RE.finditer(match.group(2)):
+            attribute_name = attribute_match.group(1).lower()
+
+            # Like browsers, keep the first one of duplicated attributes
+            if attribute_name in attrs: continue
+
+            for group, quote in ((2, '"'), (3, "'"), (4, '')):
+                value = attribute_match.group(group)
+                if value is not None:
+                    start = attrs_offset + attribute_match.start(group) - len(quote)
+                    end = attrs_offset + attribute_match.end(group) + len(quote)
+                    break
+            else:
+                value = ''
+                start = end = attrs_offset + attribute_match.end(1)
+                quote = None
+
+            if '&' in value:
+                value = html_unescape(value)
+
+            attrs[attribute_name] = HTML_Attribute(value, start, end, quote)
+
+        if tag_name in RAW_TEXT_ELEMENTS:
+            end_tag = re.compile(r'</%s[\s/>]' % tag_name, re.I).search(content, position)
+
+            if end_tag is None:
+                yield tag_name, attrs, (position, len(content))
+                break
+
+            yield tag_name, attrs, (position, end_tag.start())
+            position = end_tag.start()
+        else:
+            yield tag_name, attrs, None
+
+
+def quote_html_attribute_value(value, quote):
+    value = value.replace('&', '&amp;')
+
+    if quote is None:
+        return '="%s"' % value.replace('"', '&quot;')
+    elif quote == '':
+        if re.search(r'''[\s"'=<>`]''', value) is None:
+            return value
+        else:
+            return '"%s"' % value.replace('"', '&quot;')
+    elif quote == '"':
+        return '"%s"' % value.replace('"', '&quot;')
+    else:
+        return "'%s'" % value.replace("'", '&#39;')
+
+
+def html_base_url_in_stream(content, url, tags=None):
+    '''Return the url used to resolve relative links, scanning the markup.
+    The start tags already found by iter_html_start_tags() can be given.'''
+
+    if tags is None:
+        tags = iter_html_start_tags(content)
+
+    for tag_name, attrs, text in tags:
+        if tag_name == "base" and "href" in attrs:
+            return resolve_base_url(attrs["href"].value, url)
+
+    return url
+
+
+def process_urls_in_html_attributes(tag_name, attrs, resource_handler, rewrite_style=None):
+    '''Pass the urls in the attributes of a start tag found by
+    iter_html_start_tags() to resource_handler. The style attribute is
+    rewritten with rewrite_style(style), if it's given.
+
+    Returns a list of (attribute, new value) sorted by position.
+    '''
+
+    new_values = []
+
+    if tag_name == "link":
+        href = attrs.get('href')
+
+        if href is not None and href.value:
+            rel = attrs['rel'].value.split() if 'rel' in attrs else []
+            type_attribute = attrs['type'].value if 'type' in attrs else None
+
+            new_values.append((href, resource_handler(link_resource_type(href.value, type_attribute, rel), href.value)))
+
+    elif tag_name in URL_ATTRS_BY_TAG:
+        for attribute_name, type_of_resource in URL_ATTRS_BY_TAG[tag_name]:
+            if attribute_name not in attrs: continue
+
+            attribute = attrs[attribute_name]
+
+            if attribute_name == 'srcset':
+                new_values.append((attribute, process_urls_in_srcset(attribute.value, type_of_resource, resource_handler)))
+            else:
+                new_values.append((attribute, resource_handler(type_of_resource, attribute.value)))
+
+    if 'style' in attrs:
+        attribute = attrs['style']
+        style = attribute.value.strip()
+
+        if style:
+            if rewrite_style is None:
+                new_style = process_urls_in_css_content(style, resource_handler)
+            else:
+                new_style = rewrite_style(style)
+
+            if new_style != style:
+                new_values.append((attribute, new_style))
+
+    new_values.sort(key=lambda new_value: new_value[0].start)
+
+    return new_values
+
+
+def extract_urls_from_html_stream(content, resource_handler, rewrite_style=None, tags=None):
+    '''Pass all the urls of the markup to resource_handler, without building a
+    tree nor replacing anything.'''
+
+    if tags is None:
+        tags = iter_html_start_tags(content)
+
+    for tag_name, attrs, text in tags:
+        process_urls_in_html_attributes(tag_name, attrs, resource_handler, rewrite_style)
+
+        if tag_name == "style" and text is not None:
+            process_urls_in_css_content(content[text[0]:text[1]], resource_handler)
+
+
+def process_urls_in_html_stream(content, resource_handler, rewrite_style=None, tags=None):
+    '''Pass all the urls of the markup to resource_handler without building a
+    tree.
+
+    Only the values of the attributes and the stylesheets whose urls changed
+    are replaced, the rest of the content is returned untouched. The start
+    tags already found by iter_html_start_tags() can be given.
+    '''
+
+    if tags is None:
+        tags = iter_html_start_tags(content)
+
+    pieces = []
+    position = 0
+
+    for tag_name, attrs, text in tags:
+        new_values = process_urls_in_html_attributes(tag_name, attrs, resource_handler, rewrite_style)
+
+        for attribute, new_value in new_values:
+            if not new_value or new_value == attribute.value: continue
+
+            pieces.append(content[position:attribute.start])
+            pieces.append(quote_html_attribute_value(new_value, attribute.quote))
+            position = attribute.end
+
+        if tag_name == "style" and text is not None:
+            start, end = text
+            stylesheet = content[start:end]
+            new_stylesheet = process_urls_in_css_content(stylesheet, resource_handler)
+
+            if new_stylesheet != stylesheet:
+                pieces.append(content[position:start])
+                pieces.append(new_stylesheet)
+                position = end
+
+    pieces.append(content[position:])
+
+    return ''.join(pieces)
+
+
+def make_directory(path):
+    if not os.path.isdir(path):
+        try:
+            os.makedirs(path)
+        except OSError:
+            # Created meanwhile by another download thread
+            if not os.path.isdir(path):
+                raise
+
+
+# Characters with a special meaning in a regular expression
+REGEX_METACHARACTERS = re.compile(r'[.^$*+?{}\[\]\\|()]')
+
+# Inline flags apply to the whole expression, they can't be combined
+INLINE_FLAGS = re.compile(r'\(\?[aiLmsux]')
+
+
+def literal_alternation(literals):
+    '''Return a regular expression matching any of the literals, factored as a
+    trie so that at every position of the text each character is compared only
+    once.'''
+
+    trie = {}
+    for literal in literals:
+        node = trie
+        for char in literal:
+            node = node.setdefault(char, {})
+        node[""] = {}
+
+    return _trie_regex(trie)
+
+
+def _trie_regex(node):
+    alternatives = []
+
+    for char in sorted(node):
+        if char == "": continue
+
+        # Chains of characters without branches are a single literal
+        chain = [char]
+        child = node[char]
+        while len(child) == 1 and "" not in child:
+            char, child = next(iter(child.items()))
+            chain.append(char)
+
+        alternatives.append(re.escape("".join(chain)) + _trie_regex(child))
+
+    if not alternatives:
+        return ""
+
+    if len(alternatives) == 1 and "" not in node:
+        return alternatives[0]
+
+    regex = "(?:" + "|".join(alternatives) + ")"
+
+    if "" in node:
+        regex += "?"
+
+    return regex
+
+
+def _overlaps(a, b):
+    '''Whether a proper suffix of a is a prefix of b.'''
+
+    return any(b.startswith(a[i:]) for i in range(1, len(a)))
+
+
+def _is_literal_rule(pattern_text, substitution):
+    # A substitution can also be a function
+    if callable(substitution): return False
+
+    return pattern_text and not REGEX_METACHARACTERS.search(pattern_text) and "\\" not in substitution
+
+
+def _commutes(group, pattern_text, substitution):
+    '''Whether applying the literal rules of group and then the new one gives
+    the same result than a single pass replacing all of them.
+
+    It's the case if their occurrences never overlap and the substitutions
+    never form an occurrence of the new pattern.
+    '''
+
+    for other_pattern, other_substitution in group:
+        if pattern_text in other_pattern or other_pattern in pattern_text:
+            return False
+
+        if _overlaps(pattern_text, other_pattern) or _overlaps(other_pattern, pattern_text):
+            return False
+
+        if pattern_text in other_substitution or other_substitution in pattern_text:
+            return False
+
+        if _overlaps(other_substitution, pattern_text) or _overlaps(pattern_text, other_substitution):
+            return False
+
+    return True
+
+
+class Replacement_Rules(object):
+    '''Custom replacements, compiled once.
+
+    replacements is a list of (pattern of url path, list of rules) pairs. The
+    rules of the first pattern matching the path of a url are applied in order
+    to its content. A rule is a function or a (pattern, substitution) pair for
+    re.sub().
+
+    Consecutive rules of literal strings are merged in a single pass when the
+    result is the same. Other regular expressions are applied in order, a
+    merged alternation could match differently.
+    '''
+
+    def __init__(self, replacements):
+        url_path_patterns = []
+        self._passes = []
+
+        for pattern_url_path, list_of_replacement_objs in replacements:
+            url_path_patterns.append(pattern_url_path)
+            self._passes.append(self._compile_rules(list_of_replacement_objs))
+
+        self._url_path_patterns = [re.compile(pattern_url_path) for pattern_url_path in url_path_patterns]
+
+        # The first matching alternative is the first matching pattern, as
+        # long as the patterns don't have groups and flags of their own
+        if all(pattern.groups == 0 and not INLINE_FLAGS.search(pattern.pattern) for pattern in self._url_path_patterns):
+            self._url_path_matcher = re.compile("|".join(["(%s)" % pattern_url_path for pattern_url_path in url_path_patterns]))
+        else:
+            self._url_path_matcher = None
+
+    @staticmethod
+    def _compile_rules(list_of_replacement_objs):
+        '''Return the list of functions transforming the content.'''
+
+        passes = []
+        group = []
+
+        def merge_group():
+            if len(group) == 1:
+                pattern_text, substitution = group[0]
+                passes.append(functools.partial(re.compile(pattern_text).sub, substitution))
+            elif group:
+                substitutions = dict(group)
+                regex = re.compile(literal_alternation(substitutions))
+                passes.append(functools.partial(regex.sub, lambda matchobj: substitutions[matchobj.group(0)]))
+
+            del group[:]
+
+        for replacement_obj in list_of_replacement_objs:
+            if callable(replacement_obj):
+                merge_group()
+                passes.append(replacement_obj)
+                continue
+
+            pattern_text, substitution = replacement_obj
+
+            if _is_literal_rule(pattern_text, substitution):
+                if not _commutes(group, pattern_text, substitution):
+                    merge_group()
+
+                group.append((pattern_text, substitution))
+            else:
+                merge_group()
+                passes.append(functools.partial(re.compile(pattern_text).sub, substitution))
+
+        merge_group()
+
+        return passes
+
+    def _passes_for(self, url_path):
+        if self._url_path_matcher is not None:
+            matchobj = self._url_path_matcher.match(url_path)
+            if matchobj is None:
+                return None
+
+            return self._passes[matchobj.lastindex - 1]
+
+        for pattern, passes in zip(self._url_path_patterns, self._passes):
+            if pattern.match(url_path):
+                return passes
+
+        return None
+
+    def apply(self, url_path, content):
+        passes = self._passes_for(url_path)
+
+        if passes:
+            for transform in passes:
+                content = transform(content)
+
+        return content
+
+
+# TODO: Process form actions
+# TODO: Provide the possibility to use a custom handler for extra processing the content of internal resources
+class Save_Webpage(object):
+    RELATIVE_MODE = 0
+    ABSOLUTE_MODE = 1
+    NO_CHANGE_MODE = 2
+
+    RESOLUTION_CACHE_SIZE = 10000
+    INLINE_STYLE_CACHE_SIZE = 10000
+
+
+    def __init__(self, list_of_seed_urls, forbidden_urls=None, follow_links=False, replacements=None, domain=None, output="output", base_url=None, mode=NO_CHANGE_MODE, index_html="index.html", workers=1, max_connections=None, update=False, resume=False, parser=DEFAULT_HTML_PARSER, html_rewriter="dom", inventory=None, dedup=False, output_format="dir", visited_index="set", crawl_order="dfs", max_depth=None, max_pages=None, max_bytes=None, deadline=None, max_per_host=None, max_rate=None, stats=None, max_inflight_bytes=None):
+        if not list_of_seed_urls:
+            raise Exception("List of seed url's can't be empty")
+
+        self._list_of_seed_urls = list_of_seed_urls
+
+        self._seeds = []
+
+        # Visited indexes created by run(): paths of the queued resources,
+        # broken urls and files saved by previous crawls
+        self._visited_paths = None
+        self._broken_urls = None
+        self._saved_files = None
+
+        # Urls already in the mirror which are downloaded again with a conditional request
+        self._update = update
+        self._revalidating = set([])
+
+        self._resume = resume
+        self._database = None
+
+        for url in list_of_seed_urls:
+            if not is_absolute_url(url):
+                raise Exception("Seed URL is not absolute: %s"%url)
+
+            url = self._normalize_url(url)
+
+            if url not in self._seeds:
+                self._seeds.append(url)
+
+
+        if domain is None:
+            url = list_of_seed_urls[0]
+            domain = domain_of_url(url)
+
+        self._domain = domain
+
+        if output is None:
+            url = list_of_seed_urls[0]
+            output = os.path.join(os.getcwd(), urlparse.urlparse(url).netloc)
+        else:
+            if not os.path.isabs(output):
+                output = os.path.join(os.getcwd(), output)
+
+        self._output = output
+
+        if forbidden_urls:
+            forbidden_urls = set([self._normalize_url(url) for url in forbidden_urls])
+
+        self._forbidden_urls = forbidden_urls
+        self._follow_links = follow_links
+
+        if mode != self.RELATIVE_MODE \
+            and mode != self.ABSOLUTE_MODE \
+            and mode != self.NO_CHANGE_MODE:
+            raise Exception("Invalid mode")
+
+        self._mode = mode
+
+        if base_url:
+            if not (base_url.startswith("http://") or base_url.startswith("https://")):
+                raise Exception("Base URL requires the protocol")
+        else:
+            if mode == self.ABSOLUTE_MODE:
+                raise Exception("Base URL is require to convert all url's to absolute")
+
+        self._base_url = base_url
+        self._index_html = index_html
+
+        if replacements:
+            self._replacements = Replacement_Rules(replacements)
+        else:
+            self._replacements = None
+
+        if workers < 1:
+            raise Exception("Number of workers must be at least 1")
+
+        self._workers = workers
+
+        if parser not in HTML_PARSERS:
+            raise Exception("Invalid HTML parser: %s" % parser)
+
+        self._parser = parser
+
+        if html_rewriter not in HTML_REWRITERS:
+            raise Exception("Invalid HTML rewriter: %s" % html_rewriter)
+
+        self._html_rewriter = html_rewriter
+
+        # Path of the inventory of urls written instead of saving the webpages
+        if inventory is not None and (update or resume):
+            raise Exception("It's not possible to update or resume a discovery of urls")
+
+        self._inventory = inventory
+        self._inventory_writer = None
+        self._referrers = {}
+
+        if output_format not in OUTPUT_FORMATS:
+            raise Exception("Invalid output format: %s" % output_format)
+
+        if output_format != "dir" and (update or resume or dedup):
+            raise Exception("It's only possible to update, resume or deduplicate a directory")
+
+        self._output_format = output_format
+        self._archive = None
+
+        # Downloads are streamed here before being added to the archive
+        self._temporary_directory = None
+
+        self._dedup = dedup
+        self._blob_store = None
+
+        if visited_index not in VISITED_INDEXES:
+            raise Exception("Invalid visited index: %s" % visited_index)
+
+        self._visited_index_class = VISITED_INDEX_CLASSES[visited_index]
+
+        if crawl_order not in CRAWL_ORDERS:
+            raise Exception("Invalid crawl order: %s" % crawl_order)
+
+        self._frontier = FRONTIER_CLASSES[crawl_order]()
+
+        # Depth of the resource being crawled: the number of links followed
+        # from a seed to reach it. Resources of a page have its same depth
+        self._depth = 0
+
+        # Budgets of the crawl. The depth and number of pages limit which
+        # pages are queued, the crawl stops gracefully when it downloads
+        # max_bytes or after deadline seconds
+        self._max_depth = max_depth
+        self._max_pages = max_pages
+        self._max_bytes = max_bytes
+        self._deadline = deadline
+
+        self._queued_pages = 0
+        self._downloaded_bytes = 0
+        self._stop_time = None
+
+        # Documents held in memory by the downloads and the crawl
+        if max_inflight_bytes is not None and max_inflight_bytes < 1:
+            raise Exception("Maximum number of bytes in flight must be at least 1")
+
+        self._memory_governor = Memory_Governor(max_inflight_bytes)
+
+        self._encoding_detector = Encoding_Detector()
+
+        # (base url, url found in a document) -> result of _resolve_url()
+        self._resolution_cache = LRU_Cache(self.RESOLUTION_CACHE_SIZE)
+
+        # (style attribute, base url) -> [urls found, new urls, new style]
+        self._inline_styles = LRU_Cache(self.INLINE_STYLE_CACHE_SIZE)
+
+        if max_connections is None:
+            max_connections = max(workers, MAX_CONNECTIONS)
+
+        self._session = create_session(max_connections)
+
+        if max_per_host is None:
+            max_per_host = workers
+
+        self._rate_controller = Rate_Controller(max_per_host, max_rate)
+
+        # Path where run() writes the timings and counters of the crawl. They
+        # are only measured if it's given
+        self._stats_path = stats
+        self._stats = Null_Crawl_Stats()
+
+    def _is_absolute_url_in_same_domain(self, url):
+        return self._domain == domain_of_url(url)
+
+    def _is_external_resource(self, url):
+        if is_absolute_url(url) and not self._is_absolute_url_in_same_domain(url):
+            return True
+        else:
+            return False
+
+
+    @staticmethod
+    def _normalize_url(url):
+        return Save_Webpage._normalize_urls([url])[0]
+
+    @staticmethod
+    def _normalize_urls(urls):
+        quoted_urls = []
+
+        for url in urls:
+            if url.startswith("//"):
+                url = "http:" + url
+
+            parsed_url = urlparse.urlparse(url)
+
+            url_path = parsed_url.path
+            url_path = urllib.quote(url_path, safe="%/:=&?~#+!$,;'@()*[]")
+
+            quoted_urls.append(urlparse.urlunparse((parsed_url.scheme, parsed_url.netloc, url_path, "", "", "")))
+
+        return urltools.normalize_many(quoted_urls)
+
+    @staticmethod
+    def _path_to_resource_file(url, output, index_html):
+        parsed_url = urlparse.urlparse(url)
+        url_path = parsed_url.path
+        url_path = url_path.lstrip("/")
+
+        if url_path == "":
+            url_path = index_html
+        else:
+            if url_path.endswith("/"):
+                url_path += index_html
+
+        relative_path_to_resource_file = urllib.url2pathname(url_path)
+        path_to_resource_file = os.path.join(output, relative_path_to_resource_file)
+
+        return path_to_resource_file
+
+    def _replace_content(self, current_url, content):
+        if not self._replacements: return content
+
+        return self._replacements.apply(urlparse.urlparse(current_url).path, content)
+
+    def _on_extracted_url(self, type_of_resource, url, base_url, referrer=None):
+        if type_of_resource == HTML_FILE and not self._follow_links: return
+
+        url, is_in_scope, path_to_resource_file, new_url = self._resolve_url(url, base_url)
+
+        if not is_in_scope: return
+
+        if url in self._broken_urls:
+            logger.info('[ BROKEN URL ] - %s', url)
+            return
+
+        if path_to_resource_file in self._visited_paths:
+            logger.info('[ CACHE HIT ] - %s', url)
+            self._stats.count("cache_hits", type_of_resource)
+            return new_url
+
+        if type_of_resource == HTML_FILE:
+            # Links to files which are not pages are saved as they are
+            type_of_resource = resource_type_using_extension(url) or HTML_FILE
+
+        if type_of_resource == HTML_FILE:
+            depth = self._depth + 1
+
+            if self._max_depth is not None and depth > self._max_depth:
+                logger.info('[ MAX DEPTH ] - %s', url)
+                return
+
+            if self._max_pages is not None and self._queued_pages >= self._max_pages:
+                logger.info('[ MAX PAGES ] - %s', url)
+                return
+        else:
+            depth = self._depth
+
+        if path_to_resource_file in self._saved_files:
+            if not self._update or self._database.get(url) is None:
+                logger.info('[ CACHE HIT ] - %s', url)
+                self._stats.count("cache_hits", type_of_resource)
+                return new_url
+
+            self._revalidating.add(url)
+
+        self._enqueue(type_of_resource, url, depth, referrer)
+
+        return new_url
+
+    def _resolve_url(self, original_url, base_url):
+        '''Return the normalized url, whether it must be saved, the path of its
+        file and the url to write in the document for a url found in a
+        document.
+
+        The same links are repeated in all the pages of a site, so the results
+        are memoized. The links of a document are looked up and resolved by
+        _resolve_links() before they are handled one by one.
+        '''
+
+        resolution = self._resolution_cache.peek((base_url, original_url))
+
+        if resolution is None:
+            resolution = self._resolve_urls([(original_url, base_url)])[0]
+
+        return resolution
+
+    def _resolve_urls(self, links):
+        '''Resolve a batch of (url, base url) pairs like _resolve_url() and
+        memoize the results. The hosts and paths shared by the urls are only
+        normalized once.'''
+
+        absolute_urls = []
+        for original_url, base_url in links:
+            if base_url is not None:
+                absolute_urls.append(absurl(base_url, original_url))
+            else:
+                absolute_urls.append(original_url)
+
+        # netloc -> registrable domain
+        domains = {}
+        resolutions = []
+
+        for (original_url, base_url), url in zip(links, self._normalize_urls(absolute_urls)):
+            netloc = urlparse.urlparse(url).netloc
+
+            if netloc:
+                domain = domains.get(netloc)
+                if domain is None:
+                    domain = domains[netloc] = domain_of_netloc(netloc)
+
+                is_in_scope = domain == self._domain
+            else:
+                is_in_scope = True
+
+            is_in_scope = is_in_scope and not (self._forbidden_urls and url in self._forbidden_urls)
+
+            if is_in_scope:
+                path_to_resource_file = self._path_to_resource_file(url, output=self._output, index_html=self._index_html)
+                new_url = self._rewrite_url(original_url, base_url)
+            else:
+                path_to_resource_file = new_url = None
+
+            resolution = (url, is_in_scope, path_to_resource_file, new_url)
+            self._resolution_cache.put((base_url, original_url), resolution)
+            resolutions.append(resolution)
+
+        return resolutions
+
+    def _resolve_links(self, links):
+        '''Resolve at once the (type, url, base url) links of a page that are
+        not memoized yet.'''
+
+        pending = collections.OrderedDict()
+
+        for type_of_resource, url, base_url in links:
+            if type_of_resource == HTML_FILE and not self._follow_links: continue
+
+            if (url, base_url) in pending:
+                # Resolved once for the whole page
+                self._resolution_cache.hits += 1
+                continue
+
+            if self._resolution_cache.get((base_url, url)) is None:
+                pending[(url, base_url)] = True
+
+        if pending:
+            self._resolve_urls(list(pending))
+
+    def _resolve_links_in_content(self, type_of_resource, content, base_url, tags=None, css_urls=None, soup=None):
+        '''Extract the links of an html or css document and resolve them at
+        once. The start tags or the css urls already found in content, or the
+        parsed document, can be given so that it's not scanned again. Returns
+        the list of links.'''
+
+        links = []
+
+        def link_collector(type_of_resource, url):
+            links.append((type_of_resource, url, base_url))
+
+        if soup is not None:
+            process_urls_in_html_document(soup, link_collector, self._create_style_rewriter(base_url, link_collector))
+        elif type_of_resource == HTML_FILE:
+            extract_urls_from_html_stream(content, link_collector, self._create_style_rewriter(base_url, link_collector), tags=tags)
+        else:
+            if css_urls is None:
+                css_urls = iter_css_urls(content)
+
+            for css_url in css_urls:
+                if css_url.type is not None:
+                    link_collector(css_url.type, css_url.url)
+
+        self._resolve_links(links)
+
+        return links
+
+    def _rewrite_url(self, original_url, base_url):
+        if self._mode == self.ABSOLUTE_MODE:
+            if is_absolute_url2(original_url):
+                parsed_original_url = urlparse.urlparse(original_url)
+
+                url = urlparse.urljoin(self._base_url,
+                                       urlparse.urlunparse((
+                                                           "",
+                                                           "",
+                                                           parsed_original_url.path,
+                                                           parsed_original_url.params,
+                                                           parsed_original_url.query,
+                                                           parsed_original_url.fragment))
+                                      )
+            else:
+                url = urlparse.urljoin(self._base_url, original_url)
+
+        elif self._mode == self.RELATIVE_MODE:
+            if is_absolute_url2(original_url):
+                parsed_original_url = urlparse.urlparse(original_url)
+
+                url_path = relurl_path(urlparse.urlparse(base_url).path, parsed_original_url.path)
+                url = urlparse.urlunparse((
+                                   "",
+                                   "",
+                                   url_path,
+                                   parsed_original_url.params,
+                                   parsed_original_url.query,
+                                   parsed_original_url.fragment))
+
+                if url[0] == "/": url = url[1:]
+            else:
+                url = original_url
+        else:
+            return None
+
+        return url
+
+
+    def run(self):
+        if self._inventory is not None:
+            # Nothing is saved in the output directory
+            self._database = Mirror_Database(":memory:")
+        elif self._output_format != "dir":
+            archive_class = ARCHIVE_CLASSES[self._output_format]
+
+            path_to_archive = self._output
+            if not path_to_archive.endswith(archive_class.EXTENSION):
+                path_to_archive += archive_class.EXTENSION
+
+            self._archive = archive_class(path_to_archive)
+            self._temporary_directory = tempfile.mkdtemp(prefix='.save_webpage.', dir=os.path.dirname(os.path.abspath(path_to_archive)))
+
+            # Nothing is kept between crawls of an archive
+            self._database = Mirror_Database(":memory:")
+        else:
+            if os.path.exists(self._output):
+                if not os.path.isdir(self._output):
+                    raise Exception("It's not possible to save webpage in 'output' directory")
+            else:
+                os.makedirs(self._output)
+
+            self._database = Mirror_Database(os.path.join(self._output, Mirror_Database.FILENAME))
+
+            if self._dedup:
+                self._blob_store = Blob_Store(os.path.join(self._output, Blob_Store.DIRNAME))
+
+        # The files of the indexes are kept with the output
+        if self._archive is not None:
+            directory = self._temporary_directory
+        elif self._inventory is None:
+            directory = self._output
+        else:
+            directory = None
+
+        if directory is None:
+            self._visited_paths = self._visited_index_class()
+            self._saved_files = self._visited_index_class()
+        else:
+            self._visited_paths = self._visited_index_class(os.path.join(directory, ".save_webpage.visited"))
+            self._saved_files = self._visited_index_class(os.path.join(directory, ".save_webpage.saved"))
+
+        # There are never many broken urls
+        self._broken_urls = Visited_Index()
+
+        if self._inventory is None and self._archive is None:
+            self._scan_saved_files()
+
+        if self._resume and self._database.has_frontier():
+            queue, queued_urls, broken_urls, self._queued_pages = self._database.load_frontier()
+
+            for type_of_resource, url, depth in queue:
+                self._frontier.push(type_of_resource, url, depth)
+
+                if self._update and self._path_to_resource_file(url, output=self._output, index_html=self._index_html) in self._saved_files:
+                    self._revalidating.add(url)
+
+            for url in queued_urls:
+                if url in broken_urls:
+                    self._broken_urls.add(url)
+                else:
+                    self._visited_paths.add(self._path_to_resource_file(url, output=self._output, index_html=self._index_html))
+
+            logger.info('[ RESUME ] %d urls in the queue', len(self._frontier))
+        else:
+            self._database.clear_frontier()
+
+            for url in self._seeds:
+                path_to_resource_file = self._path_to_resource_file(url, output=self._output, index_html=self._index_html)
+
+                if path_to_resource_file in self._visited_paths: continue
+
+                if self._update and path_to_resource_file in self._saved_files:
+                    self._revalidating.add(url)
+
+                self._enqueue(HTML_FILE, url, 0)
+
+            self._database.commit()
+
+        if self._workers > 1:
+            download_pool = Download_Pool(self._download_content, self._workers, memory_governor=self._memory_governor)
+        else:
+            download_pool = None
+
+        if self._inventory is None:
+            inventory_file = None
+        elif self._inventory == "-":
+            inventory_file = sys.stdout
+        else:
+            inventory_file = open(self._inventory, "wb")
+
+        if inventory_file is not None:
+            self._inventory_writer = csv.writer(inventory_file)
+            self._inventory_writer.writerow(["url", "type", "status", "size", "referrer"])
+
+        if self._deadline is not None:
+            self._stop_time = time.time() + self._deadline
+
+        if self._stats_path is not None:
+            self._stats = Crawl_Stats()
+
+        try:
+            try:
+                self._crawl(download_pool)
+            except KeyboardInterrupt:
+                # The journal keeps the frontier, the crawl can be resumed
+                logger.info('[ STOP ] Interrupted, %d urls left in the queue', len(self._frontier))
+
+            if self._blob_store is not None:
+                blobs = self._blob_store.collect_garbage()
+                logger.info('[ DEDUPLICATION ] files: %d, blobs: %d, bytes saved: %d', self._blob_store.files, blobs, self._blob_store.bytes_saved)
+        finally:
+            if download_pool is not None:
+                download_pool.close()
+
+            self._session.close()
+            self._database.close()
+
+            memory_usage = self._visited_paths.memory_usage() + self._broken_urls.memory_usage() + self._saved_files.memory_usage()
+
+            for visited_index in (self._visited_paths, self._broken_urls, self._saved_files):
+                visited_index.close()
+
+            if self._archive is not None:
+                self._archive.close()
+                shutil.rmtree(self._temporary_directory)
+
+            if inventory_file is not None and inventory_file is not sys.stdout:
+                inventory_file.close()
+
+            logger.info('[ ENCODING SOURCES ] %s', self._encoding_detector.report())
+            logger.info('[ URL RESOLUTION CACHE ] hits: %d, misses: %d', self._resolution_cache.hits, self._resolution_cache.misses)
+            logger.info('[ RATE CONTROL ] %s', self._rate_controller.report())
+            logger.info('[ MEMORY ] %s', self._memory_governor.report())
+            logger.info('[ VISITED INDEX ] paths: %d, broken urls: %d, saved files: %d, memory: %d bytes', len(self._visited_paths), len(self._broken_urls), len(self._saved_files), memory_usage)
+
+            if self._stats.enabled:
+                for line in self._stats.summary():
+                    logger.info('[ STATS ] %s', line)
+
+                self._stats.dump(self._stats_path)
+
+    def _scan_saved_files(self):
+        '''Index the files saved in the output directory by previous crawls.'''
+
+        for dirpath, dirnames, filenames in os.walk(self._output):
+            if dirpath == self._output:
+                # Database, blobs and indexes of the crawler
+                dirnames[:] = [dirname for dirname in dirnames if not dirname.startswith(".save_webpage")]
+                filenames = [filename for filename in filenames if not filename.startswith(".save_webpage")]
+
+            for filename in filenames:
+                # Temporary file of a download which was interrupted
+                if filename.startswith(".") and filename.endswith(".part"): continue
+
+                self._saved_files.add(os.path.join(dirpath, filename))
+
+    def _enqueue(self, type_of_resource, url, depth, referrer=None):
+        self._visited_paths.add(self._path_to_resource_file(url, output=self._output, index_html=self._index_html))
+        self._frontier.push(type_of_resource, url, depth)
+        self._database.queue(type_of_resource, url, depth)
+
+        if type_of_resource == HTML_FILE:
+            self._queued_pages += 1
+
+        if self._inventory is not None:
+            self._referrers[url] = referrer
+
+    def _write_inventory_row(self, type_of_resource, url, response):
+        if response is None:
+            status = size = ""
+        else:
+            status = response.status_code
+
+            if type_of_resource in REWRITABLE_RESOURCES:
+                size = len(response.content)
+            else:
+                size = response.headers.get('content-length', "")
+
+        referrer = self._referrers.pop(url, None) or ""
+
+        self._inventory_writer.writerow([url.encode("utf-8"), RESOURCE_TYPE_NAMES[type_of_resource], status, size, referrer.encode("utf-8")])
+
+    def _download_content(self, type_of_resource, url):
+        '''Download url like download_content(). The duration of the download
+        is stored in the attribute download_time of the response.'''
+
+        if url in self._revalidating:
+            headers = self._database.conditional_headers(url)
+        else:
+            headers = None
+
+        start = time.time()
+
+        # Html, css and js files are read in memory, unless they turn out to
+        # be something else
+        if self._inventory is not None:
+            response = download_content(url, session=self._session, discard_body=True, rate_controller=self._rate_controller, type_of_resource=type_of_resource, memory_governor=self._memory_governor)
+        elif self._archive is not None:
+            response = download_content(url, session=self._session, stream_to=self._temporary_directory, rate_controller=self._rate_controller, type_of_resource=type_of_resource, memory_governor=self._memory_governor)
+        elif type_of_resource in REWRITABLE_RESOURCES:
+            # The directory of the file is only created if it's saved
+            response = download_content(url, session=self._session, stream_to=self._output, headers=headers, rate_controller=self._rate_controller, type_of_resource=type_of_resource, memory_governor=self._memory_governor)
+        else:
+            path_to_resource_file = self._path_to_resource_file(url, output=self._output, index_html=self._index_html)
+            make_directory(os.path.dirname(path_to_resource_file))
+
+            response = download_content(url, session=self._session, stream_to=os.path.dirname(path_to_resource_file), headers=headers, rate_controller=self._rate_controller, type_of_resource=type_of_resource, memory_governor=self._memory_governor)
+
+        if response is not None:
+            response.download_time = time.time() - start
+
+        return response
+
+    def _record_download(self, type_of_resource, response):
+        stats = self._stats
+
+        if response is None:
+            stats.count("errors", type_of_resource)
+            return
+
+        size = self._response_size(type_of_resource, response)
+        self._downloaded_bytes += size
+
+        if not stats.enabled: return
+
+        stats.count("resources", type_of_resource)
+        stats.count("bytes", type_of_resource, size)
+
+        # Time until the headers were parsed
+        ttfb = min(response.elapsed.total_seconds(), response.download_time)
+
+        stats.add_time("download", type_of_resource, response.download_time)
+        stats.add_time("ttfb", type_of_resource, ttfb)
+        stats.add_time("transfer", type_of_resource, response.download_time - ttfb)
+
+    def _archive_name(self, path_to_resource_file):
+        return os.path.relpath(path_to_resource_file, self._output).replace(os.sep, "/")
+
+    def _save_file(self, url, path_to_resource_file, response):
+        '''Save the body of a response streamed to a temporary file.'''
+
+        if self._archive is not None:
+            self._archive.add_file(self._archive_name(path_to_resource_file), url, response.temporary_file, response.headers.get("Content-Type", "application/octet-stream"))
+            os.remove(response.temporary_file)
+        else:
+            make_directory(os.path.dirname(path_to_resource_file))
+
+            if self._blob_store is not None:
+                self._blob_store.add_file(path_to_resource_file, response.temporary_file, response.content_hash)
+            else:
+                replace_file(response.temporary_file, path_to_resource_file)
+
+    def _save_content(self, url, path_to_resource_file, response, content, encoding=None):
+        '''Save content, encoded with encoding if it was decoded.'''
+
+        if self._archive is not None:
+            content_type = response.headers.get("Content-Type", "application/octet-stream")
+
+            if encoding is not None:
+                declared_charset = HTTP_CHARSET_RE.search(content_type)
+
+                # The DOM rewriter writes UTF-8 whatever the declared charset
+                if declared_charset is None or normalize_codec_name(declared_charset.group(1)) != encoding:
+                    content_type = "%s; charset=%s" % (content_type.split(";", 1)[0].strip(), encoding)
+
+            self._archive.add_content(self._archive_name(path_to_resource_file), url, content, content_type)
+            return
+
+        make_directory(os.path.dirname(path_to_resource_file))
+
+        if self._blob_store is not None:
+            self._blob_store.add_content(path_to_resource_file, content)
+        else:
+            temporary_file, content_hash = write_to_temporary_file([content], os.path.dirname(path_to_resource_file))
+            replace_file(temporary_file, path_to_resource_file)
+
+    def _create_resource_handler(self, base_url, links, referrer=None):
+        def resource_handler(type_of_resource, url):
+            links.append((type_of_resource, url, base_url))
+            return self._on_extracted_url(type_of_resource, url, base_url, referrer=referrer)
+
+        return resource_handler
+
+    def _create_style_rewriter(self, base_url, resource_handler):
+        def rewrite_style(style):
+            return self._rewrite_inline_style(style, base_url, resource_handler)
+
+        return rewrite_style
+
+    def _rewrite_inline_style(self, style, base_url, resource_handler):
+        '''Rewrite the urls of a style attribute.
+
+        Generated pages repeat the same styles in thousands of elements, so
+        every style is tokenized once and the rewritten style is memoized. The
+        urls are still passed to resource_handler, which records the links of
+        the page.
+        '''
+
+        key = (style, base_url)
+
+        memo = self._inline_styles.get(key)
+        if memo is None:
+            memo = [list(iter_css_urls(style)), None, style]
+            self._inline_styles.put(key, memo)
+
+        css_urls, new_urls, new_style = memo
+
+        if not css_urls:
+            return style
+
+        urls = process_css_urls(css_urls, resource_handler)
+
+        if urls == new_urls:
+            return new_style
+
+        if not any(urls):
+            # Only extracting links, keep the rewritten style
+            return style
+
+        memo[1] = urls
+        memo[2] = new_style = replace_css_urls(style, css_urls, urls)
+
+        return new_style
+
+    def _extract_urls(self, type_of_resource, url, response, links):
+        '''Pass the urls of the resource to the resource handler without
+        rewriting anything.
+
+        Returns the content to save: the original bytes of the response unless
+        some replacement is applied.
+        '''
+
+        content = response.content
+        stats = self._stats
+
+        if type_of_resource == JS_FILE:
+            with stats.stage("replacements", type_of_resource):
+                return self._replace_content(url, content)
+
+        with stats.stage("encoding", type_of_resource):
+            encoding = self._encoding_detector.detect(response, filetype=type_of_resource)
+            text = content.decode(encoding, 'strict')
+
+        with stats.stage("urls", type_of_resource):
+            if type_of_resource == HTML_FILE:
+                tags = list(iter_html_start_tags(text))
+                base_url = html_base_url_in_stream(text, url, tags)
+            else:
+                tags = None
+                base_url = url
+
+            links.extend(self._resolve_links_in_content(type_of_resource, text, base_url, tags=tags))
+
+            for type_of_link, link_url, base_url in links:
+                self._on_extracted_url(type_of_link, link_url, base_url, referrer=url)
+
+        if self._replacements:
+            with stats.stage("replacements", type_of_resource):
+                new_text = self._replace_content(url, text)
+
+            if new_text != text:
+                return new_text.encode(encoding)
+
+        return content
+
+    def _follow_recorded_links(self, record):
+        self._resolve_links(record["links"])
+
+        for type_of_resource, url, base_url in record["links"]:
+            self._on_extracted_url(type_of_resource, url, base_url)
+
+    @staticmethod
+    def _response_size(type_of_resource, response):
+        if response.status_code == 304:
+            return 0
+        elif getattr(response, "temporary_file", None) is not None:
+            return os.path.getsize(response.temporary_file)
+        elif type_of_resource in REWRITABLE_RESOURCES:
+            return len(response.content)
+        else:
+            # Only the headers were read
+            return 0
+
+    def _exhausted_budget(self):
+        '''Return why the crawl must stop, or None.'''
+
+        if self._max_bytes is not None and self._downloaded_bytes >= self._max_bytes:
+            return "Downloaded %d bytes" % self._downloaded_bytes
+
+        if self._stop_time is not None and time.time() >= self._stop_time:
+            return "Deadline reached"
+
+        return None
+
+    def _crawl(self, download_pool):
+        while len(self._frontier) != 0:
+            reason = self._exhausted_budget()
+            if reason is not None:
+                logger.info('[ STOP ] %s, %d urls left in the queue', reason, len(self._frontier))
+                break
+
+            entry = None
+
+            if download_pool is not None:
+                # Entries downloaded ahead are processed as soon as they are
+                # ready. Otherwise the crawl order can leave them behind, and
+                # the workers stay idle while they fill the window
+                entry = download_pool.ready()
+
+            if entry is None:
+                entry = self._frontier.pop()
+            else:
+                self._frontier.remove(entry)
+
+            type_of_resource, url, self._depth = entry
+            self._database.set_state(url, Mirror_Database.IN_FLIGHT)
+
+            path_to_resource_file = self._path_to_resource_file(url, output=self._output, index_html=self._index_html)
+
+            if download_pool is None:
+                # Measured as the download stage
+                response = self._download_content(type_of_resource, url)
+            else:
+                download_pool.prefetch(itertools.chain([entry], self._frontier.upcoming()))
+
+                with self._stats.stage("queue_wait", type_of_resource):
+                    response = download_pool.get(entry)
+
+            if response is not None:
+                # A link to a page can lead to a pdf or a video
+                type_of_resource = response.type_of_resource
+
+            try:
+                self._process_response(type_of_resource, url, path_to_resource_file, response)
+            finally:
+                if response is not None:
+                    release_response(response, self._memory_governor)
+
+            # The body is not kept while waiting for the next download
+            response = None
+
+    def _process_response(self, type_of_resource, url, path_to_resource_file, response):
+        self._record_download(type_of_resource, response)
+
+        if self._inventory_writer is not None:
+            self._write_inventory_row(type_of_resource, url, response)
+
+        if response is None:
+            logger.info('[ BROKEN URL ] - %s', url)
+            self._broken_urls.add(url)
+
+            # A file saved by a previous crawl is kept: the url can be broken
+            # only for a while, like when the server is down
+            self._visited_paths.discard(path_to_resource_file)
+            self._database.set_state(url, Mirror_Database.BROKEN)
+            return
+
+        if response.status_code == 304:
+            logger.info('[ NOT MODIFIED ] - %s', url)
+            self._stats.count("not_modified", type_of_resource)
+            self._follow_recorded_links(self._database.get(url))
+            self._database.set_state(url, Mirror_Database.DONE)
+            return
+
+        if self._inventory is not None:
+            if type_of_resource in REWRITABLE_RESOURCES:
+                self._extract_urls(type_of_resource, url, response, [])
+
+            self._database.set_state(url, Mirror_Database.DONE)
+            return
+
+        if type_of_resource not in REWRITABLE_RESOURCES:
+            with self._stats.stage("write", type_of_resource):
+                self._save_file(url, path_to_resource_file, response)
+            self._database.put(url, response, response.content_hash)
+            self._database.set_state(url, Mirror_Database.DONE)
+            return
+
+        content = response.content
+        content_hash = hashlib.sha1(content).hexdigest()
+
+        if url in self._revalidating:
+            # The server doesn't support conditional requests but the content is the same
+            record = self._database.get(url)
+
+            if record is not None and record["content_hash"] == content_hash:
+                logger.info('[ NOT MODIFIED ] - %s', url)
+                self._stats.count("not_modified", type_of_resource)
+                self._follow_recorded_links(record)
+                self._database.set_state(url, Mirror_Database.DONE)
+                return
+
+        links = []
+
+        # Encoding of the content to save, if it's decoded and rewritten
+        encoding = None
+
+        if self._mode == self.NO_CHANGE_MODE:
+            content = self._extract_urls(type_of_resource, url, response, links)
+
+        elif type_of_resource == HTML_FILE:
+            stats = self._stats
+
+            with stats.stage("encoding", HTML_FILE):
+                encoding = self._encoding_detector.detect(response, filetype=HTML_FILE)
+
+                content = content.decode(encoding, 'strict')
+
+            # Only the decoded document is kept from here on
+            response._content = None
+
+            if self._html_rewriter == "stream":
+                with stats.stage("urls", HTML_FILE):
+                    # The markup is only scanned once
+                    tags = list(iter_html_start_tags(content))
+                    base_url = html_base_url_in_stream(content, url, tags)
+
+                    self._resolve_links_in_content(HTML_FILE, content, base_url, tags=tags)
+
+                    resource_handler = self._create_resource_handler(base_url, links, referrer=url)
+                    content = process_urls_in_html_stream(content, resource_handler, self._create_style_rewriter(base_url, resource_handler), tags=tags)
+            else:
+                from bs4 import BeautifulSoup
+
+                with stats.stage("parse", HTML_FILE):
+                    soup = BeautifulSoup(content, self._parser)
+
+                with stats.stage("urls", HTML_FILE):
+                    base_url = html_base_url(soup, url)
+
+                    self._resolve_links_in_content(HTML_FILE, None, base_url, soup=soup)
+
+                    resource_handler = self._create_resource_handler(base_url, links, referrer=url)
+                    process_urls_in_html_document(soup, resource_handler, self._create_style_rewriter(base_url, resource_handler))
+
+                with stats.stage("parse", HTML_FILE):
+                    content = soup.decode(formatter="html")
+
+                    # The tree has reference cycles, it's not freed until the
+                    # garbage collector runs
+                    soup.decompose()
+
+                # The serialized tree declares utf-8 as charset
+                encoding = "utf-8"
+
+            with stats.stage("replacements", HTML_FILE):
+                content = self._replace_content(url, content)
+
+            content = content.encode(encoding)
+
+        elif type_of_resource == CSS_FILE:
+            stats = self._stats
+
+            resource_handler = self._create_resource_handler(url, links, referrer=url)
+
+            with stats.stage("encoding", CSS_FILE):
+                encoding = self._encoding_detector.detect(response, filetype=CSS_FILE)
+
+                content = content.decode(encoding, 'strict')
+
+            response._content = None
+
+            with stats.stage("urls", CSS_FILE):
+                css_urls = list(iter_css_urls(content))
+                self._resolve_links_in_content(CSS_FILE, content, url, css_urls=css_urls)
+
+                content = replace_css_urls(content, css_urls, process_css_urls(css_urls, resource_handler))
+
+            with stats.stage("replacements", CSS_FILE):
+                content = self._replace_content(url, content)
+
+            content = content.encode(encoding)
+
+        elif type_of_resource == JS_FILE:
+            with self._stats.stage("replacements", JS_FILE):
+                content = self._replace_content(url, content)
+
+        with self._stats.stage("write", type_of_resource):
+            self._save_content(url, path_to_resource_file, response, content, encoding)
+
+        self._database.put(url, response, content_hash, links)
+        self._database.set_state(url, Mirror_Database.DONE)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, epilog="""save_webpage.py:
+    Takes a list of url's and download the websites with all its internal resource files.
+    Transforms all internal resources so that they link to local files.
+    Process css files exctracting new resource and converting url's.
+    Possibility to replace javascript and html files using custom substitutions.
+    Full Unicode/UTF-8 support.""")
+
+    parser.add_argument("list_of_seed_urls", nargs='+', help="Seed urls")
+    parser.add_argument('-o', '--output', default="output", action='store', help="Output directory")
+    parser.add_argument('--version', action='version', version=__version__)
+    parser.add_argument('-q', '--quite', action='store_true', default=False, help="don't show verbose url get log in stderr")
+    parser.add_argument('--insecure', action='store_true', default=False, help="Ignore the certificate")
+    parser.add_argument("--forbidden-urls", nargs='+', help="Forbidden urls")
+    parser.add_argument('--follow-links', action='store_true', default=False, help="Follow links")
+    parser.add_argument('-b', '--base-url', action='store', help="Resolves relative links using URL as the point of reference")
+    parser.add_argument('--index-html', action='store', default="index.html", help="Default index file")
+    parser.add_argument('--mode', action='store',  default="relative", choices=["relative", "absolute", "nochange"], help="Mode of extraction")
+    parser.add_argument('--config', action='store', dest="path_to_config_file", help="Path to configuration file")
+    parser.add_argument('-w', '--workers', action='store', type=int, default=1, help="Number of concurrent downloads")
+    parser.add_argument('--max-connections', action='store', type=int, help="Maximum number of keep-alive connections per host")
+    parser.add_argument('--update', action='store_true', default=False, help="Revalidate the resources already saved in the output directory using conditional requests")
+    parser.add_argument('--resume', action='store_true', default=False, help="Resume the interrupted crawl saved in the output directory")
+    parser.add_argument('--parser', action='store', dest="html_parser", default=DEFAULT_HTML_PARSER, choices=HTML_PARSERS, help="HTML parser")
+    parser.add_argument('--html-rewriter', action='store', default="dom", choices=HTML_REWRITERS, help="Engine rewriting the urls of html pages")
+    parser.add_argument('--discover-only', action='store', dest="inventory", help="Don't save anything, only write the inventory of urls found as CSV in INVENTORY ('-' for stdout)")
+    parser.add_argument('--dedup', action='store_true', default=False, help="Store only once the files with the same content, using hardlinks")
+    parser.add_argument('--output-format', action='store', default="dir", choices=OUTPUT_FORMATS, help="Save the files in the output directory or in a single zip or WARC archive")
+    parser.add_argument('--max-per-host', action='store', type=int, help="Maximum number of requests in flight to the same host (default: the number of workers)")
+    parser.add_argument('--max-rate', action='store', type=float, help="Maximum number of requests per second to the same host")
+    parser.add_argument('--crawl-order', action='store', default="dfs", choices=CRAWL_ORDERS, help="Visit first the last found resources, the first found ones, or the closest ones to the seeds by type of resource")
+    parser.add_argument('--max-depth', action='store', type=int, help="Maximum number of links followed from the seeds")
+    parser.add_argument('--max-pages', action='store', type=int, help="Maximum number of pages to queue, counting the seeds")
+    parser.add_argument('--max-bytes', action='store', type=int, help="Stop after downloading this number of bytes")
+    parser.add_argument('--deadline', action='store', type=float, help="Stop after this number of seconds")
+    parser.add_argument('--visited-index', action='store', default="set", choices=VISITED_INDEXES, help="Index of the visited urls: in memory, or a Bloom filter backed by a file for millions of urls")
+    parser.add_argument('--stats', action='store', help="Measure the time spent in every stage of the crawl and write it with the counters of every type of resource in STATS, as JSON or in the text format of Prometheus if the extension is .prom")
+    parser.add_argument('--max-inflight-bytes', action='store', type=int, help="Stop downloading ahead while the documents held in memory add up to this number of bytes")
+    args = parser.parse_args()
+
+    if args.quite:
+        logger.setLevel(logging.WARNING)
+
+
+    list_of_seed_urls  = args.list_of_seed_urls
+    output = args.output
+    base_url = args.base_url
+    follow_links = args.follow_links
+    forbidden_urls = args.forbidden_urls
+    mode = args.mode
+    index_html = args.index_html
+    workers = args.workers
+    max_connections = args.max_connections
+    update = args.update
+    resume = args.resume
+    html_parser = args.html_parser
+    html_rewriter = args.html_rewriter
+    inventory = args.inventory
+    dedup = args.dedup
+    output_format = args.output_format
+    visited_index = args.visited_index
+    crawl_order = args.crawl_order
+    max_depth = args.max_depth
+    max_pages = args.max_pages
+    max_bytes = args.max_bytes
+    deadline = args.deadline
+    max_per_host = args.max_per_host
+    max_rate = args.max_rate
+    stats = args.stats
+    max_inflight_bytes = args.max_inflight_bytes
+
+    if mode == "relative":
+        mode = Save_Webpage.RELATIVE_MODE
+    elif mode == "absolute":
+        mode = Save_Webpage.ABSOLUTE_MODE
+    else:
+        mode = Save_Webpage.NO_CHANGE_MODE
+
+    replacements = None
+
+    if args.path_to_config_file:
+        config = json.parse(args.path_to_config_file)
+        if "base_url" in config:
+            base_url = config["base_url"]
+
+        if "follow_links" in config:
+            follow_links = config["follow_links"]
+
+        if "forbidden_urls" in config:
+            forbidden_urls = config["forbidden_urls"]
+
+        if "replacements" in config:
+            replacements = config["replacements"]
+
+        if "output" in config:
+            output = config["output"]
+
+        if "list_of_seed_urls" in config:
+            list_of_seed_urls = config["list_of_seed_urls"]
+
+        if "index_html" in config:
             index_html = config["index_html"]
 
         if "mode" in config:
             mode = config["mode"]
 
+        if "workers" in config:
+            workers = config["workers"]
+
+        if "max_connections" in config:
+            max_connections = config["max_connections"]
+
+        if "update" in config:
+            update = config["update"]
+
+        if "parser" in config:
+            html_parser = config["parser"]
+
+        if "html_rewriter" in config:
+            html_rewriter = config["html_rewriter"]
+
+        if "dedup" in config:
+            dedup = config["dedup"]
+
+        if "output_format" in config:
+            output_format = config["output_format"]
+
+        if "visited_index" in config:
+            visited_index = config["visited_index"]
+
+        if "crawl_order" in config:
+            crawl_order = config["crawl_order"]
+
+        if "max_depth" in config:
+            max_depth = config["max_depth"]
+
+        if "max_pages" in config:
+            max_pages = config["max_pages"]
+
+        if "max_bytes" in config:
+            max_bytes = config["max_bytes"]
+
+        if "deadline" in config:
+            deadline = config["deadline"]
+
+        if "max_per_host" in config:
+            max_per_host = config["max_per_host"]
+
+        if "max_rate" in config:
+            max_rate = config["max_rate"]
+
+        if "stats" in config:
+            stats = config["stats"]
+
+        if "max_inflight_bytes" in config:
+            max_inflight_bytes = config["max_inflight_bytes"]
+
 
     save_webpage = Save_Webpage(
                             list_of_seed_urls=list_of_seed_urls,
@@ -849,7 +3771,26 @@ def main():
                             replacements=replacements,
                             base_url=base_url,
                             mode = mode,
-                            index_html=index_html)
+                            index_html=index_html,
+                            workers=workers,
+                            max_connections=max_connections,
+                            update=update,
+                            resume=resume,
+                            parser=html_parser,
+                            html_rewriter=html_rewriter,
+                            inventory=inventory,
+                            dedup=dedup,
+                            output_format=output_format,
+                            visited_index=visited_index,
+                            crawl_order=crawl_order,
+                            max_depth=max_depth,
+                            max_pages=max_pages,
+                            max_bytes=max_bytes,
+                            deadline=deadline,
+                            max_per_host=max_per_host,
+                            max_rate=max_rate,
+                            stats=stats,
+                            max_inflight_bytes=max_inflight_bytes)
     save_webpage.run()
 
 if __name__ == '__main__':
@@ -0,0 +1,75 @@
+"""Local HTTP server for the tests."""
+
+import hashlib
+import threading
+
+import benchmark
+
+
+class Recording_Handler(benchmark.Synthetic_Site_Handler):
+
+    def do_GET(self):
+        site = self.server.site
+        site.requested_paths.append(self.path)
+
+        if not site.etags:
+            benchmark.Synthetic_Site_Handler.do_GET(self)
+            return
+
+        path = self.path.split("?", 1)[0]
+        if path == "/":
+            path = "/index.html"
+
+        if path not in site.files:
+            benchmark.Synthetic_Site_Handler.do_GET(self)
+            return
+
+        content_type, content = site.files[path]
+        etag = '"%s"' % hashlib.sha1(content).hexdigest()
+
+        if self.headers.get("If-None-Match") == etag:
+            site.not_modified_paths.append(self.path)
+
+            self.send_response(304)
+            self.send_header("ETag", etag)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("ETag", etag)
+        self.send_header("Content-Length", str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+
+class Local_Site(object):
+    '''Serve files, a dict mapping every path to its (content type, content)
+    pair, from a local HTTP server running in a thread. The paths of the
+    requests are appended to requested_paths.
+
+    With etags, the responses have an ETag and conditional requests are
+    answered with 304, appending their paths to not_modified_paths.'''
+
+    def __init__(self, files, etags=False):
+        self.files = files
+        self.etags = etags
+        self.requested_paths = []
+        self.not_modified_paths = []
+
+        self._server = benchmark.Synthetic_Site_Server()
+        self._server.RequestHandlerClass = Recording_Handler
+        self._server.site = self
+
+        self._thread = threading.Thread(target=self._server.serve_forever)
+        self._thread.daemon = True
+        self._thread.start()
+
+    @property
+    def url(self):
+        return self._server.url
+
+    def close(self):
+        self._server.shutdown()
+        self._server.server_close()
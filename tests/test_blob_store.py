@@ -0,0 +1,68 @@
+"""Content addressed storage of the saved files."""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from save_webpage import Blob_Store, write_to_temporary_file
+
+
+class Test_Blob_Store(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp(prefix="save_webpage_test.")
+        self.blob_store = Blob_Store(os.path.join(self.directory, Blob_Store.DIRNAME))
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def path(self, name):
+        return os.path.join(self.directory, name)
+
+    def read(self, name):
+        with open(self.path(name), "rb") as f:
+            return f.read()
+
+    def blobs(self):
+        return [blob for dirpath, dirnames, filenames in os.walk(self.blob_store._path) for blob in filenames]
+
+    def test_same_content_is_stored_once(self):
+        self.blob_store.add_content(self.path("a"), b"content")
+        self.blob_store.add_content(self.path("b"), b"content")
+
+        temporary_file, content_hash = write_to_temporary_file([b"content"], self.directory)
+        self.blob_store.add_file(self.path("c"), temporary_file, content_hash)
+
+        self.assertFalse(os.path.exists(temporary_file))
+        self.assertEqual(len(self.blobs()), 1)
+        self.assertEqual(self.blob_store.files, 3)
+        self.assertEqual(self.blob_store.bytes_saved, 2 * len(b"content"))
+
+        for name in ("a", "b", "c"):
+            self.assertEqual(self.read(name), b"content")
+
+    def test_replaced_files_are_not_written_in_place(self):
+        self.blob_store.add_content(self.path("a"), b"old")
+        self.blob_store.add_content(self.path("b"), b"old")
+
+        self.blob_store.add_content(self.path("a"), b"new")
+
+        self.assertEqual(self.read("a"), b"new")
+        self.assertEqual(self.read("b"), b"old")
+
+    def test_collect_garbage(self):
+        self.blob_store.add_content(self.path("a"), b"a")
+        self.blob_store.add_content(self.path("b"), b"b")
+        self.blob_store.add_content(self.path("c"), b"b")
+
+        os.remove(self.path("a"))
+        os.remove(self.path("b"))
+
+        self.assertEqual(self.blob_store.collect_garbage(), 1)
+        self.assertEqual(len(self.blobs()), 1)
+        self.assertEqual(self.read("c"), b"b")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,50 @@
+"""Types of resources by extension, Content-Type and magic bytes."""
+
+import codecs
+import unittest
+
+import save_webpage
+from save_webpage import HTML_FILE, CSS_FILE, JS_FILE, IMAGE_FILE, VIDEO_FILE, FONT_FILE, OTHER_RESOURCE
+
+
+class Test_Classifier(unittest.TestCase):
+
+    def test_extension(self):
+        self.assertEqual(save_webpage.resource_type_using_extension("http://example.com/a.PNG?x=1"), IMAGE_FILE)
+        self.assertEqual(save_webpage.resource_type_using_extension("http://example.com/a.css"), CSS_FILE)
+        self.assertEqual(save_webpage.resource_type_using_extension("http://example.com/a.woff2"), FONT_FILE)
+        self.assertEqual(save_webpage.resource_type_using_extension("http://example.com/a.tar.gz"), OTHER_RESOURCE)
+        self.assertEqual(save_webpage.resource_type_using_extension("http://example.com/a.html"), HTML_FILE)
+        self.assertIsNone(save_webpage.resource_type_using_extension("http://example.com/download"))
+
+    def test_content_type(self):
+        self.assertEqual(save_webpage.resource_type_using_content_type("text/html; charset=utf-8"), HTML_FILE)
+        self.assertEqual(save_webpage.resource_type_using_content_type("image/svg+xml"), IMAGE_FILE)
+        self.assertIsNone(save_webpage.resource_type_using_content_type("application/octet-stream"))
+
+    def test_magic_bytes(self):
+        self.assertEqual(save_webpage.resource_type_using_magic_bytes(b"\x89PNG\r\n\x1a\n...."), IMAGE_FILE)
+        self.assertEqual(save_webpage.resource_type_using_magic_bytes(b"%PDF-1.4"), OTHER_RESOURCE)
+        self.assertEqual(save_webpage.resource_type_using_magic_bytes(b"\x00\x00\x00\x18ftypmp42"), VIDEO_FILE)
+        self.assertIsNone(save_webpage.resource_type_using_magic_bytes(b"<html>"))
+
+    def test_classify_response(self):
+        # The content wins over the Content-Type
+        self.assertEqual(save_webpage.classify_response(HTML_FILE, "text/html", b"%PDF-1.4 ..."), OTHER_RESOURCE)
+        self.assertEqual(save_webpage.classify_response(HTML_FILE, "application/pdf", b"..."), OTHER_RESOURCE)
+
+        # Binary data without Content-Type
+        self.assertEqual(save_webpage.classify_response(HTML_FILE, "", b"\x00\x01\x02"), OTHER_RESOURCE)
+
+        # Text in UTF-16 has null bytes
+        self.assertEqual(save_webpage.classify_response(HTML_FILE, "", codecs.BOM_UTF16_LE + u"<html>".encode("utf-16-le")), HTML_FILE)
+
+        self.assertEqual(save_webpage.classify_response(CSS_FILE, "text/css", b"body {}"), CSS_FILE)
+        self.assertEqual(save_webpage.classify_response(JS_FILE, "", b"var x;"), JS_FILE)
+
+        # Only html, css and js files are checked
+        self.assertEqual(save_webpage.classify_response(IMAGE_FILE, "text/html", b"<html>"), IMAGE_FILE)
+
+
+if __name__ == '__main__':
+    unittest.main()
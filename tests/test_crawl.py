@@ -0,0 +1,418 @@
+# -*- coding: utf-8 -*-
+
+"""Crawls of a local site."""
+
+import os
+import csv
+import json
+import shutil
+import logging
+import zipfile
+import tempfile
+import unittest
+
+import save_webpage
+from save_webpage import Save_Webpage
+
+from tests.local_site import Local_Site
+
+
+PDF = b"%PDF-1.4\n" + b"\x00\x01\x02\x03" * 100
+
+FILES = {
+    "/index.html": ("text/html; charset=utf-8", u'''<html><head><link rel="stylesheet" href="/css/main.css"></head>
+<body><h1>Índice</h1>
+<img src="/img/a.png" srcset="/img/a.png 1x, /img/b.png 2x"> <img src="/img/logo.svg">
+<a href="/pages/page1.html">1</a> <a href="/doc">pdf</a> <a href="/missing.html">missing</a>
+</body></html>'''.encode("utf-8")),
+    "/pages/page1.html": ("text/html", b'<html><body><img src="../img/c.png"><a href="/index.html">home</a> <a href="latin1.html">latin1</a></body></html>'),
+    "/pages/latin1.html": ("text/html; charset=iso-8859-1", u'<html><body><p>Caf\xe9</p></body></html>'.encode("iso-8859-1")),
+    "/css/main.css": ("text/css", b'@import "extra.css";\nbody { background: url(../img/bg.png) }'),
+    "/css/extra.css": ("text/css", b'p { color: red }'),
+    "/img/logo.svg": ("image/svg+xml", b'<svg xmlns="http://www.w3.org/2000/svg"><rect width="10" height="10"/></svg>' * 10),
+    # Served without extension nor Content-Type of pdf
+    "/doc": ("application/octet-stream", PDF),
+}
+
+for name in ("a", "b", "c", "bg"):
+    FILES["/img/%s.png" % name] = ("image/png", b"\x89PNG\r\n\x1a\n" + name.encode("ascii") * 1000)
+
+SAVED_FILES = set(["index.html", "pages/page1.html", "pages/latin1.html", "img/logo.svg", "css/main.css", "css/extra.css", "doc", "img/a.png", "img/b.png", "img/c.png", "img/bg.png"])
+
+
+def saved_files(output):
+    '''Return a dict mapping the paths of the files of a mirror to their
+    content.'''
+
+    files = {}
+
+    for dirpath, dirnames, filenames in os.walk(output):
+        if dirpath == output:
+            dirnames[:] = [dirname for dirname in dirnames if not dirname.startswith(".save_webpage")]
+            filenames = [filename for filename in filenames if not filename.startswith(".save_webpage")]
+
+        for filename in filenames:
+            path = os.path.join(dirpath, filename)
+
+            with open(path, "rb") as f:
+                files[os.path.relpath(path, output).replace(os.sep, "/")] = f.read()
+
+    return files
+
+
+class Test_Crawl(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        save_webpage.logger.setLevel(logging.WARNING)
+        cls.site = Local_Site(FILES)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.site.close()
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp(prefix="save_webpage_test.")
+        self.output = os.path.join(self.directory, "output")
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def crawl(self, **kwargs):
+        kwargs.setdefault("output", self.output)
+        kwargs.setdefault("mode", Save_Webpage.RELATIVE_MODE)
+
+        save_webpage = Save_Webpage([self.site.url], follow_links=True, **kwargs)
+        save_webpage.run()
+
+        return save_webpage
+
+    def test_relative_mirror(self):
+        self.crawl()
+
+        files = saved_files(self.output)
+        self.assertEqual(set(files), SAVED_FILES)
+
+        # Urls which are not absolute are kept
+        index = files["index.html"].decode("utf-8")
+        self.assertIn(u'srcset="/img/a.png 1x, /img/b.png 2x"', index)
+        self.assertIn(u'&Iacute;ndice', index)
+
+        self.assertEqual(files["css/main.css"], FILES["/css/main.css"][1])
+
+        # A link to a page leading to a pdf is saved untouched
+        self.assertEqual(files["doc"], PDF)
+
+    def test_absolute_mirror(self):
+        self.crawl(mode=Save_Webpage.ABSOLUTE_MODE, base_url="http://mirror.test/")
+
+        files = saved_files(self.output)
+        self.assertEqual(set(files), SAVED_FILES)
+
+        index = files["index.html"].decode("utf-8")
+        self.assertIn(u'href="http://mirror.test/css/main.css"', index)
+        self.assertIn(u'srcset="http://mirror.test/img/a.png 1x, http://mirror.test/img/b.png 2x"', index)
+        self.assertIn(u'href="http://mirror.test/pages/page1.html"', index)
+
+    def test_same_mirror_with_workers(self):
+        self.crawl()
+        expected = saved_files(self.output)
+        shutil.rmtree(self.output)
+
+        self.crawl(workers=4)
+        self.assertEqual(saved_files(self.output), expected)
+
+    def test_same_mirror_with_exhausted_memory(self):
+        self.crawl()
+        expected = saved_files(self.output)
+        shutil.rmtree(self.output)
+
+        save_webpage = self.crawl(workers=4, max_inflight_bytes=1)
+        self.assertEqual(saved_files(self.output), expected)
+
+        memory_governor = save_webpage._memory_governor
+        self.assertEqual(memory_governor.in_use, 0)
+        self.assertGreater(memory_governor.throttled, 0)
+
+
+    def test_resume(self):
+        self.crawl()
+        expected = saved_files(self.output)
+        shutil.rmtree(self.output)
+
+        # Saved by a previous crawl
+        os.makedirs(os.path.join(self.output, "img"))
+        with open(os.path.join(self.output, "img", "c.png"), "wb") as f:
+            f.write(expected["img/c.png"])
+
+        # The budget stops the crawl after the first download
+        self.crawl(max_bytes=1)
+        self.assertEqual(set(saved_files(self.output)), set(["index.html", "img/c.png"]))
+
+        del self.site.requested_paths[:]
+
+        # Only the queued urls are downloaded
+        self.crawl(resume=True)
+        self.assertEqual(saved_files(self.output), expected)
+
+        self.assertNotIn("/", self.site.requested_paths)
+        self.assertNotIn("/img/c.png", self.site.requested_paths)
+        self.assertEqual(len(self.site.requested_paths), len(set(self.site.requested_paths)))
+    def test_nochange_mode_keeps_the_original_bytes(self):
+        self.crawl(mode=Save_Webpage.NO_CHANGE_MODE, html_rewriter="stream")
+
+        files = saved_files(self.output)
+        self.assertEqual(set(files), SAVED_FILES)
+
+        for path, content in files.items():
+            self.assertEqual(content, FILES["/" + path][1], path)
+
+    def test_discover_only(self):
+        os.makedirs(self.output)
+
+        # Not removed although its url is broken
+        with open(os.path.join(self.output, "missing.html"), "wb") as f:
+            f.write(b"old")
+
+        inventory = os.path.join(self.directory, "inventory.csv")
+        self.crawl(inventory=inventory)
+
+        self.assertEqual(saved_files(self.output), {"missing.html": b"old"})
+
+        with open(inventory, "rb") as f:
+            rows = list(csv.DictReader(f))
+
+        urls = dict((row["url"], row) for row in rows)
+        self.assertEqual(len(urls), len(SAVED_FILES) + 1)
+
+        self.assertEqual(urls[self.site.url + "missing.html"]["status"], "")
+        self.assertEqual(urls[self.site.url + "css/extra.css"]["referrer"], self.site.url + "css/main.css")
+        self.assertEqual(urls[self.site.url + "doc"]["type"], "other")
+
+    def test_dedup(self):
+        self.crawl()
+        expected = saved_files(self.output)
+        shutil.rmtree(self.output)
+
+        self.crawl(dedup=True)
+        self.assertEqual(saved_files(self.output), expected)
+
+        # Crawled again, the files are still linked to their blobs
+        self.crawl(dedup=True)
+        self.assertEqual(saved_files(self.output), expected)
+        self.assertEqual(os.stat(os.path.join(self.output, "img", "a.png")).st_nlink, 2)
+
+    def test_zip_archive(self):
+        os.makedirs(self.output)
+
+        with open(os.path.join(self.output, "missing.html"), "wb") as f:
+            f.write(b"old")
+
+        self.crawl(output_format="zip")
+
+        with zipfile.ZipFile(self.output + ".zip") as archive:
+            self.assertEqual(set(archive.namelist()), SAVED_FILES)
+
+            self.assertEqual(archive.read("doc"), PDF)
+
+            # Only the resources which aren't compressed yet
+            self.assertEqual(archive.getinfo("css/main.css").compress_type, zipfile.ZIP_DEFLATED)
+            self.assertEqual(archive.getinfo("img/logo.svg").compress_type, zipfile.ZIP_DEFLATED)
+            self.assertEqual(archive.getinfo("img/a.png").compress_type, zipfile.ZIP_STORED)
+
+        self.assertEqual(saved_files(self.output), {"missing.html": b"old"})
+
+    def read_warc_records(self, html_rewriter):
+        '''Crawl to a WARC file and return a dict mapping the path of every
+        record in the index to its headers and its content.'''
+
+        self.crawl(output_format="warc", html_rewriter=html_rewriter)
+
+        with open(self.output + ".warc", "rb") as f:
+            warc = f.read()
+
+        with open(self.output + ".warc.idx", "rb") as f:
+            rows = list(csv.DictReader(f))
+
+        self.assertTrue(warc.startswith(b"WARC/1.0\r\nWARC-Type: warcinfo\r\n"))
+
+        records = {}
+
+        for row in rows:
+            offset = int(row["offset"])
+            record = warc[offset:offset + int(row["length"])]
+
+            head, content = record.split(b"\r\n\r\n", 1)
+            self.assertTrue(content.endswith(b"\r\n\r\n"))
+            content = content[:-4]
+
+            lines = head.split(b"\r\n")
+            self.assertEqual(lines[0], b"WARC/1.0")
+
+            headers = dict(line.split(b": ", 1) for line in lines[1:])
+            self.assertEqual(headers["WARC-Type"], b"resource")
+            self.assertEqual(headers["WARC-Target-URI"], row["url"])
+            self.assertEqual(int(headers["Content-Length"]), len(content))
+
+            records[row["path"]] = headers, content
+
+        self.assertEqual(set(records), SAVED_FILES)
+
+        return records
+
+    def test_warc_archive(self):
+        records = self.read_warc_records("dom")
+
+        headers, content = records["doc"]
+        self.assertEqual(content, PDF)
+        self.assertEqual(headers["Content-Type"], b"application/octet-stream")
+
+        # The tree of the page is serialized in UTF-8
+        headers, content = records["pages/latin1.html"]
+        self.assertEqual(headers["Content-Type"], b"text/html; charset=utf-8")
+        self.assertIn(u"Caf\xe9", content.decode("utf-8").replace(u"&eacute;", u"\xe9"))
+
+        self.assertFalse(os.path.exists(self.output))
+
+    def test_warc_archive_with_stream_rewriter(self):
+        records = self.read_warc_records("stream")
+
+        headers, content = records["pages/latin1.html"]
+        self.assertEqual(headers["Content-Type"], b"text/html; charset=iso-8859-1")
+        self.assertEqual(content, FILES["/pages/latin1.html"][1])
+    def test_budget_stop_with_workers_leaves_no_temporary_files(self):
+        self.crawl(max_bytes=1, workers=4)
+
+        for dirpath, dirnames, filenames in os.walk(self.output):
+            for filename in filenames:
+                self.assertFalse(filename.endswith(".part"), filename)
+
+    def test_max_pages_with_resume(self):
+        # The budget stops the crawl after the first download
+        self.crawl(max_pages=3, max_bytes=1)
+
+        del self.site.requested_paths[:]
+        self.crawl(max_pages=3, resume=True)
+
+        self.assertIn("/pages/page1.html", self.site.requested_paths)
+        self.assertIn("/doc", self.site.requested_paths)
+
+        # The queue was already full
+        self.assertNotIn("/missing.html", self.site.requested_paths)
+        self.assertNotIn("/pages/latin1.html", self.site.requested_paths)
+
+    def test_stats(self):
+        path = os.path.join(self.directory, "stats.json")
+        self.crawl(stats=path, workers=4)
+
+        with open(path) as f:
+            stats = json.load(f)
+
+        resources = stats["resources"]
+        self.assertEqual(resources["html"]["resources"], 3)
+        self.assertEqual(resources["html"]["errors"], 1)
+        self.assertEqual(resources["css"]["resources"], 2)
+        # The urls of srcset are of type other
+        images = ["/img/a.png", "/img/c.png", "/img/bg.png", "/img/logo.svg"]
+        self.assertEqual(resources["image"]["resources"], len(images))
+        self.assertEqual(resources["image"]["bytes"], sum(len(FILES[path][1]) for path in images))
+
+        for stage in ("queue_wait", "download", "encoding", "parse", "urls", "write"):
+            self.assertIn("html", stats["stages"][stage], stage)
+
+class Test_Update(unittest.TestCase):
+
+    def setUp(self):
+        save_webpage.logger.setLevel(logging.WARNING)
+
+        self.directory = tempfile.mkdtemp(prefix="save_webpage_test.")
+        self.output = os.path.join(self.directory, "output")
+
+    def tearDown(self):
+        self.site.close()
+        shutil.rmtree(self.directory)
+
+    def crawl(self, **kwargs):
+        save_webpage = Save_Webpage([self.site.url], follow_links=True, output=self.output, mode=Save_Webpage.RELATIVE_MODE, **kwargs)
+        save_webpage.run()
+
+        return save_webpage
+
+    def tamper(self, path):
+        with open(os.path.join(self.output, path), "ab") as f:
+            f.write(b"tampered")
+
+    def test_not_modified(self):
+        self.site = Local_Site(dict(FILES), etags=True)
+
+        self.crawl()
+        self.tamper("index.html")
+        self.tamper("img/a.png")
+        expected = saved_files(self.output)
+
+        del self.site.requested_paths[:]
+        self.crawl(update=True)
+
+        # Every saved resource is revalidated and kept
+        self.assertEqual(saved_files(self.output), expected)
+        self.assertEqual(sorted(self.site.not_modified_paths), sorted(path for path in self.site.requested_paths if path != "/missing.html"))
+        self.assertIn("/pages/page1.html", self.site.not_modified_paths)
+
+    def test_same_content(self):
+        self.site = Local_Site(dict(FILES))
+
+        self.crawl()
+        self.tamper("index.html")
+        self.tamper("css/extra.css")
+
+        self.site.files["/css/extra.css"] = ("text/css", b"p { color: blue }")
+        self.crawl(update=True)
+
+        files = saved_files(self.output)
+
+        # The server doesn't support conditional requests, but the page
+        # has the same content
+        self.assertTrue(files["index.html"].endswith(b"tampered"))
+        self.assertEqual(files["css/extra.css"], b"p { color: blue }")
+
+
+    def test_resume(self):
+        self.site = Local_Site(dict(FILES), etags=True)
+
+        self.crawl()
+        expected = saved_files(self.output)
+
+        # The budget stops the revalidation after the changed page
+        self.site.files["/index.html"] = ("text/html", FILES["/index.html"][1].replace(b"<h1>", b"<h1>New "))
+        self.crawl(update=True, max_bytes=1)
+
+        del self.site.requested_paths[:]
+        del self.site.not_modified_paths[:]
+        self.crawl(update=True, resume=True)
+
+        self.assertNotIn("/", self.site.requested_paths)
+        self.assertEqual(sorted(self.site.not_modified_paths), sorted(path for path in self.site.requested_paths if path != "/missing.html"))
+
+        files = saved_files(self.output)
+        self.assertIn(b"New ", files["index.html"])
+
+        del files["index.html"], expected["index.html"]
+        self.assertEqual(files, expected)
+
+    def test_broken_urls_keep_the_mirror(self):
+        self.site = Local_Site(dict(FILES))
+
+        self.crawl()
+        expected = saved_files(self.output)
+
+        # The server is down
+        self.site.close()
+
+        self.crawl()
+        self.assertEqual(saved_files(self.output), expected)
+
+        self.crawl(update=True)
+        self.assertEqual(saved_files(self.output), expected)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,137 @@
+"""Downloads in background threads."""
+
+import time
+import unittest
+
+from save_webpage import Download_Pool, Memory_Governor, read_in_memory, release_response
+
+
+class Response(object):
+    pass
+
+
+class Test_Download_Pool(unittest.TestCase):
+
+    def setUp(self):
+        self.downloaded = []
+
+    def download(self, type_of_resource, url):
+        self.downloaded.append(url)
+        return "content of " + url
+
+    def entries(self, number):
+        return [(1, "http://example.com/%d" % i, 0) for i in range(number)]
+
+    def wait_results(self, pool, number):
+        '''Wait until number downloads are finished and not collected.'''
+
+        for i in range(500):
+            with pool._condition:
+                if sum(1 for response in pool._results.values() if response is not pool._PENDING) >= number: break
+
+            time.sleep(0.01)
+
+    def test_get(self):
+        pool = Download_Pool(self.download, workers=2)
+
+        try:
+            for entry in self.entries(10):
+                self.assertEqual(pool.get(entry), "content of " + entry[1])
+        finally:
+            pool.close()
+
+    def test_results_not_collected_are_bounded_by_the_window(self):
+        entries = self.entries(20)
+        pool = Download_Pool(self.download, workers=2, window=4)
+
+        try:
+            for i in range(3):
+                pool.prefetch(entries)
+                self.wait_results(pool, 4)
+
+            # Nothing is collected, so nothing more is downloaded
+            self.assertEqual(sorted(self.downloaded), [url for type_of_resource, url, depth in entries[:4]])
+            self.assertEqual(pool.ready(), entries[0])
+
+            pool.get(entries[0])
+            pool.prefetch(entries[1:])
+            self.wait_results(pool, 4)
+
+            self.assertEqual(len(self.downloaded), 5)
+        finally:
+            pool.close()
+
+
+class Test_Memory_Governor(unittest.TestCase):
+
+    SIZE = 60
+
+    def setUp(self):
+        self.memory_governor = Memory_Governor(max_bytes=100)
+        self.downloaded = []
+
+    def download(self, type_of_resource, url):
+        self.downloaded.append(url)
+
+        response = Response()
+        response.content = read_in_memory([b"x" * (self.SIZE // 2)] * 2, self.memory_governor)
+        response.memory_bytes = len(response.content)
+
+        return response
+
+    def entries(self, number):
+        return [(0, "http://example.com/%d" % i, 0) for i in range(number)]
+
+    def test_read_in_memory(self):
+        self.assertEqual(read_in_memory([b"ab", b"c"], self.memory_governor), b"abc")
+        self.assertEqual(self.memory_governor.in_use, 3)
+
+        def chunks():
+            yield b"abcd"
+            raise IOError("Connection reset")
+
+        self.assertRaises(IOError, read_in_memory, chunks(), self.memory_governor)
+        self.assertEqual(self.memory_governor.in_use, 3)
+        self.assertEqual(self.memory_governor.peak, 7)
+
+        self.memory_governor.release(3)
+        self.assertFalse(self.memory_governor.exhausted())
+
+    def test_prefetch_stops_while_the_budget_is_exhausted(self):
+        entries = self.entries(10)
+        pool = Download_Pool(self.download, workers=2, window=8, memory_governor=self.memory_governor)
+
+        try:
+            pool.prefetch(entries[:2])
+            pool.get(entries[0])
+            pool.get(entries[1])
+            self.assertTrue(self.memory_governor.exhausted())
+
+            pool.prefetch(entries[2:])
+            self.assertEqual(len(self.downloaded), 2)
+            self.assertEqual(self.memory_governor.throttled, 1)
+
+            # The resource that the crawl waits for is always downloaded
+            response = pool.get(entries[2])
+            self.assertEqual(response.content, b"x" * self.SIZE)
+            self.assertEqual(self.memory_governor.in_use, 3 * self.SIZE)
+
+            release_response(response, self.memory_governor)
+            self.assertEqual(self.memory_governor.in_use, 2 * self.SIZE)
+        finally:
+            pool.close()
+
+    def test_results_not_collected_are_released(self):
+        entries = self.entries(4)
+        pool = Download_Pool(self.download, workers=2, memory_governor=self.memory_governor)
+
+        pool.prefetch(entries)
+        pool.get(entries[0])
+        pool.close()
+
+        # Only the collected response is held
+        self.assertEqual(self.memory_governor.in_use, self.SIZE)
+
+
+if __name__ == '__main__':
+    unittest.main()
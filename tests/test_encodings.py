@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+
+"""Detection of the encoding of documents."""
+
+import codecs
+import unittest
+
+import save_webpage
+from save_webpage import HTML_FILE
+
+
+class Response(object):
+
+    def __init__(self, url, content, content_type="text/html"):
+        self.url = url
+        self.content = content
+        self.headers = {"content-type": content_type}
+
+
+class Test_Encoding_Detector(unittest.TestCase):
+
+    def setUp(self):
+        self.detector = save_webpage.Encoding_Detector()
+
+    def detect(self, url, content, content_type="text/html"):
+        return codecs.lookup(self.detector.detect(Response(url, content, content_type), filetype=HTML_FILE)).name
+
+    def test_declarations(self):
+        self.assertEqual(self.detect("http://example.com/a", u"<p>ñ</p>".encode("latin-1"), "text/html; charset=ISO-8859-1"), "iso8859-1")
+        self.assertEqual(self.detect("http://example.com/b", u'<meta charset="windows-1252"><p>ñ</p>'.encode("cp1252")), "cp1252")
+        self.assertEqual(self.detect("http://example.com/c", codecs.BOM_UTF16_LE + u"<p>ñ</p>".encode("utf-16-le")), "utf-16")
+
+    def test_cache_doesnt_override_utf8(self):
+        self.detect("http://example.com/latin", u'<meta charset="iso-8859-1"><p>Bäcker</p>'.encode("latin-1"))
+
+        self.assertEqual(self.detect("http://example.com/utf8", u"<p>Bäcker</p>".encode("utf-8")), "utf-8")
+        self.assertEqual(self.detector.counters["cache"], 0)
+
+    def test_cache(self):
+        self.detect("http://example.com/latin", u'<meta charset="iso-8859-1"><p>Bäcker</p>'.encode("latin-1"))
+
+        self.assertEqual(self.detect("http://example.com/other", u"<p>Größe</p>".encode("latin-1")), "iso8859-1")
+        self.assertEqual(self.detector.counters["cache"], 1)
+
+    def test_bom_is_not_cached(self):
+        self.detect("http://example.com/utf16", codecs.BOM_UTF16_LE + u"<p>ñ</p>".encode("utf-16-le"))
+
+        self.assertEqual(self.detect("http://example.com/ascii", b"<p>plain text</p>"), "utf-8")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,115 @@
+# -*- coding: utf-8 -*-
+
+"""The html parsers and the stream tokenizer extract the same urls."""
+
+import unittest
+
+from bs4 import BeautifulSoup
+
+import save_webpage
+
+
+PAGES = [
+u'''<!DOCTYPE html>
+<html>
+<head>
+<meta charset="utf-8">
+<title>Title &amp; <img src="title.png"></title>
+<base target="_blank">
+<link rel="stylesheet" href="css/main.css">
+<link rel="icon" href="/favicon.ico">
+<link rel=preload href="fonts/font.woff2" as=font>
+<script src="js/app.js"></script>
+<script>var image = "<img src='script.png'>";</script>
+<style>body { background: url(img/bg.png) } @import "extra.css";</style>
+</head>
+<body background="img/body.png">
+<img src="img/a.png" srcset="img/a.png 1x, img/b.png 2x" alt="a">
+<IMG SRC="img/upper.png">
+<a href="page.html">page</a>
+<a href='query.html?x=1&amp;y=2'>query</a>
+<div style="background-image: url('img/c.png')">c</div>
+<video src=video.mp4 poster=poster.jpg><source src="video.webm"></video>
+<picture><img src="img/d.png"></picture>
+<object data="object.swf"></object>
+<embed src="embed.swf">
+<iframe src="frame.html"></iframe>
+<form action="submit.php"><input type="image" src="button.png"></form>
+<noscript><img src="noscript.png"></noscript>
+<!-- <img src="comment.png"> -->
+</body>
+</html>
+''',
+
+# Raw text elements: their content is text, not markup
+u'''<html><head><title><img src="title.png"></title></head>
+<body>
+<textarea><img src="textarea.png"></textarea>
+<xmp><img src="xmp.png"></xmp>
+<iframe src="frame.html"><img src="iframe.png"></iframe>
+<noembed><img src="noembed.png"></noembed>
+<img src="after.png">
+<plaintext><img src="plaintext.png">
+''',
+
+# Broken markup
+u'''<p>Unclosed <img src=unclosed.png>
+<table><tr><td><img src=cell.png></table>
+<a href=first.html><div><a href=nested.html>nested</a></div>
+<ul><li><img src="item1.png"><li><img src="item2.png"></ul>
+<p style="background: url(&quot;img/quoted.png&quot;)">quoted</p>
+<img src="img/entity&amp;.png">
+''',
+
+# Quotes which don't delimit a value
+u'''<a href=foo.html title=it's>it's</a>
+<img alt=a"b src="quote.png">
+<a title='x > y' href="after.html">after</a>
+''',
+]
+
+
+def extract_urls_with_parser(page, parser):
+    urls = []
+    save_webpage.process_urls_in_html_document(BeautifulSoup(page, parser), lambda type_of_resource, url: urls.append(url))
+
+    return set(urls)
+
+
+def extract_urls_with_stream(page):
+    urls = []
+    save_webpage.extract_urls_from_html_stream(page, lambda type_of_resource, url: urls.append(url))
+
+    return set(urls)
+
+
+class Test_Parsers(unittest.TestCase):
+
+    def test_same_urls_in_every_parser(self):
+        for page in PAGES:
+            expected = extract_urls_with_parser(page, "html5lib")
+
+            for parser in save_webpage.HTML_PARSERS:
+                self.assertEqual(extract_urls_with_parser(page, parser), expected, "%s: %r" % (parser, page[:60]))
+
+            self.assertEqual(extract_urls_with_stream(page), expected, "stream: %r" % page[:60])
+
+    def test_raw_text_is_not_markup(self):
+        for parser in save_webpage.HTML_PARSERS:
+            self.assertEqual(extract_urls_with_parser(PAGES[1], parser), set([u"frame.html", u"after.png"]), parser)
+
+    def test_quotes_in_unquoted_values(self):
+        self.assertEqual(extract_urls_with_stream(PAGES[3]), set([u"foo.html", u"quote.png", u"after.html"]))
+
+    def test_urls_of_a_page(self):
+        urls = extract_urls_with_parser(PAGES[0], "html5lib")
+
+        for url in (u"css/main.css", u"js/app.js", u"img/b.png", u"img/bg.png", u"extra.css", u"img/c.png", u"query.html?x=1&y=2", u"poster.jpg", u"noscript.png"):
+            self.assertIn(url, urls)
+
+        for url in (u"title.png", u"script.png", u"comment.png"):
+            self.assertNotIn(url, urls)
+
+
+if __name__ == '__main__':
+    unittest.main()
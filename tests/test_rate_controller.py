@@ -0,0 +1,142 @@
+"""Throttling of the requests sent to every host."""
+
+import time
+import threading
+import unittest
+import email.utils
+
+from save_webpage import Rate_Controller, retry_after_seconds
+
+
+HOST = "example.com"
+
+
+class Test_Rate_Controller(unittest.TestCase):
+
+    def setUp(self):
+        self.rate_controller = Rate_Controller(max_in_flight=4)
+        self.state = self.rate_controller._hosts[HOST]
+
+    def request(self, status_code=200, latency=0.01, retry_after=None):
+        self.rate_controller.acquire(HOST)
+        self.rate_controller.release(HOST, status_code, latency, retry_after)
+
+    def test_additive_increase(self):
+        limits = []
+
+        for i in range(8):
+            self.request()
+            limits.append(int(self.state.limit))
+
+        # About one more after as many responses as the limit, up to
+        # max_in_flight
+        self.assertEqual(limits, [2, 2, 2, 3, 3, 3, 4, 4])
+
+    def test_multiplicative_decrease(self):
+        while self.state.limit < 4:
+            self.request(latency=1.0)
+
+        self.request(status_code=503, latency=1.0)
+        self.assertEqual(self.state.limit, 2)
+
+        # The responses of the requests sent before the decrease don't count
+        self.state.next_time = 0
+        self.request(status_code=None)
+        self.assertEqual(self.state.limit, 2)
+
+        self.state.decreased_at -= 1.0
+        self.state.next_time = 0
+        self.request(status_code=None)
+        self.assertEqual(self.state.limit, 1)
+
+        self.state.decreased_at -= 1.0
+        self.request(status_code=500)
+        self.assertEqual(self.state.limit, 1)
+
+    def test_slow_responses_decrease_the_limit(self):
+        while self.state.limit < 4:
+            self.request(latency=0.01)
+
+        self.request(latency=0.01 * Rate_Controller.LATENCY_FACTOR * 2)
+        self.assertEqual(self.state.limit, 2)
+
+    def test_retry_after(self):
+        self.request(status_code=429, retry_after="2")
+
+        self.assertAlmostEqual(self.state.next_time - time.time(), 2, delta=0.5)
+        self.assertEqual(self.state.throttled, 1)
+
+        # Capped
+        self.state.next_time = 0
+        self.request(status_code=503, retry_after="100000")
+        self.assertAlmostEqual(self.state.next_time - time.time(), Rate_Controller.MAX_WAIT, delta=0.5)
+
+    def test_backoff_without_retry_after(self):
+        waits = []
+
+        for i in range(3):
+            self.state.next_time = 0
+            self.request(status_code=429)
+            waits.append(round(self.state.next_time - time.time()))
+
+        self.assertEqual(waits, [Rate_Controller.BACKOFF, Rate_Controller.BACKOFF * 2, Rate_Controller.BACKOFF * 4])
+
+        # A success resets the backoff
+        self.state.next_time = 0
+        self.request()
+        self.state.next_time = 0
+        self.request(status_code=429)
+        self.assertEqual(round(self.state.next_time - time.time()), Rate_Controller.BACKOFF)
+
+    def test_requests_in_flight(self):
+        acquired = threading.Event()
+
+        def acquire():
+            self.rate_controller.acquire(HOST)
+            acquired.set()
+
+        self.rate_controller.acquire(HOST)
+
+        thread = threading.Thread(target=acquire)
+        thread.daemon = True
+        thread.start()
+
+        # The limit starts at one request in flight
+        self.assertFalse(acquired.wait(0.2))
+
+        self.rate_controller.release(HOST, 200, 0.01)
+        self.assertTrue(acquired.wait(5))
+
+        thread.join()
+
+    def test_max_rate(self):
+        rate_controller = Rate_Controller(max_in_flight=4, max_rate=10)
+
+        start = time.time()
+        for i in range(4):
+            rate_controller.acquire(HOST)
+            rate_controller.release(HOST, 200, 0.01)
+
+        self.assertGreaterEqual(time.time() - start, 0.3 - 0.05)
+
+
+class Test_Retry_After(unittest.TestCase):
+
+    def test_seconds(self):
+        self.assertEqual(retry_after_seconds("120"), 120)
+        self.assertEqual(retry_after_seconds(" 0 "), 0)
+
+    def test_date(self):
+        date = email.utils.formatdate(time.time() + 60, usegmt=True)
+        self.assertAlmostEqual(retry_after_seconds(date), 60, delta=2)
+
+        # In the past
+        self.assertEqual(retry_after_seconds("Wed, 21 Oct 2015 07:28:00 GMT"), 0)
+
+    def test_not_valid(self):
+        self.assertIsNone(retry_after_seconds(None))
+        self.assertIsNone(retry_after_seconds("soon"))
+
+
+if __name__ == '__main__':
+    unittest.main()
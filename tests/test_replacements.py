@@ -0,0 +1,95 @@
+"""Custom replacements and the merging of their rules."""
+
+import re
+import random
+import unittest
+
+import save_webpage
+from save_webpage import Replacement_Rules
+
+
+def apply_in_order(rules, content):
+    for rule in rules:
+        if callable(rule):
+            content = rule(content)
+        else:
+            pattern_text, substitution = rule
+            content = re.sub(pattern_text, substitution, content)
+
+    return content
+
+
+def random_text(rng, alphabet, min_length, max_length):
+    return "".join(rng.choice(alphabet) for i in range(rng.randint(min_length, max_length)))
+
+
+class Test_Replacement_Rules(unittest.TestCase):
+
+    def test_same_result_than_rules_in_order(self):
+        rng = random.Random(0)
+
+        other_rules = [("a+", "x"), ("(b)c", r"\1\1"), (lambda content: content.replace("c", "a")), ("b", lambda matchobj: "ab")]
+
+        for i in range(2000):
+            rules = []
+
+            for j in range(rng.randint(1, 6)):
+                if rng.random() < 0.1:
+                    rules.append(rng.choice(other_rules))
+                else:
+                    rules.append((random_text(rng, "abc", 1, 3), random_text(rng, "abcd", 0, 3)))
+
+            replacement_rules = Replacement_Rules([("/", rules)])
+
+            for k in range(5):
+                content = random_text(rng, "abcd", 0, 20)
+                self.assertEqual(replacement_rules.apply("/", content), apply_in_order(rules, content), (rules, content))
+
+    def test_merged_rules(self):
+        self.assertEqual(len(Replacement_Rules._compile_rules([("foo", "bar"), ("baz", "qux"), ("<b>", "<strong>")])), 1)
+
+        # Occurrences which overlap
+        self.assertEqual(len(Replacement_Rules._compile_rules([("ab", "x"), ("bc", "y")])), 2)
+        self.assertEqual(len(Replacement_Rules._compile_rules([("ab", "x"), ("b", "y")])), 2)
+
+        # A substitution forms an occurrence of the next pattern
+        self.assertEqual(len(Replacement_Rules._compile_rules([("a", "b"), ("b", "c")])), 2)
+        self.assertEqual(len(Replacement_Rules._compile_rules([("x", "a"), ("ab", "c")])), 2)
+
+        # Regular expressions are not merged
+        self.assertEqual(len(Replacement_Rules._compile_rules([("foo", "bar"), ("b.z", "qux"), ("baz", "qux")])), 3)
+        self.assertEqual(len(Replacement_Rules._compile_rules([("foo", "bar"), ("baz", r"\g<0>")])), 2)
+
+    def test_commutes(self):
+        self.assertTrue(save_webpage._commutes([("foo", "bar")], "baz", "qux"))
+
+        self.assertFalse(save_webpage._commutes([("foo", "bar")], "oo", "x"))
+        self.assertFalse(save_webpage._commutes([("foo", "bar")], "ob", "x"))
+        self.assertFalse(save_webpage._commutes([("foo", "bar")], "ar", "x"))
+        self.assertFalse(save_webpage._commutes([("a", "b")], "bc", "x"))
+
+        # The new substitution comes after the rules of the group
+        self.assertTrue(save_webpage._commutes([("foo", "bar")], "x", "fo"))
+
+    def test_literal_alternation(self):
+        rng = random.Random(0)
+
+        for i in range(500):
+            literals = set(random_text(rng, "ab.", 1, 4) for j in range(rng.randint(1, 5)))
+            regex = re.compile("(?:%s)\\Z" % save_webpage.literal_alternation(literals))
+
+            for j in range(20):
+                text = random_text(rng, "ab.", 1, 4)
+                self.assertEqual(regex.match(text) is not None, text in literals, (literals, text))
+
+    def test_first_matching_url_path(self):
+        for replacements in ([("/a/", [("x", "1")]), ("/", [("x", "2")])], [("/(a)/", [("x", "1")]), ("/", [("x", "2")])]):
+            replacement_rules = Replacement_Rules(replacements)
+
+            self.assertEqual(replacement_rules.apply("/a/page.html", "x"), "1")
+            self.assertEqual(replacement_rules.apply("/b/page.html", "x"), "2")
+            self.assertEqual(replacement_rules.apply("page.html", "x"), "x")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,95 @@
+"""Stats of the stages of a crawl."""
+
+import os
+import re
+import json
+import time
+import shutil
+import tempfile
+import unittest
+
+from save_webpage import Crawl_Stats, HTML_FILE, IMAGE_FILE
+
+
+PROMETHEUS_SAMPLE_RE = re.compile(r'^([a-z_]+)(?:\{((?:[a-z_]+="[^"]*",?)*)\})? (-?[0-9.e+-]+)$')
+
+
+def parse_prometheus(content):
+    '''Return a dict mapping the (name, labels) of every sample to its value,
+    checking that every metric declares its type before its samples.'''
+
+    types = {}
+    samples = {}
+
+    for line in content.splitlines():
+        if line.startswith("# TYPE "):
+            name, metric_type = line[len("# TYPE "):].split()
+            types[name] = metric_type
+        elif line.startswith("#"):
+            continue
+        else:
+            match = PROMETHEUS_SAMPLE_RE.match(line)
+            assert match is not None, line
+
+            name, labels, value = match.groups()
+            assert name in types, name
+
+            samples[(name, labels or "")] = float(value)
+
+    return samples
+
+
+class Test_Crawl_Stats(unittest.TestCase):
+
+    def setUp(self):
+        self.stats = Crawl_Stats()
+
+        with self.stats.stage("download", HTML_FILE):
+            time.sleep(0.01)
+
+        self.stats.add_time("write", IMAGE_FILE, 0.5)
+        self.stats.count("resources", HTML_FILE)
+        self.stats.count("bytes", HTML_FILE, 100)
+        self.stats.count("resources", IMAGE_FILE)
+
+    def test_as_dict(self):
+        stats = self.stats.as_dict()
+
+        self.assertGreater(stats["stages"]["download"]["html"], 0.005)
+        self.assertEqual(stats["stages"]["write"], {"image": 0.5})
+        self.assertEqual(stats["stages"]["parse"], {})
+
+        self.assertEqual(stats["resources"]["html"], {"resources": 1, "bytes": 100, "errors": 0, "cache_hits": 0, "not_modified": 0})
+        self.assertEqual(stats["resources"]["image"]["resources"], 1)
+
+    def test_as_prometheus(self):
+        samples = parse_prometheus(self.stats.as_prometheus())
+
+        self.assertIn(("save_webpage_wall_seconds", ""), samples)
+        self.assertEqual(samples[("save_webpage_stage_seconds_total", 'stage="write",type="image"')], 0.5)
+        self.assertEqual(samples[("save_webpage_bytes_total", 'type="html"')], 100)
+        self.assertEqual(samples[("save_webpage_errors_total", 'type="image"')], 0)
+
+    def test_summary(self):
+        self.assertEqual(self.stats.summary()[-1], "image: resources 1, bytes 0, errors 0, cache_hits 0, not_modified 0")
+
+    def test_dump(self):
+        directory = tempfile.mkdtemp(prefix="save_webpage_test.")
+
+        try:
+            self.stats.dump(os.path.join(directory, "stats.json"))
+            self.stats.dump(os.path.join(directory, "stats.prom"))
+
+            self.assertEqual(sorted(os.listdir(directory)), ["stats.json", "stats.prom"])
+
+            with open(os.path.join(directory, "stats.json")) as f:
+                self.assertEqual(json.load(f)["resources"]["html"]["bytes"], 100)
+
+            with open(os.path.join(directory, "stats.prom")) as f:
+                self.assertEqual(parse_prometheus(f.read())[("save_webpage_resources_total", 'type="html"')], 1)
+        finally:
+            shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    unittest.main()
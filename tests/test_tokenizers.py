@@ -0,0 +1,132 @@
+# -*- coding: utf-8 -*-
+
+"""Tokenizers of stylesheets, html and urls."""
+
+import doctest
+import unittest
+
+import urltools
+import save_webpage
+from save_webpage import Save_Webpage, CSS_FILE, IMAGE_FILE, FONT_FILE
+
+
+STYLESHEET = u'''@import "a.css"; @import url(b.css) screen;
+/* url(comment.png) */ .x { content: "url(string.png)"; background: url( 'c.png' ) }
+.y { background-image: image-set("d.png" 1x, url(e.png) 2x) }
+.z { background: url(data:image/png;base64,AAAA) }
+.w { background: url(f\\(1\\).png) }
+@font-face { src: url("g.woff2") format("woff2") }'''
+
+
+def load_tests(loader, tests, pattern):
+    tests.addTests(doctest.DocTestSuite(urltools, optionflags=doctest.ELLIPSIS))
+    return tests
+
+
+class Test_CSS_Tokenizer(unittest.TestCase):
+
+    def test_urls(self):
+        urls = [(css_url.type, css_url.url) for css_url in save_webpage.iter_css_urls(STYLESHEET)]
+
+        self.assertEqual(urls, [
+            (CSS_FILE, u"a.css"),
+            (CSS_FILE, u"b.css"),
+            (IMAGE_FILE, u"c.png"),
+            (IMAGE_FILE, u"d.png"),
+            (IMAGE_FILE, u"e.png"),
+            (IMAGE_FILE, u"f(1).png"),
+            (FONT_FILE, u"g.woff2")])
+
+    def test_positions(self):
+        for css_url in save_webpage.iter_css_urls(STYLESHEET):
+            raw_url = STYLESHEET[css_url.start:css_url.end]
+
+            self.assertEqual(save_webpage.css_unescape(raw_url), css_url.url)
+
+    def test_only_urls_are_replaced(self):
+        new_stylesheet = save_webpage.process_urls_in_css_content(STYLESHEET, lambda type_of_resource, url: u"new/" + url)
+
+        self.assertIn(u'@import "new/a.css"', new_stylesheet)
+        self.assertIn(u"url( 'new/c.png' )", new_stylesheet)
+        self.assertIn(u'image-set("new/d.png" 1x, url(new/e.png) 2x)', new_stylesheet)
+        self.assertIn(u"/* url(comment.png) */", new_stylesheet)
+        self.assertIn(u'"url(string.png)"', new_stylesheet)
+        self.assertIn(u"url(data:image/png;base64,AAAA)", new_stylesheet)
+
+        # The new url needs quotes
+        self.assertIn(u'url("new/f(1).png")', new_stylesheet)
+
+    def test_unchanged_stylesheet(self):
+        self.assertEqual(save_webpage.process_urls_in_css_content(STYLESHEET, lambda type_of_resource, url: None), STYLESHEET)
+
+
+class Test_HTML_Tokenizer(unittest.TestCase):
+
+    def test_start_tags(self):
+        content = u'''<!-- <img src="comment.png"> --><P a=1 B="x &amp; y" c><style>a{}</style><img src='q.png'>'''
+
+        tags = list(save_webpage.iter_html_start_tags(content))
+
+        self.assertEqual([(tag_name, text_span) for tag_name, attrs, text_span in tags], [(u"p", None), (u"style", (content.index(u"a{}"), content.index(u"</style>"))), (u"img", None)])
+
+        attrs = tags[0][1]
+        self.assertEqual(attrs[u"a"].value, u"1")
+        self.assertEqual(attrs[u"b"].value, u"x & y")
+        self.assertEqual(content[attrs[u"b"].start:attrs[u"b"].end], u'"x &amp; y"')
+        self.assertEqual(attrs[u"c"].value, u"")
+
+    def test_stream_rewriter_preserves_the_rest_of_the_page(self):
+        content = u'''<IMG  SRC = "a.png"   alt=x><a href=b.html  class='y'>b</a><img srcset="a.png 1x, /img 2x">'''
+
+        new_content = save_webpage.process_urls_in_html_stream(content, lambda type_of_resource, url: u"new/" + url if url == u"a.png" else None)
+
+        self.assertEqual(new_content, content.replace(u"a.png", u"new/a.png"))
+
+    def test_srcset(self):
+        self.assertIsNone(save_webpage.process_urls_in_srcset(u"a.png 1x, /img 2x", IMAGE_FILE, lambda type_of_resource, url: url))
+        self.assertEqual(save_webpage.process_urls_in_srcset(u"a.png 1x, /img 2x", IMAGE_FILE, lambda type_of_resource, url: u"img" if url == u"/img" else None), u"a.png 1x, img 2x")
+        self.assertEqual(save_webpage.process_urls_in_srcset(u" a.png 1x ,b.png", IMAGE_FILE, lambda type_of_resource, url: u"new/" + url), u" new/a.png 1x ,new/b.png")
+
+
+class Test_Batch_Urls(unittest.TestCase):
+
+    URLS = [
+        u"hTtp://ExAMPLe.COM:80",
+        u"http://example.com/a/../b",
+        u"https://example.com:443/%7Euser/?b=2&a=1#frag",
+        u"http://www.example.co.uk/a b",
+        u"http://example.com/a/../b",
+        u"mailto:someone@example.com",
+        u"relative/path?x=1",
+        u"",
+    ]
+
+    def test_normalize_many(self):
+        self.assertEqual(urltools.normalize_many(self.URLS), [urltools.normalize(url) for url in self.URLS])
+
+    def test_split_many(self):
+        self.assertEqual(urltools.split_many(self.URLS), [tuple(urltools.split(url)) for url in self.URLS])
+
+
+class Test_Url_Resolution(unittest.TestCase):
+
+    def test_cache_counters(self):
+        save_webpage = Save_Webpage(["http://example.com/"], mode=Save_Webpage.RELATIVE_MODE)
+        resolution_cache = save_webpage._resolution_cache
+
+        base_url = u"http://example.com/pages/"
+        links = [(IMAGE_FILE, u"a.png", base_url), (IMAGE_FILE, u"a.png", base_url), (IMAGE_FILE, u"/b.png", base_url)]
+
+        save_webpage._resolve_links(links)
+        self.assertEqual((resolution_cache.hits, resolution_cache.misses), (1, 2))
+
+        # The links are handled after they are resolved
+        self.assertEqual(save_webpage._resolve_url(u"a.png", base_url)[0], u"http://example.com/pages/a.png")
+        self.assertEqual((resolution_cache.hits, resolution_cache.misses), (1, 2))
+
+        save_webpage._resolve_links(links)
+        self.assertEqual((resolution_cache.hits, resolution_cache.misses), (4, 2))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+
+"""Indexes of the urls and paths visited by a crawl."""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from save_webpage import Visited_Index, Bloom_Visited_Index
+
+
+class Small_Bloom_Visited_Index(Bloom_Visited_Index):
+    # Most lookups of keys not in the index are false positives of the filter
+    CAPACITY = 10
+
+
+class Test_Visited_Index(unittest.TestCase):
+
+    visited_index_class = Visited_Index
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp(prefix="save_webpage_test.")
+        self.visited_index = self.visited_index_class(os.path.join(self.directory, "visited"))
+
+    def tearDown(self):
+        self.visited_index.close()
+        shutil.rmtree(self.directory)
+
+    def test_keys(self):
+        keys = [u"http://example.com/%d" % i for i in range(1000)] + [u"http://example.com/\xedndice"]
+
+        for key in keys[::2]:
+            self.visited_index.add(key)
+
+        # Added twice
+        self.visited_index.add(keys[0])
+
+        self.assertEqual(len(self.visited_index), len(keys[::2]))
+
+        for key in keys[::2]:
+            self.assertIn(key, self.visited_index)
+
+        for key in keys[1::2]:
+            self.assertNotIn(key, self.visited_index)
+
+        # Unicode and UTF-8 keys are the same
+        self.assertIn(keys[-1].encode("utf-8"), self.visited_index)
+
+    def test_discard(self):
+        self.visited_index.add(u"a")
+        self.visited_index.discard(u"a")
+        self.visited_index.discard(u"b")
+
+        self.assertNotIn(u"a", self.visited_index)
+        self.assertEqual(len(self.visited_index), 0)
+
+
+class Test_Bloom_Visited_Index(Test_Visited_Index):
+
+    visited_index_class = Small_Bloom_Visited_Index
+
+    def test_files(self):
+        path = os.path.join(self.directory, "visited")
+        self.assertTrue(os.path.isfile(path))
+
+        self.visited_index.close()
+        self.assertFalse(os.path.exists(path))
+
+        # Left by a crawl which was killed
+        with open(path, "wb") as f:
+            f.write(b"old")
+
+        self.visited_index = self.visited_index_class(path)
+        self.assertEqual(len(self.visited_index), 0)
+        self.assertNotIn(u"old", self.visited_index)
+
+    def test_memory_usage_doesnt_grow(self):
+        memory_usage = self.visited_index.memory_usage()
+
+        for i in range(1000):
+            self.visited_index.add(u"http://example.com/%d" % i)
+
+        self.assertEqual(self.visited_index.memory_usage(), memory_usage)
+
+
+if __name__ == '__main__':
+    unittest.main()
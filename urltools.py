@@ -4,38 +4,34 @@ from collections import namedtuple
 from posixpath import normpath
 
 try:
-    from urllib.request import urlopen
     from urllib.parse import quote
-    unicode = str
 except:
-    from urllib import urlopen
     from urllib import quote
 
 
 __version__ = '0.3.2'
 
 __all__ = ['URL', 'SplitResult', 'parse', 'extract', 'construct', 'normalize',
-           'compare', 'normalize_host', 'normalize_path', 'normalize_query',
-           'normalize_fragment', 'encode', 'unquote', 'split', 'split_netloc',
-           'split_host']
+           'normalize_many', 'compare', 'normalize_host', 'normalize_path',
+           'normalize_query', 'normalize_fragment', 'encode', 'unquote',
+           'split', 'split_many', 'split_netloc', 'split_host']
 
 
-PSL_URL = 'https://publicsuffix.org/list/effective_tld_names.dat'
+PSL_URL = 'https://publicsuffix.org/list/public_suffix_list.dat'
+PSL_SNAPSHOT = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                            'public_suffix_list.dat')
 
 
 def _get_public_suffix_list():
     """Return a set containing all Public Suffixes.
 
-    If the env variable PUBLIC_SUFFIX_LIST does not point to a local copy of the
-    public suffix list it is downloaded into memory each time urltools is
-    imported.
+    The list is read from the file in the env variable PUBLIC_SUFFIX_LIST or,
+    if it is not set, from the snapshot bundled with urltools. Refresh the
+    snapshot downloading PSL_URL.
     """
-    local_psl = os.environ.get('PUBLIC_SUFFIX_LIST')
-    if local_psl:
-        with codecs.open(local_psl, 'r', 'utf-8') as f:
-            psl_raw = f.readlines()
-    else:
-        psl_raw = unicode(urlopen(PSL_URL).read(), 'utf-8').split('\n')
+    local_psl = os.environ.get('PUBLIC_SUFFIX_LIST') or PSL_SNAPSHOT
+    with codecs.open(local_psl, 'r', 'utf-8') as f:
+        psl_raw = f.readlines()
     psl = set()
     for line in psl_raw:
         item = line.strip()
@@ -43,8 +39,35 @@ def _get_public_suffix_list():
             psl.add(item)
     return psl
 
-PSL = _get_public_suffix_list()
-assert len(PSL) > 0, 'Public Suffix List is empty!'
+
+# Key of the trie nodes which end a rule. Its value is '!' for exceptions.
+_RULE = None
+_psl_trie = None
+
+
+def _get_public_suffix_trie():
+    """Return the Public Suffix List as a trie of reversed labels.
+
+    The list is only loaded the first time it is needed.
+
+    >>> _get_public_suffix_trie()['uk']['co'][None]
+    ''
+    """
+    global _psl_trie
+    if _psl_trie is None:
+        trie = {}
+        for rule in _get_public_suffix_list():
+            kind = ''
+            if rule.startswith('!'):
+                kind = '!'
+                rule = rule[1:]
+            node = trie
+            for label in reversed(rule.split('.')):
+                node = node.setdefault(label, {})
+            node[_RULE] = kind
+        assert len(trie) > 0, 'Public Suffix List is empty!'
+        _psl_trie = trie
+    return _psl_trie
 
 
 SCHEMES = ['http', 'https', 'ftp', 'sftp', 'file', 'gopher', 'imap', 'mms',
@@ -81,30 +104,80 @@ def normalize(url):
     >>> normalize('hTtp://ExAMPLe.COM:80')
     'http://example.com/'
     """
+    return _normalize(url, {}, {})
+
+
+def normalize_many(urls):
+    """Normalize a batch of URLs.
+
+    Return a list with the normalized URLs in the same order. Repeated URLs,
+    and hosts, ports and paths shared by several URLs, are only normalized
+    once.
+
+    >>> normalize_many(['hTtp://ExAMPLe.COM:80', 'http://example.com/a/../b'])
+    ['http://example.com/', 'http://example.com/b']
+    """
+    authorities = {}
+    paths = {}
+    results = {}
+    normalized_urls = []
+    for url in urls:
+        normalized_url = results.get(url)
+        if normalized_url is None:
+            normalized_url = results[url] = _normalize(url, authorities, paths)
+        normalized_urls.append(normalized_url)
+    return normalized_urls
+
+
+def _normalize(url, authorities, paths):
+    """Normalize a URL reusing the normalized authorities (keyed by scheme and
+    netloc) and paths of previous URLs."""
     url = url.strip()
     if url == '':
         return ''
-    parts = split(url)
-    if parts.scheme:
-        netloc = parts.netloc
-        if parts.scheme in SCHEMES:
-            path = normalize_path(parts.path)
-        else:
-            path = parts.path
+    scheme, netloc, path, query, fragment = _split(url)
+    if scheme:
+        if scheme in SCHEMES:
+            npath = paths.get(path)
+            if npath is None:
+                npath = paths[path] = normalize_path(path)
+            path = npath
     # url is relative, netloc (if present) is part of path
     else:
-        netloc = parts.path
+        netloc = path
         path = ''
         if '/' in netloc:
             netloc, path_raw = netloc.split('/', 1)
             path = normalize_path('/' + path_raw)
+    authority = authorities.get((scheme, netloc))
+    if authority is None:
+        authority = authorities[(scheme, netloc)] = _normalize_authority(
+            scheme, netloc)
+    nurl = ''
+    if scheme:
+        if scheme in SCHEMES:
+            nurl += scheme + '://'
+        else:
+            nurl += scheme + ':'
+    nurl += authority
+    if path:
+        nurl += path
+    query = normalize_query(query)
+    if query:
+        nurl += '?' + query
+    fragment = normalize_fragment(fragment)
+    if fragment:
+        nurl += '#' + fragment
+    return nurl
+
+
+def _normalize_authority(scheme, netloc):
+    """Return the normalized user info, host and port of a netloc."""
     username, password, host, port = split_netloc(netloc)
     host = normalize_host(host)
-    port = _normalize_port(parts.scheme, port)
-    query = normalize_query(parts.query)
-    fragment = normalize_fragment(parts.fragment)
-    return construct(URL(parts.scheme, username, password, None, host, None,
-                         port, path, query, fragment, None))
+    port = _normalize_port(scheme, port)
+    return construct(URL('', username, password, None, host, None, port, '',
+                         '', '', None))
 
 
 def compare(url1, url2):
@@ -316,6 +389,30 @@ def split(url):
     >>> split('http://www.example.com/abc?x=1&y=2#foo')
     SplitResult(scheme='http', netloc='www.example.com', path='/abc', query='x=1&y=2', fragment='foo')
     """
+    return SplitResult(*_split(url))
+
+
+def split_many(urls):
+    """Split a batch of URLs like split().
+
+    Return a list of plain (scheme, netloc, path, query, fragment) tuples in
+    the same order. Repeated URLs are only split once.
+
+    >>> split_many(['http://example.com/a?x=1', 'b#c'])
+    [('http', 'example.com', '/a', 'x=1', ''), ('', '', 'b', '', 'c')]
+    """
+    results = {}
+    parts = []
+    for url in urls:
+        result = results.get(url)
+        if result is None:
+            result = results[url] = _split(url)
+        parts.append(result)
+    return parts
+
+
+def _split(url):
+    """Split URL into a (scheme, netloc, path, query, fragment) tuple."""
     scheme = netloc = path = query = fragment = ''
     ip6_start = url.find('[')
     scheme_end = url.find(':')
@@ -367,7 +464,7 @@ def split(url):
     if not scheme:
         path = netloc + path
         netloc = ''
-    return SplitResult(scheme, netloc, path, query, fragment)
+    return scheme, netloc, path, query, fragment
 
 
 def _clean_netloc(netloc):
@@ -419,23 +516,34 @@ def split_host(host):
     else:
         return '', host, ''
     # host is a domain name
-    domain = subdomain = tld = ''
+    domain = subdomain = ''
     parts = host.split('.')
-    for i in range(len(parts)):
-        tld = '.'.join(parts[i:])
-        wildcard_tld = '*.' + tld
-        exception_tld = '!' + tld
-        if exception_tld in PSL:
-            domain = '.'.join(parts[:i+1])
-            tld = '.'.join(parts[i+1:])
-            break
-        if tld in PSL:
-            domain = '.'.join(parts[:i])
-            break
-        if wildcard_tld in PSL:
-            domain = '.'.join(parts[:i-1])
-            tld = '.'.join(parts[i-1:])
+    # Walk the trie from the last label: the longest matching rule wins and,
+    # for the same suffix, an exception wins over a rule and a rule over a
+    # wildcard.
+    match = None
+    node = _get_public_suffix_trie()
+    for i in range(len(parts) - 1, -1, -1):
+        node = node.get(parts[i])
+        if node is None:
             break
+        kind = node.get(_RULE)
+        if kind == '!':
+            match = (i, '!')
+        elif kind is not None:
+            match = (i, '')
+        elif _RULE in node.get('*', ()):
+            match = (i, '*')
+    if match is None:
+        tld = parts[-1]
+    else:
+        i, kind = match
+        if kind == '!':
+            i += 1
+        elif kind == '*':
+            i -= 1
+        domain = '.'.join(parts[:i])
+        tld = '.'.join(parts[i:])
     if '.' in domain:
         subdomain, domain = domain.rsplit('.', 1)
     return subdomain, domain, tld